@@ -5,60 +5,44 @@ import numpy as np
 import time
 import seaborn as sns
 
+from datasets.attention_masks import pad_attention_masks
+from plot_service import plot_inputs
+
 
 def select_non_zero_attention_masks(attention_masks):
     """
     This function checks how many attention masks there are per batch
     It also maps pixels outside the mask to negative values. Every mask will receive a different negative value
     such that there will be no overlap between the masks
+    attention_masks: [batch, masks, 192, 640] binary attention masks, updated in place
     """
 
-    amount_attention_masks = {}
-
-    # create an empty dictionary where you save what the size is of every attention masks. this will be used later on
-    # for determening the weight per attention mask
-    size_attention_masks_all_batches = {}
-    size_per_batch = {}
-
-    for b in range(attention_masks.shape[0]):
-        amount_attention_masks[b] = None
-
-        size_attention_masks_all_batches[b] = None
-
-        for m in range(attention_masks.shape[1]):
-            size_per_batch[m] = None
-
-        size_attention_masks_all_batches[b] = size_per_batch
-
-
+    # size of every attention mask in one reduction, [batch, masks]
+    mask_sizes = attention_masks.sum(-1).sum(-1)
+    empty_masks = mask_sizes == 0
 
-    # loop over batches
-    for b in range(attention_masks.shape[0]):
+    # pixels outside mask m get -m - 1, all pixels of masks which are not found get -999
+    fill_values = -torch.arange(1, attention_masks.shape[1] + 1, dtype=attention_masks.dtype, device=attention_masks.device)
+    fill_values = torch.where(empty_masks, torch.full_like(fill_values, -999), fill_values)
 
+    # the masks are binary (every caller thresholds them at 0.8 first), so 1 stays 1 and 0 becomes the fill value.
+    # done in place with a multiply and add instead of a torch.where, which needs two full size temporaries
+    fill_values = fill_values.unsqueeze(-1).unsqueeze(-1)
+    attention_masks.mul_(1 - fill_values).add_(fill_values)
 
+    amount_attention_masks = {}
 
-        # loop over the attention masks per batch
-        for mask in range(attention_masks.shape[1]):
-
-            # then there is no attention mask found for this image
-            if attention_masks[b][mask].sum() == 0:
-
-                # add inf such that when you do sorting later on these values will be add the end after sorting
-                size_attention_masks_all_batches[b][mask] = float('inf')
-
-                # only add the first number per batch because then the oter number from there are also no attention masks
-                # this is the number of how many attention masks there are found per batch
-                if amount_attention_masks[b] == None:
-                    amount_attention_masks[b] = mask
-
-                attention_masks[b][mask][attention_masks[b][mask] == 0] = -999
+    # create a dictionary where you save what the size is of every attention masks. this will be used later on
+    # for determening the weight per attention mask
+    size_attention_masks_all_batches = {}
 
-            else:
+    for b, (sizes, empty) in enumerate(zip(mask_sizes.tolist(), empty_masks.tolist())):
 
-                # add the size of the attention mask to the dictionary
-                size_attention_masks_all_batches[b][mask] = attention_masks[b][mask].sum().item()
+        # the number of the first mask which is not found is how many attention masks there are found per batch
+        amount_attention_masks[b] = empty.index(True) if True in empty else None
 
-                attention_masks[b][mask][attention_masks[b][mask] == 0] = -mask - 1
+        # add inf such that when you do sorting later on these values will be add the end after sorting
+        size_attention_masks_all_batches[b] = {mask: float('inf') if empty[mask] else size for mask, size in enumerate(sizes)}
 
     return attention_masks, amount_attention_masks, size_attention_masks_all_batches
 
@@ -75,6 +59,9 @@ def find_not_overlapping_masks(self, inputs, attention_masks, amount_attention_m
 
     all_not_overlapping_masks = []
 
+    # which masks overlap with each other, computed once for all the greedy picks below
+    overlap = mask_overlap_matrix(attention_masks)
+
     # loop over the batches
     for batch in range(attention_masks.shape[0]):
 
@@ -101,7 +88,7 @@ def find_not_overlapping_masks(self, inputs, attention_masks, amount_attention_m
             other_masks = all_masks_loop_list
 
             # find which masks are all overlapping which current mask (choice_mask).
-            overlapping_masks = find_overlapping_tensors(batch, choice_mask, other_masks, attention_masks)
+            overlapping_masks = find_overlapping_tensors(batch, choice_mask, other_masks, overlap)
 
             # add the current mask to the not overlapping mask
             not_overlapping_masks.append(choice_mask)
@@ -112,9 +99,9 @@ def find_not_overlapping_masks(self, inputs, attention_masks, amount_attention_m
             # remove also the current mask since you have checked thisone
             all_masks_loop_list = np.setdiff1d(all_masks_loop_list, choice_mask)
 
-        # fill the batch mask array with the not overlapping masks
-        for f in range(len(not_overlapping_masks)):
-            batch_masks[batch][f] = attention_masks[batch][not_overlapping_masks[f]]
+        # fill the batch mask array with the not overlapping masks, on the device of batch_masks
+        not_overlapping_index = torch.as_tensor(not_overlapping_masks, dtype=torch.long, device=attention_masks.device)
+        batch_masks[batch][:len(not_overlapping_masks)] = attention_masks[batch][not_overlapping_index].to(batch_masks.device)
 
 
         all_not_overlapping_masks.append(not_overlapping_masks)
@@ -233,7 +220,8 @@ def check_if_weight_is_applied_correctly(weight_per_mask, weight_assert):
 def overlapping_masks_edge_detection(self, inputs, batch_idx, original_attention_masks):
 
     # retrieve the attention masks which belong to the target frame
-    attention_masks = inputs['attention'].to(self.device)
+    # for ragged batches only padded up to the largest amount of masks in the batch
+    attention_masks = pad_attention_masks(inputs).to(self.device)
 
     # only keep the pixels which belong to the mask en reduce noise from the mask image
     attention_masks[attention_masks >= 0.8] = 1
@@ -276,6 +264,9 @@ def find_not_overlapping_masks_for_edge_detection(self, inputs, attention_masks,
     # print("DICHT", attention_size_dict)
     all_not_overlapping_masks = []
 
+    # which masks overlap with each other, computed once for all the greedy picks below
+    overlap = mask_overlap_matrix(attention_masks)
+
     # loop over the batches
     for batch in range(attention_masks.shape[0]):
 
@@ -300,7 +291,7 @@ def find_not_overlapping_masks_for_edge_detection(self, inputs, attention_masks,
             other_masks = all_masks_loop_list
 
             # find which masks are all overlapping which current mask (choice_mask).
-            overlapping_masks = find_overlapping_tensors(batch, choice_mask, other_masks, attention_masks)
+            overlapping_masks = find_overlapping_tensors(batch, choice_mask, other_masks, overlap)
 
             # add the current mask to the not overlapping mask
             not_overlapping_masks.append(choice_mask)
@@ -331,7 +322,8 @@ def attention_mask_weight(self, inputs, batch_idx, original_attention_masks, edg
     """
 
     # retrieve the attention masks which belong to the target frame
-    attention_masks = inputs['attention']
+    # for ragged batches only padded up to the largest amount of masks in the batch
+    attention_masks = pad_attention_masks(inputs)
 
     # only keep the pixels which belong to the mask en reduce noise from the mask image
     attention_masks[attention_masks >= 0.8] = 1
@@ -347,7 +339,8 @@ def attention_mask_weight(self, inputs, batch_idx, original_attention_masks, edg
 
 
     # empty tensor which will be filled later on with the not overlapping masks
-    batch_masks = torch.zeros(size=(attention_masks.shape[0], attention_masks.shape[1], 192, 640))
+    # on the training device, such that the mask weights below are computed there as well
+    batch_masks = torch.zeros(size=(attention_masks.shape[0], attention_masks.shape[1], 192, 640), device=self.device)
 
     # checks which masks are overlapping and returns the not overlapping tensors in batch masks.
     # all_not_overlapping_masks are the index numbers of the not overlapping masks
@@ -411,8 +404,13 @@ def attention_mask_weight(self, inputs, batch_idx, original_attention_masks, edg
     # plot every x steps an example of the weight matrix during training
     if batch_idx % self.opt.save_plot_every == 0:
         # only plot for one image .. so therefor the [0] index in all not overlapping masks
-        plot_attention_weight_loss_matrix(self, inputs, all_not_overlapping_masks[0], attention_masks,
-                                          original_attention_masks, weight_per_mask, batch_idx, weight_assert)
+        # only its not overlapping masks are sent to the plot, in the same order
+        not_overlapping_masks = torch.as_tensor(all_not_overlapping_masks[0], dtype=torch.long)
+        self.plot_service.submit(plot_attention_weight_loss_matrix, self, plot_inputs(inputs, 1),
+                                 list(range(len(not_overlapping_masks))),
+                                 attention_masks[:1, not_overlapping_masks.to(attention_masks.device)],
+                                 original_attention_masks[:1, not_overlapping_masks.to(original_attention_masks.device)],
+                                 weight_per_mask[:1], batch_idx, weight_assert[:1])
 
 
     # check if the weight are correctly multiplied against the attention_masks
@@ -420,41 +418,48 @@ def attention_mask_weight(self, inputs, batch_idx, original_attention_masks, edg
 
     return weight_per_mask
 
-def find_overlapping_tensors(batch, current_tensor, other_tensors, attention_masks):
+def mask_overlap_matrix(attention_masks):
     """
-    batch: INTEGER: current batch number
-    current_tensor: INTEGER: 1 specific tensor which you want to compare with other tensors
-    other_tensors: LIST OF INTEGERS: these are the tensor which will be compared with the current tensor
-    # attention_masks: tensor where the attention_masks are putted in.
-    The function checks if current tensor is having overlap with other tensors. It uses the batch, current_tensor
-    and other_tensors for indexing into the attention_masks
+    attention_masks: [batch, masks, 192, 640] tensor where the pixels inside a mask are 1 and the pixels outside
+    a mask a negative value per mask (see select_non_zero_attention_masks)
+    Returns a [batch, masks, masks] boolean numpy array telling which masks share at least one pixel. Per kitti image
+    this is the matrix product of the flattened masks, instead of comparing the masks pixel by pixel for every pick.
+    Like the torch.eq comparison, a mask overlaps with itself and the empty masks overlap with each other
     """
 
-    # build tensors where all the tensors can fit in such that you only have to do torch.eq once
-    a = torch.zeros(size = (len(other_tensors), 192, 640))
-    b = torch.zeros(size = (len(other_tensors), 192, 640))
+    overlap = torch.zeros(attention_masks.shape[0], attention_masks.shape[1], attention_masks.shape[1], dtype=torch.bool)
+
+    for batch in range(attention_masks.shape[0]):
+
+        # [masks, 192 * 640]
+        inside_masks = (attention_masks[batch] == 1).to(torch.float32).flatten(1)
+
+        # number of shared pixels between every two masks
+        shared_pixels = torch.mm(inside_masks, inside_masks.t())
 
-    # fill the tensors with the masks
-    for x in range(len(other_tensors)):
+        empty_masks = torch.diagonal(shared_pixels) == 0
 
-        # stack one tensor with only the current tensor
-        a[x] = attention_masks[batch][current_tensor]
+        overlap[batch] = ((shared_pixels > 0) | (empty_masks.unsqueeze(1) & empty_masks.unsqueeze(0))).cpu()
 
-        # stack other tensor with the tensors you want the current tensor to compare with
-        b[x] = attention_masks[batch][other_tensors[x]]
+    overlap |= torch.eye(attention_masks.shape[1], dtype=torch.bool)
 
-    # compare
-    result_torch_eq = torch.eq(a, b)
+    return overlap.numpy()
 
-    # count how many pixels ovelap there is between the two images
-    count_overlap_pixel = (result_torch_eq == True).nonzero()
 
-    # find which masks are overlapping (which mask numbers)
-    overlappers = np.array(count_overlap_pixel[:,0].unique())
+def find_overlapping_tensors(batch, current_tensor, other_tensors, overlap):
+    """
+    batch: INTEGER: current batch number
+    current_tensor: INTEGER: 1 specific tensor which you want to compare with other tensors
+    other_tensors: LIST OF INTEGERS: these are the tensor which will be compared with the current tensor
+    overlap: [batch, masks, masks] boolean array made by mask_overlap_matrix
+    The function checks if current tensor is having overlap with other tensors. It uses the batch, current_tensor
+    and other_tensors for indexing into the overlap matrix
+    """
+
     other_tensors = np.array(other_tensors)
 
     # select correct overlapping tensors
-    overlapping_tensors = other_tensors[overlappers]
+    overlapping_tensors = other_tensors[overlap[batch, current_tensor, other_tensors]]
 
     return overlapping_tensors
 
@@ -529,19 +534,7 @@ def determine_mask_weight(self, attention_masks):
 # weight_attention_mask", weight_attention_mask)
 
     # [batch, 1, 192, 640]
-    end_weight = torch.zeros(attention_masks.shape[0], 1, attention_masks.shape[2], attention_masks.shape[3])
-
-    # loop over batches and create per batch an torch . ones
-    for b in range(attention_masks.shape[0]):
-        ones = torch.ones(size=(attention_masks.shape[2], attention_masks.shape[3]))
-
-        # now loop over the masks within the batch
-        for mask in range(attention_masks.shape[1]):
-            # multiply the weights of the current weight mask by an empty ones
-            # in this way we will get 1 matrix combines of all the weights
-            current_ones = ones * weight_attention_mask[b][mask]
-            ones = ones + current_ones
-
-        end_weight[b] = ones
+    # combine the weights of all the masks in 1 matrix: the product of (1 + weight * mask) over the masks
+    end_weight = torch.prod(1 + weight_attention_mask, dim=1, keepdim=True)
 
     return end_weight, attention_weight_for_assert
@@ -4,6 +4,10 @@ import torch
 import numpy as np
 import time
 import seaborn as sns
+
+from datasets.attention_masks import pad_attention_masks
+from pre_process_weight_matrix import weight_matrix_from_masks
+from plot_service import plot_inputs
 import copy
 import itertools
 import matplotlib
@@ -126,6 +130,33 @@ def plot_loss_tensor(self, inputs, to_optimise, attention_mask_weight, batch_idx
     plt.close(fig)
 
 
+def plot_attention_masks(self, inputs, batch_idx):
+
+    path = self.opt.log_dir + self.opt.model_name + "/" + "weight_matrix_img/"
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    for b in range(self.opt.batch_size):
+        original_img = inputs["color_aug", 0, 0][b]
+
+        original_img = np.array(original_img.cpu().detach().numpy())
+
+        original_img = np.swapaxes(original_img, 0, 1)
+        original_img = np.swapaxes(original_img, 1, 2)
+
+        weight_mask = inputs['weight_matrix'][b].cpu()
+
+        fig, axis = plt.subplots(1, 2, figsize=(40, 5))
+
+        # create the heatmap
+        sns.heatmap(weight_mask, ax=axis[0], vmin=1, vmax=1.2, cmap='Greens', center=1)
+
+        # put the original rgb kitti image in the subplot
+        axis[1].imshow(original_img)
+        fig.savefig('{}/epoch_{}_batch_idx_{}_batch_{}.png'.format(path, self.epoch, batch_idx, b))
+        plt.close(fig)
+
+
 def determine_weight_matrix(self, overlap_per_pixel, weight_per_mask, attention_masks, method):
     """
     function that receives the an dict which tells which pixels have overlap with which masks
@@ -321,40 +352,49 @@ def calculate_weight_per_mask(self, attention_masks):
 
     return attention_weight_matrix
 
-def calculate_weight_matrix(self, inputs, batch_idx, original_masks):
-
-    start = time.time()
+def calculate_weight_matrix(self, inputs, batch_idx, original_masks, method='avg'):
+    """
+    Creates the [batch, 192, 640] weight matrix: pixels inside one or more attention masks get 1 + the avg, min or max
+    weight of those masks, all other pixels get 1. Same result as calculate_weight_matrix_pairwise, but with
+    reductions over the mask axis in O(batch * masks * 192 * 640) memory instead of comparing every pair of masks
+    """
 
-    attention_masks = inputs['attention'].to(self.device)
+    # for ragged batches only padded up to the largest amount of masks in the batch
+    attention_masks = pad_attention_masks(inputs).to(self.device)
 
-    # overlap per pixel is a dictionary telling you per pixel which attention masks have overlap there
     # weight per mask is an array of len amount attetnion masks. each number tells how much wheight that attention mask is
-    # 2 sec
-    overlap_per_pixel, weight_per_mask = check_overlap_per_pixel(self, attention_masks)
-    # print("START", start)
-    # time_overlap_per_pixel =  start - time.time()
+    # this also binarizes the attention masks
+    weight_per_mask = calculate_weight_per_mask(self, attention_masks).to(self.device)
 
-    # print("TIME OVERLAP PER PIXEL", time_overlap_per_pixel)
+    weight_matrix = weight_matrix_from_masks(attention_masks, weight_per_mask, method)
 
-    # now create the weight matrix
-    # 2 sec
-    weight_matrix =  determine_weight_matrix(self, overlap_per_pixel, weight_per_mask , attention_masks, method = 'avg').to(self.device)
+    if batch_idx % self.opt.save_plot_every == 0:
+        submit_weight_matrix_plot(self, inputs, attention_masks, original_masks, weight_per_mask, batch_idx, weight_matrix)
+
+    return weight_matrix
 
-    time_determine_weight_matrix =  start - time.time()
 
-    # print("time weight matrix", time_determine_weight_matrix)
+def calculate_weight_matrix_pairwise(self, inputs, batch_idx, original_masks, method='avg'):
+    """
+    The original implementation of calculate_weight_matrix which compares every pair of masks pixel by pixel.
+    Needs two [batch, masks * (masks - 1) / 2, 192, 640] tensors, only kept as reference for small inputs,
+    benchmarks/calculate_weight_matrix.py checks that both give the same weight matrix
+    """
+
+    # for ragged batches only padded up to the largest amount of masks in the batch
+    attention_masks = pad_attention_masks(inputs).to(self.device)
+
+    # overlap per pixel is a dictionary telling you per pixel which attention masks have overlap there
+    # weight per mask is an array of len amount attetnion masks. each number tells how much wheight that attention mask is
+    overlap_per_pixel, weight_per_mask = check_overlap_per_pixel(self, attention_masks)
 
+    # now create the weight matrix
+    weight_matrix = determine_weight_matrix(self, overlap_per_pixel, weight_per_mask, attention_masks, method).to(self.device)
 
-    # this one is quick 0.1 sec
     weight_matrix = determine_not_overlapping_masks(self, weight_matrix, attention_masks, weight_per_mask).to(self.device)
 
-    time_determine_not_overlap_pixel =  start - time.time()
     if batch_idx % self.opt.save_plot_every == 0:
-    # print("determine not overlap masks", time_determine_not_overlap_pixel)
-        plot_attention_weight_loss_matrix(self, inputs, attention_masks, original_masks, weight_per_mask, batch_idx, weight_matrix)
-
-    end = time.time() - start
-    print("TOTAL", end)
+        submit_weight_matrix_plot(self, inputs, attention_masks, original_masks, weight_per_mask, batch_idx, weight_matrix)
 
     return weight_matrix
 
@@ -412,11 +452,22 @@ def determine_not_overlapping_masks(self, weight_matrix, attention_masks, weight
     return weight_matrix
 
 
-def plot_attention_weight_loss_matrix(self, inputs, attention_masks, original_attention_masks, weight_per_mask, batch_idx, weight_matrix):
+def submit_weight_matrix_plot(self, inputs, attention_masks, original_masks, weight_per_mask, batch_idx, weight_matrix):
+    """
+    Per kitti image only as many masks as it has non zero masks are drawn, so the masks are counted here and
+    only the masks up to the largest count are sent to the plot
+    """
+    amount_masks = (attention_masks >= 0.8).flatten(2).any(-1).sum(1)
+    max_masks = int(amount_masks.max().item())
+
+    self.plot_service.submit(plot_attention_weight_loss_matrix, self, plot_inputs(inputs), amount_masks,
+                             original_masks[:, :max_masks], weight_per_mask[:, :max_masks], batch_idx, weight_matrix)
+
+
+def plot_attention_weight_loss_matrix(self, inputs, amount_masks, original_attention_masks, weight_per_mask, batch_idx, weight_matrix):
     """
     inputs: for selecting the original kitti image
-    not_overlapping_masks: list of index number where the masks not overlap
-    attention_masks: the tensor where the attention masks are in
+    amount_masks: the amount of non zero attention masks per kitti image
     original_attention_masks: untouched attention masks used for plotting
     weight_per_mask: used for plot title
     batch_idx: used for plot title
@@ -428,9 +479,6 @@ def plot_attention_weight_loss_matrix(self, inputs, attention_masks, original_at
     if not os.path.exists(path):
         os.makedirs(path)
 
-    attention_masks[attention_masks >= 0.8] = 1
-    attention_masks[attention_masks < 0.8] = 0
-
     for batch_nr in range(self.opt.batch_size):
 
 
@@ -446,11 +494,7 @@ def plot_attention_weight_loss_matrix(self, inputs, attention_masks, original_at
 
 
 # count how many non zero attention masks there are
-        plot_list = []
-        for mask in range(attention_masks.shape[1]):
-            current_mask = attention_masks[batch_nr][mask]
-            if current_mask.sum() != 0:
-                plot_list.append(current_mask)
+        plot_list = range(int(amount_masks[batch_nr]))
 
 
 
@@ -0,0 +1,76 @@
+"""Micro benchmark of calculate_weight_matrix against the pairwise implementation it replaced
+
+    python -m benchmarks.calculate_weight_matrix --batch_size 2 --amount_masks 6 --device cuda
+
+The pairwise version compares every pair of masks and loops over the overlapping pixels in python,
+so only small inputs are feasible
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+import argparse
+
+import torch
+
+from attention_weight_mask import calculate_weight_matrix, calculate_weight_matrix_pairwise
+from benchmarks.synthetic import make_opt, make_attention_masks, BenchmarkContext, NO_PLOT_BATCH_IDX
+
+
+METHODS = ["avg", "min", "max"]
+
+
+def time_function(function, context, attention_masks, method, repeats, device):
+    times = []
+    for _ in range(repeats):
+        # both versions binarize the masks of the inputs in place
+        masks = attention_masks.clone()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.time()
+        weight_matrix = function(context, {"attention": masks}, NO_PLOT_BATCH_IDX, attention_masks, method)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        times.append(time.time() - start)
+    return min(times), weight_matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="calculate_weight_matrix benchmark")
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--amount_masks", type=int, default=6)
+    parser.add_argument("--padding", type=int, help="zero masks after the masks, like the dataset pads", default=2)
+    parser.add_argument("--overlap", type=float, help="probability that a mask overlaps an earlier one", default=0.7)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--device", type=str, default="cpu")
+    opt = parser.parse_args()
+
+    device = torch.device(opt.device)
+    # calculate_weight_matrix_pairwise only works for 192 x 640 masks
+    train_opt = make_opt(batch_size=opt.batch_size, no_cuda=device.type != "cuda")
+    context = BenchmarkContext(train_opt, device)
+
+    torch.manual_seed(0)
+    cases = {
+        "overlapping masks": make_attention_masks(opt.batch_size, opt.amount_masks, train_opt.height, train_opt.width,
+                                                  device, opt.overlap, opt.padding),
+        "only zero masks": torch.zeros(opt.batch_size, opt.padding, train_opt.height, train_opt.width, device=device),
+        "no masks": torch.zeros(opt.batch_size, 0, train_opt.height, train_opt.width, device=device),
+    }
+
+    print("{:<18} {:<6} {:>14} {:>14} {:>9}".format("case", "method", "pairwise ms", "reductions ms", "speedup"))
+
+    for case, attention_masks in cases.items():
+        for method in METHODS:
+            pairwise_time, expected = time_function(calculate_weight_matrix_pairwise, context, attention_masks, method,
+                                                    opt.repeats, device)
+            reductions_time, result = time_function(calculate_weight_matrix, context, attention_masks, method,
+                                                    opt.repeats, device)
+
+            assert torch.equal(expected, result), "{} weight matrix of {} differs".format(method, case)
+
+            print("{:<18} {:<6} {:>14.2f} {:>14.2f} {:>8.1f}x".format(
+                case, method, pairwise_time * 1000, reductions_time * 1000, pairwise_time / reductions_time))
+
+
+if __name__ == "__main__":
+    main()
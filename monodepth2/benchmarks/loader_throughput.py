@@ -0,0 +1,155 @@
+"""Throughput of the KITTIRAWDataset dataloader on a tree made by benchmarks.synthetic_kitti
+
+    python -m benchmarks.loader_throughput --data_root ../synthetic_kitti --num_workers 0 4 8 --batch_sizes 6 12 \
+        --modes plain edge_loss convolution_experiment
+
+For every combination of loader mode, num_workers and batch size it reports the samples per second,
+the resident memory of all worker processes together and the bytes per batch which the workers
+send to the training process
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+import resource
+import argparse
+import itertools
+
+import torch
+from torch.utils.data import DataLoader
+
+from datasets import KITTIRAWDataset
+from datasets.attention_masks import collate_attention_masks
+
+
+# the dataset flags of every loader mode, the weight matrix is loaded in all of them
+MODES = {
+    "plain": {},
+    "edge_loss": {"edge_loss": True},
+    "attention_mask_loss": {"attention_mask_loss": True},
+    "weight_matrix_on_the_fly": {"weight_matrix_on_the_fly": True},
+    "convolution_experiment": {"convolution_experiment": True},
+}
+
+
+def child_pids():
+    """Pids of the child processes of this process, the dataloader workers
+    """
+    pids = []
+    task_path = "/proc/self/task"
+    for task in os.listdir(task_path):
+        with open(os.path.join(task_path, task, "children")) as f:
+            pids += [int(pid) for pid in f.read().split()]
+    return pids
+
+
+def resident_memory(pid):
+    """Resident memory of a process in bytes, 0 if it is already gone
+    """
+    try:
+        with open("/proc/{}/statm".format(pid)) as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        return 0
+
+
+def batch_bytes(batch):
+    """Bytes of all tensors in a batch, what the workers send to the training process per batch
+    """
+    if isinstance(batch, torch.Tensor):
+        return batch.numel() * batch.element_size()
+    if isinstance(batch, dict):
+        return sum(batch_bytes(value) for value in batch.values())
+    if isinstance(batch, (list, tuple)):
+        return sum(batch_bytes(value) for value in batch)
+    return 0
+
+
+def make_dataset(opt, filenames, mode):
+    flags = dict({"convolution_experiment": False, "attention_mask_loss": False, "edge_loss": False,
+                  "weight_matrix_on_the_fly": False}, **MODES[mode])
+
+    return KITTIRAWDataset(
+        flags["convolution_experiment"], opt.top_k, opt.seed, opt.weight_mask_method,
+        os.path.join(opt.data_root, "weight_mask"), flags["attention_mask_loss"], flags["edge_loss"],
+        os.path.join(opt.data_root, "kitti"), os.path.join(opt.data_root, "attention"), opt.attention_threshold,
+        filenames, opt.height, opt.width, [0, -1, 1], 4, is_train=True, img_ext=opt.img_ext,
+        pack_attention_masks=opt.pack_attention_masks,
+        ragged_attention_masks=opt.ragged_attention_masks,
+        weight_matrix_on_the_fly=flags["weight_matrix_on_the_fly"])
+
+
+def measure(opt, filenames, mode, num_workers, batch_size):
+    """Samples per second, peak worker memory and bytes per batch of one loader configuration
+    """
+    loader = DataLoader(
+        make_dataset(opt, filenames, mode), batch_size, True, num_workers=num_workers, drop_last=True,
+        collate_fn=collate_attention_masks if opt.ragged_attention_masks else None)
+
+    iterator = iter(loader)
+
+    # the first batches include starting the workers
+    for _ in range(opt.warmup_batches):
+        next(iterator)
+
+    samples = 0
+    bytes_per_batch = []
+    worker_memory = 0
+    start = time.time()
+    for _ in range(opt.num_batches):
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            break
+
+        samples += batch_size
+        bytes_per_batch.append(batch_bytes(batch))
+        worker_memory = max(worker_memory, sum(resident_memory(pid) for pid in child_pids()))
+    duration = time.time() - start
+
+    del iterator
+
+    return {
+        "samples_per_sec": samples / duration,
+        "worker_rss_mb": worker_memory / 2 ** 20,
+        "mb_per_batch": sum(bytes_per_batch) / max(len(bytes_per_batch), 1) / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KITTIRAWDataset dataloader throughput")
+    parser.add_argument("--data_root", type=str, help="output_path of benchmarks.synthetic_kitti", required=True)
+    parser.add_argument("--split_file", type=str, help="defaults to <data_root>/splits/synthetic/train_files.txt",
+                        default=None)
+    parser.add_argument("--modes", nargs="+", type=str, choices=list(MODES), default=list(MODES))
+    parser.add_argument("--num_workers", nargs="+", type=int, default=[0, 4, 8])
+    parser.add_argument("--batch_sizes", nargs="+", type=int, default=[6, 12])
+    parser.add_argument("--num_batches", type=int, default=20)
+    parser.add_argument("--warmup_batches", type=int, default=2)
+    parser.add_argument("--img_ext", type=str, default=".jpg")
+    parser.add_argument("--height", type=int, default=192)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--top_k", type=int, help="masks per frame in the convolution_experiment mode", default=5)
+    parser.add_argument("--attention_threshold", type=float, default=0.5)
+    parser.add_argument("--weight_mask_method", type=str, default="avg")
+    parser.add_argument("--pack_attention_masks", action="store_true")
+    parser.add_argument("--ragged_attention_masks", action="store_true")
+    parser.add_argument("--seed", type=int, default=4)
+    opt = parser.parse_args()
+
+    split_file = opt.split_file or os.path.join(opt.data_root, "splits", "synthetic", "train_files.txt")
+    with open(split_file) as f:
+        filenames = f.read().splitlines()
+
+    print("{:<24} {:>8} {:>6} {:>12} {:>14} {:>14}".format(
+        "mode", "workers", "batch", "samples/s", "worker rss mb", "mb per batch"))
+
+    for mode, num_workers, batch_size in itertools.product(opt.modes, opt.num_workers, opt.batch_sizes):
+        result = measure(opt, filenames, mode, num_workers, batch_size)
+        print("{:<24} {:>8} {:>6} {:>12.1f} {:>14.1f} {:>14.1f}".format(
+            mode, num_workers, batch_size, result["samples_per_sec"], result["worker_rss_mb"],
+            result["mb_per_batch"]))
+
+
+if __name__ == "__main__":
+    main()
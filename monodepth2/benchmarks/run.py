@@ -0,0 +1,265 @@
+"""Benchmarks of the attention loss, edge loss and reprojection hot paths on synthetic KITTI shaped inputs
+
+    python -m benchmarks.run --batch_size 4 --amount_masks 20 --overlap 0.5 --save_baseline benchmarks/baseline.json
+    python -m benchmarks.run --batch_size 4 --amount_masks 20 --overlap 0.5 --compare benchmarks/baseline.json
+
+Every case runs in its own process, such that the peak memory of one case doesn't hide the next.
+With --compare the exit status is 1 if a case got slower or uses more memory than the baseline allows
+"""
+from __future__ import absolute_import, division, print_function
+
+import sys
+import json
+import time
+import resource
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+from benchmarks.synthetic import make_opt, make_inputs, make_outputs, clone_inputs, BenchmarkContext, \
+    NO_PLOT_BATCH_IDX
+
+
+def setup_attention_mask_weight(context, inputs, outputs):
+    from attention_mask_loss import attention_mask_weight
+
+    def make_args():
+        inputs_copy = clone_inputs(inputs)
+        return context, inputs_copy, NO_PLOT_BATCH_IDX, inputs["attention"].clone()
+
+    return attention_mask_weight, make_args
+
+
+def setup_find_not_overlapping_masks(context, inputs, outputs):
+    from attention_mask_loss import find_not_overlapping_masks, select_non_zero_attention_masks
+
+    def make_args():
+        attention_masks = (inputs["attention"] >= 0.8).to(torch.float32)
+        attention_masks, amount_attention_masks, _ = select_non_zero_attention_masks(attention_masks)
+        batch_masks = torch.zeros(size=attention_masks.shape, device=context.device)
+        return context, clone_inputs(inputs), attention_masks, amount_attention_masks, batch_masks, \
+            inputs["attention"].clone(), NO_PLOT_BATCH_IDX
+
+    return find_not_overlapping_masks, make_args
+
+
+def setup_calculate_weight_matrix(context, inputs, outputs):
+    from attention_weight_mask import calculate_weight_matrix
+
+    def make_args():
+        return context, clone_inputs(inputs), NO_PLOT_BATCH_IDX, inputs["attention"].clone()
+
+    return calculate_weight_matrix, make_args
+
+
+def setup_edge_detection_loss(context, inputs, outputs):
+    from attention_mask_loss import overlapping_masks_edge_detection
+    from edge_code import edge_detection_loss
+
+    not_overlapping_masks, index_nrs = overlapping_masks_edge_detection(context, clone_inputs(inputs),
+                                                                        NO_PLOT_BATCH_IDX, inputs["attention"])
+
+    def make_args():
+        return context, outputs, inputs, not_overlapping_masks, NO_PLOT_BATCH_IDX, index_nrs, inputs["attention"]
+
+    return edge_detection_loss, make_args
+
+
+def setup_ssim(context, inputs, outputs):
+    pred = outputs[("color", context.opt.frame_ids[1], 0)]
+    target = inputs[("color", 0, 0)]
+
+    def make_args():
+        return pred, target
+
+    return context.ssim, make_args
+
+
+def setup_backproject_project(context, inputs, outputs):
+    from layers import BackprojectDepth, Project3D, disp_to_depth
+
+    opt = context.opt
+    backproject_depth = BackprojectDepth(opt.batch_size, opt.height, opt.width).to(context.device)
+    project_3d = Project3D(opt.batch_size, opt.height, opt.width).to(context.device)
+
+    depths = [disp_to_depth(torch.nn.functional.interpolate(outputs[("disp", scale)], [opt.height, opt.width],
+                                                            mode="bilinear", align_corners=False),
+                            opt.min_depth, opt.max_depth)[1] for scale in opt.scales]
+
+    Ts = torch.stack([outputs[("cam_T_cam", 0, frame_id)] for frame_id in opt.frame_ids[1:]], 1)
+    source_images = torch.stack([inputs[("color", frame_id, 0)] for frame_id in opt.frame_ids[1:]], 1)
+
+    def warp_all(depths):
+        # like generate_images_pred: every scale is warped at full resolution to all source frames at once
+        for depth in depths:
+            cam_points = backproject_depth(depth, inputs[("inv_K", 0)])
+            pix_coords = project_3d(cam_points, inputs[("K", 0)], Ts)
+            torch.nn.functional.grid_sample(source_images.flatten(0, 1), pix_coords.flatten(0, 1),
+                                            padding_mode="border")
+
+    def make_args():
+        return depths,
+
+    return warp_all, make_args
+
+
+def setup_compute_losses(context, inputs, outputs):
+    from trainer_experiment import Trainer
+
+    # a trainer without models, only the attributes compute_losses uses
+    trainer = Trainer.__new__(Trainer)
+    trainer.__dict__.update(context.__dict__)
+
+    def make_args():
+        return clone_inputs(inputs), dict(outputs), NO_PLOT_BATCH_IDX
+
+    return trainer.compute_losses, make_args
+
+
+CASES = {
+    "attention_mask_weight": setup_attention_mask_weight,
+    "find_not_overlapping_masks": setup_find_not_overlapping_masks,
+    "calculate_weight_matrix": setup_calculate_weight_matrix,
+    "edge_detection_loss": setup_edge_detection_loss,
+    "ssim": setup_ssim,
+    "backproject_project": setup_backproject_project,
+    "compute_losses": setup_compute_losses,
+}
+
+
+def current_memory():
+    """Resident memory of this process in bytes
+    """
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def run_case(name, config):
+    """Time one case in this process. Returns the median and min time, images per second and peak memory
+    """
+    device = torch.device(config["device"])
+    torch.manual_seed(0)
+    torch.set_num_threads(config["num_threads"])
+
+    # weight_attention_matrix is no option anymore but determine_mask_weight still scales by it
+    opt = make_opt(batch_size=config["batch_size"], attention_mask_loss=True, edge_loss=True,
+                   no_cuda=device.type != "cuda", weight_attention_matrix=1)
+    context = BenchmarkContext(opt, device)
+    inputs = make_inputs(opt, config["amount_masks"], config["overlap"], config["padding"], device)
+    outputs = make_outputs(opt, inputs)
+
+    function, make_args = CASES[name](context, inputs, outputs)
+
+    def synchronize():
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+
+    # warm up
+    function(*make_args())
+    synchronize()
+
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+    memory_before = current_memory()
+
+    times = []
+    for _ in range(config["repeats"]):
+        args = make_args()
+        synchronize()
+        start = time.time()
+        with torch.no_grad() if config["no_grad"] else torch.enable_grad():
+            function(*args)
+        synchronize()
+        times.append(time.time() - start)
+        del args
+
+    if device.type == "cuda":
+        peak_memory = torch.cuda.max_memory_allocated()
+    else:
+        # ru_maxrss is in kilobytes on linux
+        peak_memory = max(0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - memory_before)
+
+    times.sort()
+    median = times[len(times) // 2]
+    return {
+        "median_ms": median * 1000,
+        "min_ms": times[0] * 1000,
+        "images_per_sec": config["batch_size"] / median,
+        "peak_memory_mb": peak_memory / 2 ** 20,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Names of the cases which are more than tolerance slower or use more than tolerance more memory than the baseline
+    """
+    flagged = []
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]
+
+        slower = result["median_ms"] > base["median_ms"] * (1 + tolerance)
+        # memory below a few mb is noise of the allocator
+        more_memory = result["peak_memory_mb"] > max(base["peak_memory_mb"] * (1 + tolerance), 16)
+
+        print("{:<28} {:8.1f}x time  {:8.1f}x memory  {}".format(
+            name, result["median_ms"] / base["median_ms"],
+            result["peak_memory_mb"] / max(base["peak_memory_mb"], 1e-6),
+            "SLOWER" if slower else ("MORE MEMORY" if more_memory else "ok")))
+
+        if slower or more_memory:
+            flagged.append(name)
+
+    return flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="attention loss and reprojection benchmarks")
+    parser.add_argument("--cases", nargs="+", type=str, choices=list(CASES), default=list(CASES))
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--amount_masks", type=int, help="attention masks per kitti image", default=20)
+    parser.add_argument("--padding", type=int, help="empty attention masks after the real ones", default=10)
+    parser.add_argument("--overlap", type=float, help="fraction of the masks which overlap an earlier mask",
+                        default=0.5)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--num_threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--no_grad", help="if set, time without autograd", action="store_true")
+    parser.add_argument("--save_baseline", type=str, help="write the results to this json file", default=None)
+    parser.add_argument("--compare", type=str, help="compare against the results in this json file", default=None)
+    parser.add_argument("--tolerance", type=float, help="allowed slowdown before a case is flagged", default=0.1)
+    opt = parser.parse_args()
+
+    config = {key: value for key, value in vars(opt).items()
+              if key not in ["cases", "save_baseline", "compare", "tolerance"]}
+
+    results = {}
+    for name in opt.cases:
+        # spawn instead of fork, such that every case starts with a clean process
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results[name] = executor.submit(run_case, name, config).result()
+
+        print("{:<28} {:10.2f} ms  {:10.1f} images/s  {:10.1f} mb".format(
+            name, results[name]["median_ms"], results[name]["images_per_sec"], results[name]["peak_memory_mb"]))
+
+    if opt.save_baseline is not None:
+        with open(opt.save_baseline, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+
+    if opt.compare is not None:
+        with open(opt.compare) as f:
+            baseline = json.load(f)
+
+        if baseline["config"] != config:
+            print("warning: the baseline was made with a different config {}".format(baseline["config"]))
+
+        flagged = compare(results, baseline, opt.tolerance)
+        if len(flagged) > 0:
+            print("{} got slower or use more memory: {}".format(len(flagged), ", ".join(flagged)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
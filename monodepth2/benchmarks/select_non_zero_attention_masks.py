@@ -0,0 +1,115 @@
+"""Micro benchmark of select_non_zero_attention_masks against the loop implementation it replaced
+
+    python -m benchmarks.select_non_zero_attention_masks --batch_size 12 --device cuda
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+import argparse
+
+import torch
+
+from attention_mask_loss import select_non_zero_attention_masks
+
+
+def select_non_zero_attention_masks_loop(attention_masks):
+    """The old batch x masks loop, kept unchanged as reference. It shares one size dict between all batches,
+    so every batch holds the sizes of the last batch
+    """
+    amount_attention_masks = {}
+
+    size_attention_masks_all_batches = {}
+    size_per_batch = {}
+
+    for b in range(attention_masks.shape[0]):
+        amount_attention_masks[b] = None
+
+        size_attention_masks_all_batches[b] = None
+
+        for m in range(attention_masks.shape[1]):
+            size_per_batch[m] = None
+
+        size_attention_masks_all_batches[b] = size_per_batch
+
+    for b in range(attention_masks.shape[0]):
+
+        for mask in range(attention_masks.shape[1]):
+
+            if attention_masks[b][mask].sum() == 0:
+
+                size_attention_masks_all_batches[b][mask] = float('inf')
+
+                if amount_attention_masks[b] == None:
+                    amount_attention_masks[b] = mask
+
+                attention_masks[b][mask][attention_masks[b][mask] == 0] = -999
+
+            else:
+
+                size_attention_masks_all_batches[b][mask] = attention_masks[b][mask].sum().item()
+
+                attention_masks[b][mask][attention_masks[b][mask] == 0] = -mask - 1
+
+    return attention_masks, amount_attention_masks, size_attention_masks_all_batches
+
+
+def make_attention_masks(batch_size, amount_masks, height, width, device):
+    """Binary masks with a random amount of rectangles per kitti image, followed by zero padding like the dataset does
+    """
+    attention_masks = torch.zeros(batch_size, amount_masks, height, width)
+    for b in range(batch_size):
+        for m in range(torch.randint(1, amount_masks, ()).item()):
+            y, x = torch.randint(0, height - 8, ()).item(), torch.randint(0, width - 8, ()).item()
+            h, w = torch.randint(4, height - y, ()).item(), torch.randint(4, width - x, ()).item()
+            attention_masks[b, m, y:y + h, x:x + w] = 1
+    return attention_masks.to(device)
+
+
+def time_function(function, attention_masks, repeats, device):
+    times = []
+    for _ in range(repeats):
+        masks = attention_masks.clone()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.time()
+        function(masks)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="select_non_zero_attention_masks benchmark")
+    parser.add_argument("--batch_size", type=int, default=12)
+    parser.add_argument("--amount_masks", type=int, default=100)
+    parser.add_argument("--height", type=int, default=192)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cpu")
+    opt = parser.parse_args()
+
+    device = torch.device(opt.device)
+    torch.manual_seed(0)
+    attention_masks = make_attention_masks(opt.batch_size, opt.amount_masks, opt.height, opt.width, device)
+
+    expected = select_non_zero_attention_masks_loop(attention_masks.clone())
+    result = select_non_zero_attention_masks(attention_masks.clone())
+    assert torch.equal(expected[0], result[0]), "attention masks differ"
+    assert expected[1] == result[1], "amount of attention masks differ"
+    # every batch has its own sizes now, the old loop gave every batch the sizes of the last batch
+    last_batch = opt.batch_size - 1
+    assert all(expected[2][b] == result[2][last_batch] for b in expected[2]), "attention mask sizes differ"
+    assert all(result[2][b] == {mask: float('inf') if size == 0 else size for mask, size in enumerate(sizes)}
+               for b, sizes in enumerate(attention_masks.sum(-1).sum(-1).tolist())), "attention mask sizes differ"
+
+    loop_time = time_function(select_non_zero_attention_masks_loop, attention_masks, opt.repeats, device)
+    vectorized_time = time_function(select_non_zero_attention_masks, attention_masks, opt.repeats, device)
+
+    print("loop        {:8.2f} ms".format(loop_time * 1000))
+    print("vectorized  {:8.2f} ms".format(vectorized_time * 1000))
+    print("speedup     {:8.1f}x".format(loop_time / vectorized_time))
+
+
+if __name__ == "__main__":
+    main()
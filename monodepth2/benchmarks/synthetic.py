@@ -0,0 +1,128 @@
+"""Synthetic KITTI shaped inputs and outputs for the benchmarks, no dataset needed
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from layers import SSIM, transformation_from_parameters
+from options import MonodepthOptions
+from plot_service import PlotService
+from step_timer import StepTimer
+from pre_process_weight_matrix import calculate_weight_per_mask, weight_matrix_from_masks
+
+
+# a batch_idx which is never a plot step, such that the benchmarks don't time matplotlib
+NO_PLOT_BATCH_IDX = 1
+
+
+def make_opt(**overrides):
+    """The default training options, with overrides
+    """
+    opt = MonodepthOptions().parser.parse_args([])
+    for key, value in overrides.items():
+        setattr(opt, key, value)
+    return opt
+
+
+class BenchmarkContext:
+    """The attributes of the trainer which the attention, edge and loss functions use as self
+    """
+    def __init__(self, opt, device):
+        self.opt = opt
+        self.device = device
+        self.epoch = 0
+        self.step = 0
+        self.num_scales = len(opt.scales)
+        self.plot_service = PlotService(False)
+        self.step_timer = StepTimer(False)
+        self.ssim = SSIM().to(device)
+
+
+def make_attention_masks(batch_size, amount_masks, height, width, device, overlap=0.5, padding=0):
+    """Binary masks of amount_masks rectangles per kitti image, followed by padding zero masks like the dataset does
+
+    Every mask has its own cell in a grid over the image. With probability overlap a mask is instead
+    a copy of an earlier mask shifted by half its size, such that the two overlap
+    """
+    attention_masks = torch.zeros(batch_size, amount_masks + padding, height, width)
+
+    cols = int(np.ceil(np.sqrt(amount_masks * width / height)))
+    rows = int(np.ceil(amount_masks / cols))
+    cell_h, cell_w = height // rows, width // cols
+
+    for b in range(batch_size):
+        boxes = []
+        for m in range(amount_masks):
+            if m > 0 and torch.rand(()).item() < overlap:
+                y, x, h, w = boxes[torch.randint(0, len(boxes), ()).item()]
+                y, x = min(y + h // 2, height - h), min(x + w // 2, width - w)
+            else:
+                h = torch.randint(cell_h // 4, cell_h + 1, ()).item()
+                w = torch.randint(cell_w // 4, cell_w + 1, ()).item()
+                y = (m // cols) * cell_h + torch.randint(0, cell_h - h + 1, ()).item()
+                x = (m % cols) * cell_w + torch.randint(0, cell_w - w + 1, ()).item()
+
+            boxes.append((y, x, h, w))
+            attention_masks[b, m, y:y + h, x:x + w] = 1
+
+    return attention_masks.to(device)
+
+
+def make_inputs(opt, amount_masks, overlap, padding, device):
+    """A batch like the KITTI dataloader gives it, already on the device
+    """
+    inputs = {}
+    for scale in range(4):
+        height, width = opt.height // 2 ** scale, opt.width // 2 ** scale
+
+        for frame_id in opt.frame_ids:
+            inputs[("color", frame_id, scale)] = torch.rand(opt.batch_size, 3, height, width, device=device)
+            inputs[("color_aug", frame_id, scale)] = inputs[("color", frame_id, scale)].clone()
+
+        K = torch.tensor([[0.58, 0, 0.5, 0],
+                          [0, 1.92, 0.5, 0],
+                          [0, 0, 1, 0],
+                          [0, 0, 0, 1]], device=device)
+        K[0, :] *= width
+        K[1, :] *= height
+        inputs[("K", scale)] = K.repeat(opt.batch_size, 1, 1)
+        inputs[("inv_K", scale)] = torch.inverse(K).repeat(opt.batch_size, 1, 1)
+
+    inputs["attention"] = make_attention_masks(opt.batch_size, amount_masks, opt.height, opt.width, device,
+                                               overlap, padding)
+
+    weight_per_mask = calculate_weight_per_mask(inputs["attention"], opt.attention_threshold)
+    inputs["weight_matrix"] = weight_matrix_from_masks(inputs["attention"], weight_per_mask, opt.weight_mask_method)
+
+    return inputs
+
+
+def make_outputs(opt, inputs):
+    """Smooth disparities per scale, poses and warped images like process_batch makes them
+    """
+    outputs = {}
+    device = inputs["attention"].device
+
+    for scale in opt.scales:
+        coarse = torch.rand(opt.batch_size, 1, 6, 20, device=device)
+        outputs[("disp", scale)] = F.interpolate(coarse, [opt.height // 2 ** scale, opt.width // 2 ** scale],
+                                                 mode="bilinear", align_corners=False)
+
+    for frame_id in opt.frame_ids[1:]:
+        axisangle = 0.01 * torch.randn(opt.batch_size, 1, 1, 3, device=device)
+        translation = 0.1 * torch.randn(opt.batch_size, 1, 1, 3, device=device)
+        outputs[("cam_T_cam", 0, frame_id)] = transformation_from_parameters(axisangle[:, 0], translation[:, 0],
+                                                                             frame_id < 0)
+        for scale in opt.scales:
+            outputs[("color", frame_id, scale)] = torch.rand(opt.batch_size, 3, opt.height, opt.width, device=device)
+            outputs[("color_identity", frame_id, scale)] = inputs[("color", frame_id, 0)]
+
+    return outputs
+
+
+def clone_inputs(inputs):
+    """A copy of the inputs, because the attention functions binarize inputs["attention"] in place
+    """
+    return {key: value.clone() for key, value in inputs.items()}
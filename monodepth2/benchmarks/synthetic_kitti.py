@@ -0,0 +1,223 @@
+"""Generate a synthetic KITTI raw tree to profile the dataloader without the real dataset
+
+    python -m benchmarks.synthetic_kitti --output_path ../synthetic_kitti --drives 2 --frames 50
+
+writes
+    <output_path>/kitti/<date>/calib_cam_to_cam.txt, calib_velo_to_cam.txt
+    <output_path>/kitti/<folder>/image_0x/data/<frame>.jpg and velodyne_points/data/<frame>.bin
+    <output_path>/attention/<folder>/image_0x/data/<frame>/<id>_<prob>.jpg, 100 scored masks per frame
+    <output_path>/weight_mask/<folder>/image_0x/data/<frame>/threshold_<t>_method_<m>.pt
+    <output_path>/splits/synthetic/train_files.txt and val_files.txt
+
+For training on it use --data_path <output_path>/kitti --attention_path <output_path>/attention
+--weight_matrix_path <output_path>/weight_mask and copy the split to splits/synthetic.
+benchmarks/loader_throughput.py reads the tree directly
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import argparse
+
+import numpy as np
+import torch
+from PIL import Image
+
+from datasets.attention_masks import MASK_THRESHOLD, attention_mask_file_name
+from pre_process_weight_matrix import METHODS, calculate_weight_per_mask, weight_matrix_from_masks, \
+    get_weight_matrix_file
+
+
+DATE = "2011_09_26"
+SIDES = {2: "l", 3: "r"}
+
+# calibration of 2011_09_26, the velodyne points land in the image like in the real dataset
+CALIB_CAM_TO_CAM = """calib_time: 09-Jan-2012 13:57:47
+corner_dist: 9.950000e-02
+S_rect_00: 1.242000e+03 3.750000e+02
+R_rect_00: 9.999239e-01 9.837760e-03 -7.445048e-03 -9.869795e-03 9.999421e-01 -4.278459e-03 7.402527e-03 4.351614e-03 9.999631e-01
+P_rect_00: 7.215377e+02 0.000000e+00 6.095593e+02 0.000000e+00 0.000000e+00 7.215377e+02 1.728540e+02 0.000000e+00 0.000000e+00 0.000000e+00 1.000000e+00 0.000000e+00
+S_rect_02: 1.242000e+03 3.750000e+02
+P_rect_02: 7.215377e+02 0.000000e+00 6.095593e+02 4.485728e+01 0.000000e+00 7.215377e+02 1.728540e+02 2.163791e-01 0.000000e+00 0.000000e+00 1.000000e+00 2.745884e-03
+S_rect_03: 1.242000e+03 3.750000e+02
+P_rect_03: 7.215377e+02 0.000000e+00 6.095593e+02 -3.395242e+02 0.000000e+00 7.215377e+02 1.728540e+02 2.199936e+00 0.000000e+00 0.000000e+00 1.000000e+00 2.729905e-03
+"""
+
+CALIB_VELO_TO_CAM = """calib_time: 15-Mar-2012 11:37:16
+R: 7.533745e-03 -9.999714e-01 -6.166020e-04 1.480249e-02 7.280733e-04 -9.998902e-01 9.998621e-01 7.523790e-03 1.480755e-02
+T: -4.069766e-03 -7.631618e-02 -2.717806e-01
+delta_f: 0.000000e+00 0.000000e+00
+delta_c: 0.000000e+00 0.000000e+00
+"""
+
+
+def make_image(rng, width, height):
+    """Smooth random colors with some noise, such that the jpg/png compression is closer to a real photo than pure noise
+    """
+    coarse = rng.randint(0, 256, size=(height // 25 + 1, width // 25 + 1, 3)).astype(np.uint8)
+    image = np.asarray(Image.fromarray(coarse).resize((width, height), Image.BILINEAR), dtype=np.int16)
+    image = image + rng.randint(-12, 13, size=image.shape)
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8))
+
+
+def make_velodyne_points(rng, amount_points):
+    """forward, left, up, reflectance like a velodyne scan around the car
+    """
+    angle = rng.uniform(-np.pi, np.pi, amount_points)
+    distance = rng.uniform(2, 80, amount_points)
+    points = np.stack([distance * np.cos(angle), distance * np.sin(angle),
+                       rng.uniform(-2, 1, amount_points), rng.uniform(0, 1, amount_points)], 1)
+    return points.astype(np.float32)
+
+
+def make_attention_masks(rng, amount_masks, width, height):
+    """amount_masks binary DETR like masks of one rectangle each, with their probability
+    """
+    masks = np.zeros((amount_masks, height, width), dtype=np.uint8)
+    for m in range(amount_masks):
+        h, w = rng.randint(4, height // 2), rng.randint(4, width // 3)
+        y, x = rng.randint(0, height - h), rng.randint(0, width - w)
+        masks[m, y:y + h, x:x + w] = 255
+
+    probs = np.round(rng.uniform(0, 1, amount_masks), 3)
+    return masks, probs
+
+
+def write_frame(opt, rng, folder, frame_index):
+    frame = "{:010d}".format(frame_index)
+
+    velodyne_path = os.path.join(opt.output_path, "kitti", folder, "velodyne_points", "data")
+    make_velodyne_points(rng, opt.velodyne_points).tofile(os.path.join(velodyne_path, frame + ".bin"))
+
+    for side_number in opt.sides:
+        image_dir = "image_0{}".format(side_number)
+        make_image(rng, opt.image_width, opt.image_height).save(
+            os.path.join(opt.output_path, "kitti", folder, image_dir, "data", frame + opt.img_ext))
+
+        attention_path = os.path.join(opt.output_path, "attention", folder, image_dir, "data", frame)
+        weight_path = os.path.join(opt.output_path, "weight_mask", folder, image_dir, "data", frame)
+        os.makedirs(attention_path, exist_ok=True)
+        os.makedirs(weight_path, exist_ok=True)
+
+        masks, probs = make_attention_masks(rng, 100, opt.width, opt.height)
+        for mask_id, (mask, prob) in enumerate(zip(masks, probs)):
+            Image.fromarray(mask).save(os.path.join(attention_path, attention_mask_file_name(mask_id, prob)))
+
+        # the same weight matrices as pre_process_weight_matrix.py makes from these masks
+        masks = torch.from_numpy(masks / 255 >= MASK_THRESHOLD).to(torch.float32)
+        probs = torch.from_numpy(probs)
+        for threshold in opt.thresholds:
+            masks_above_threshold = masks[probs >= threshold]
+            weight_per_mask = calculate_weight_per_mask(masks_above_threshold, threshold)
+            for method in opt.methods:
+                weight_matrix = weight_matrix_from_masks(masks_above_threshold, weight_per_mask, method)
+                torch.save(weight_matrix, get_weight_matrix_file(weight_path, threshold, method))
+
+
+def generate_synthetic_kitti():
+
+    parser = argparse.ArgumentParser(description='synthetic_kitti')
+
+    parser.add_argument('--output_path',
+                        type=str,
+                        help='where to write the synthetic tree',
+                        required=True)
+    parser.add_argument('--drives',
+                        type=int,
+                        help='number of drives',
+                        default=1)
+    parser.add_argument('--frames',
+                        type=int,
+                        help='number of frames per drive',
+                        default=50)
+    parser.add_argument('--sides',
+                        nargs='+',
+                        type=int,
+                        help='cameras to write, 2 is left and 3 is right',
+                        choices=[2, 3],
+                        default=[2, 3])
+    parser.add_argument('--img_ext',
+                        type=str,
+                        help='image extension, .jpg or .png like the --png option of training',
+                        choices=['.jpg', '.png'],
+                        default='.jpg')
+    parser.add_argument('--image_width',
+                        type=int,
+                        help='width of the camera images',
+                        default=1242)
+    parser.add_argument('--image_height',
+                        type=int,
+                        help='height of the camera images',
+                        default=375)
+    parser.add_argument('--width',
+                        type=int,
+                        help='width of the attention masks and weight matrices, the training width',
+                        default=640)
+    parser.add_argument('--height',
+                        type=int,
+                        help='height of the attention masks and weight matrices, the training height',
+                        default=192)
+    parser.add_argument('--velodyne_points',
+                        type=int,
+                        help='number of velodyne points per frame',
+                        default=120000)
+    parser.add_argument('--thresholds',
+                        nargs='+',
+                        type=float,
+                        help='attention thresholds to write the weight matrices for',
+                        default=[0.5])
+    parser.add_argument('--methods',
+                        nargs='+',
+                        type=str,
+                        help='weight mask methods to write the weight matrices for',
+                        choices=METHODS,
+                        default=['avg'])
+    parser.add_argument('--val_fraction',
+                        type=float,
+                        help='fraction of the frames in val_files.txt instead of train_files.txt',
+                        default=0.1)
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0)
+    opt = parser.parse_args()
+
+    rng = np.random.RandomState(opt.seed)
+
+    date_path = os.path.join(opt.output_path, "kitti", DATE)
+    os.makedirs(date_path, exist_ok=True)
+    with open(os.path.join(date_path, "calib_cam_to_cam.txt"), "w") as f:
+        f.write(CALIB_CAM_TO_CAM)
+    with open(os.path.join(date_path, "calib_velo_to_cam.txt"), "w") as f:
+        f.write(CALIB_VELO_TO_CAM)
+
+    lines = []
+    for drive in range(1, opt.drives + 1):
+        folder = "{}/{}_drive_{:04d}_sync".format(DATE, DATE, drive)
+        print("Writing {} frames of {}".format(opt.frames, folder))
+
+        os.makedirs(os.path.join(opt.output_path, "kitti", folder, "velodyne_points", "data"), exist_ok=True)
+        for side_number in opt.sides:
+            os.makedirs(os.path.join(opt.output_path, "kitti", folder, "image_0{}".format(side_number), "data"),
+                        exist_ok=True)
+
+        for frame_index in range(opt.frames):
+            write_frame(opt, rng, folder, frame_index)
+
+        # the first and last frame have no neighbour for frame ids -1 and 1
+        lines += ["{} {} {}".format(folder, frame_index, SIDES[side_number])
+                  for frame_index in range(1, opt.frames - 1) for side_number in opt.sides]
+
+    rng.shuffle(lines)
+    amount_val = int(len(lines) * opt.val_fraction)
+
+    split_path = os.path.join(opt.output_path, "splits", "synthetic")
+    os.makedirs(split_path, exist_ok=True)
+    with open(os.path.join(split_path, "train_files.txt"), "w") as f:
+        f.write("\n".join(lines[amount_val:]) + "\n")
+    with open(os.path.join(split_path, "val_files.txt"), "w") as f:
+        f.write("\n".join(lines[:amount_val]) + "\n")
+
+    print("Wrote {} train and {} val frames to {}".format(len(lines) - amount_val, amount_val, opt.output_path))
+
+
+if __name__ == "__main__":
+    generate_synthetic_kitti()
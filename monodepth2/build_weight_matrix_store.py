@@ -0,0 +1,103 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import argparse
+import numpy as np
+import torch
+
+from datasets.attention_masks import get_attention_frame_key
+from datasets.weight_matrix_store import get_weight_matrix_store_path, get_weight_matrix_store_frames_path
+
+
+def find_weight_matrices(weight_matrix_path, file_name):
+    """Frame keys and paths of all <weight_matrix_path>/<folder>/image_0x/data/<frame>/<file_name> files
+    """
+    frames = []
+    paths = []
+    for frame_dir, _, files in os.walk(weight_matrix_path):
+
+        if file_name not in files:
+            continue
+
+        parts = os.path.relpath(frame_dir, weight_matrix_path).split(os.sep)
+        folder, side_number, frame_index = "/".join(parts[:-3]), int(parts[-3][-1]), int(parts[-1])
+
+        frames.append(get_attention_frame_key(folder, side_number, frame_index))
+        paths.append(os.path.join(frame_dir, file_name))
+
+    return frames, paths
+
+
+def build_store(weight_matrix_path, output_path, threshold, method, dtype):
+    """Copy all .pt weight matrices of one threshold and method into one .npy array
+    """
+    file_name = 'threshold_' + str(threshold) + '_method_' + method + '.pt'
+    frames, paths = find_weight_matrices(weight_matrix_path, file_name)
+
+    if len(frames) == 0:
+        print("   no {} files found, skipping".format(file_name))
+        return
+
+    height, width = torch.load(paths[0]).shape
+
+    # write to a temporary file first such that an interrupted run never leaves half an array behind
+    store_file = get_weight_matrix_store_path(output_path, threshold, method)
+    tmp_file = store_file + ".tmp"
+    weight_matrices = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=dtype, shape=(len(frames), height, width))
+
+    for i, path in enumerate(paths):
+        weight_matrices[i] = torch.load(path).numpy()
+
+        if (i + 1) % 5000 == 0:
+            print("   {} / {}".format(i + 1, len(paths)))
+
+    weight_matrices.flush()
+    del weight_matrices
+
+    np.save(get_weight_matrix_store_frames_path(output_path, threshold, method), np.array(frames, dtype=np.str_))
+    os.replace(tmp_file, store_file)
+
+    print("   wrote {} weight matrices to {}".format(len(frames), store_file))
+
+
+def build_weight_matrix_store():
+
+    parser = argparse.ArgumentParser(description='build_weight_matrix_store')
+
+    parser.add_argument('--weight_matrix_path',
+                        type=str,
+                        help='path to the tree with the .pt weight matrices made by pre_process_weight_matrix.py',
+                        required=True)
+    parser.add_argument('--output_path',
+                        type=str,
+                        help='where to write one .npy array per threshold and method',
+                        required=True)
+    parser.add_argument('--thresholds',
+                        nargs='+',
+                        type=float,
+                        help='attention thresholds to migrate',
+                        default=[0.4, 0.5, 0.6, 0.7, 0.8])
+    parser.add_argument('--methods',
+                        nargs='+',
+                        type=str,
+                        help='weight mask methods to migrate',
+                        default=['avg', 'min', 'max'])
+    parser.add_argument('--float16',
+                        help='if set, stores the weight matrices as float16 to halve the size of the arrays',
+                        action='store_true')
+    opt = parser.parse_args()
+
+    if not os.path.exists(opt.output_path):
+        os.makedirs(opt.output_path)
+
+    dtype = np.float16 if opt.float16 else np.float32
+
+    for threshold in opt.thresholds:
+        for method in opt.methods:
+            print("Building weight matrix store for threshold {} method {}".format(threshold, method))
+            build_store(opt.weight_matrix_path, opt.output_path, threshold, method, dtype)
+
+
+if __name__ == "__main__":
+    build_weight_matrix_store()
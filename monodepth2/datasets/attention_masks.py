@@ -0,0 +1,194 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+
+
+# every consumer of the attention masks binarizes them at this value
+MASK_THRESHOLD = 0.8
+
+
+def mask_probability(file_name):
+    """Parse the DETR probability out of an attention mask file name like '12_0.344.jpg'
+    """
+    return float(file_name.split("_")[1].split(".jpg")[0])
+
+
+def get_attention_shard_path(shard_path, folder, side_number, frame_index):
+    """Path of the packed shard which holds all attention masks of one kitti frame
+    """
+    return os.path.join(
+        shard_path, folder, "image_0{}/data".format(side_number), "{:010d}.npz".format(int(frame_index)))
+
+
+def save_attention_shard(path, names, probs, masks):
+    """Save all attention masks of one kitti frame in one uncompressed file
+
+    masks: (N, H, W) float array with values in [0, 1]. the masks are thresholded at MASK_THRESHOLD
+    and stored as bits (8 pixels per byte) together with their probabilities and pixel sizes
+    """
+    masks = np.asarray(masks) >= MASK_THRESHOLD
+    n, height, width = masks.shape
+    sizes = masks.reshape(n, -1).sum(1).astype(np.int32)
+
+    np.savez(path,
+             names=np.array(names, dtype=np.str_),
+             probs=np.array(probs, dtype=np.float64),
+             sizes=sizes,
+             shape=np.array([height, width], dtype=np.int32),
+             masks=np.packbits(masks, axis=-1))
+
+
+def load_attention_shard(path):
+    """Load a frame written by save_attention_shard with one sequential read
+
+    Returns a dict with the mask names, probabilities, sizes and the bit packed masks of shape (N, H, W // 8)
+    """
+    with open(path, 'rb') as f:
+        with np.load(f) as shard:
+            return {key: shard[key] for key in shard.files}
+
+
+def unpack_attention_shard_masks(packed, width):
+    """Unpack (N, H, W // 8) bits from a shard back to a (N, H, W) float32 array of zeros and ones
+    """
+    return np.unpackbits(packed, axis=-1, count=width).astype(np.float32)
+
+
+def pack_attention_masks(masks):
+    """Binarize a (..., H, W) float tensor of attention masks at MASK_THRESHOLD and pack it to (..., H, W // 8) uint8
+
+    The packed masks are 32x smaller than the float32 ones, which makes the worker -> main process
+    and host -> device copies of the attention masks cheap
+    """
+    return torch.from_numpy(np.packbits((masks >= MASK_THRESHOLD).numpy(), axis=-1))
+
+
+def unpack_attention_masks(packed, width):
+    """Unpack (..., H, W // 8) uint8 masks made by pack_attention_masks to a (..., H, W) float32 tensor of zeros and ones
+
+    Works on any device, so the masks can be unpacked after they are moved to the gpu
+    """
+    shifts = torch.arange(7, -1, -1, dtype=torch.uint8, device=packed.device)
+    bits = (packed.unsqueeze(-1) >> shifts) & 1
+    return bits.view(*packed.shape[:-1], packed.shape[-1] * 8)[..., :width].to(torch.float32)
+
+
+def collate_attention_masks(batch):
+    """Collate function for samples with a variable amount of attention masks (ragged_attention_masks)
+
+    The masks of all samples are concatenated to one (sum of the masks, H, W) tensor in inputs["attention"],
+    inputs["attention_count"] tells how many of them belong to every sample
+    """
+    attention = [sample.pop("attention") for sample in batch]
+    inputs = default_collate(batch)
+    inputs["attention"] = torch.cat(attention)
+    return inputs
+
+
+def split_attention_masks(inputs):
+    """List with the (masks, H, W) attention masks of every sample, both for padded and for ragged batches
+    """
+    if "attention_count" not in inputs:
+        return list(inputs["attention"])
+
+    return list(torch.split(inputs["attention"], inputs["attention_count"].tolist()))
+
+
+def pad_attention_masks(inputs):
+    """Dense (B, masks, H, W) attention masks with the masks of every sample followed by zero masks
+
+    A padded batch is returned as is, a ragged batch is only padded up to the largest amount of masks in the batch
+    instead of 100
+    """
+    if "attention_count" not in inputs:
+        return inputs["attention"]
+
+    masks_per_sample = split_attention_masks(inputs)
+    masks = inputs["attention"]
+
+    padded = masks.new_zeros(len(masks_per_sample), max(len(m) for m in masks_per_sample), *masks.shape[1:])
+    for b, sample_masks in enumerate(masks_per_sample):
+        padded[b, :len(sample_masks)] = sample_masks
+
+    return padded
+
+
+def attention_mask_file_name(mask_id, prob):
+    """Inverse of the attention mask naming, 12 and 0.344 -> '12_0.344.jpg'
+    """
+    return "{}_{}.jpg".format(mask_id, repr(float(prob)))
+
+
+def get_attention_frame_key(folder, side_number, frame_index):
+    """Key of a kitti frame in the attention mask index
+    """
+    return "{} {} {}".format(folder, side_number, int(frame_index))
+
+
+def save_attention_index(path, frames, names, probs, sizes):
+    """Save the columnar attention mask index made by index_attention_masks.py
+
+    frames: list with a frame key per kitti frame, names / probs / sizes: one list per frame with a value per mask
+    The masks of all frames are stored after each other, frame_offsets tells where the masks of every frame start
+    """
+    counts = [len(frame_names) for frame_names in names]
+    names = [name for frame_names in names for name in frame_names]
+
+    mask_ids = np.array([int(name.split("_")[0]) for name in names], dtype=np.int16)
+    probs = np.array([prob for frame_probs in probs for prob in frame_probs], dtype=np.float64)
+
+    for name, mask_id, prob in zip(names, mask_ids, probs):
+        assert attention_mask_file_name(mask_id, prob) == name, \
+            "Can't rebuild the file name of attention mask {} from its id and probability".format(name)
+
+    np.savez(path,
+             frames=np.array(frames, dtype=np.str_),
+             frame_offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+             mask_ids=mask_ids,
+             probs=probs,
+             sizes=np.array([size for frame_sizes in sizes for size in frame_sizes], dtype=np.int32))
+
+
+class AttentionMaskIndex(object):
+    """Per frame metadata of the attention masks: mask ids, probabilities and binarized pixel sizes
+
+    This allows filtering on probability, sorting on size and picking the top-k masks of a frame
+    without listing its directory or decoding any of its masks
+    """
+    def __init__(self, path):
+        with np.load(path) as index:
+            self.frame_offsets = index["frame_offsets"]
+            self.mask_ids = index["mask_ids"]
+            self.probs = index["probs"]
+            self.sizes = index["sizes"]
+            frames = index["frames"]
+
+        self.frame_rows = {str(key): i for i, key in enumerate(frames)}
+
+    def get_frame(self, folder, side_number, frame_index):
+        """The index rows of one kitti frame
+        """
+        key = get_attention_frame_key(folder, side_number, frame_index)
+        assert key in self.frame_rows, "There are no attention masks in the index for {}".format(key)
+
+        i = self.frame_rows[key]
+        start, end = self.frame_offsets[i], self.frame_offsets[i + 1]
+
+        return {"names": [attention_mask_file_name(mask_id, prob)
+                          for mask_id, prob in zip(self.mask_ids[start:end], self.probs[start:end])],
+                "probs": self.probs[start:end],
+                "sizes": self.sizes[start:end]}
+
+
+_attention_mask_indices = {}
+
+
+def load_attention_index(path):
+    """Load an AttentionMaskIndex once per process, such that the train, val and test datasets share it
+    """
+    if path not in _attention_mask_indices:
+        _attention_mask_indices[path] = AttentionMaskIndex(path)
+    return _attention_mask_indices[path]
@@ -18,6 +18,8 @@ from PIL import Image  # using pillow-simd for increased speed
 
 from kitti_utils import generate_depth_map
 from .mono_dataset import MonoDataset
+from .attention_masks import get_attention_shard_path, load_attention_shard, unpack_attention_shard_masks, \
+    mask_probability
 
 
 class KITTIDataset(MonoDataset):
@@ -59,6 +61,15 @@ class KITTIDataset(MonoDataset):
 
     def get_weight_matrix(self, folder, frame_index, side, do_flip):
 
+        if self.weight_matrix_store is not None:
+            weight_matrix = self.weight_matrix_store.get(folder, self.side_map[side], frame_index)
+
+            if do_flip:
+                weight_matrix = weight_matrix[:, ::-1]
+
+            # one copy out of the memory map, which also does the flip and the float16 -> float32 cast
+            return torch.from_numpy(np.ascontiguousarray(weight_matrix, dtype=np.float32))
+
         frame_index_start = f"{0:010}"
         length = len(str(frame_index))
         frame_index_start = frame_index_start[:-length]
@@ -80,8 +91,64 @@ class KITTIDataset(MonoDataset):
         return weight_matrix
 
 
+    def get_attention_from_shard(self, folder, frame_index, side, do_flip):
+        """Same as get_attention but reads all 100 masks of the frame from one packed shard
+        instead of walking the directory and decoding 100 jpgs
+        """
+
+        attention_masks = {}
+
+        path = get_attention_shard_path(self.attention_shard_path, folder, self.side_map[side], frame_index)
+        shard = load_attention_shard(path)
+
+        assert len(shard["names"]) == 100, "There should be 100 attention masks saved for this kitti image. its now {}".format(len(shard["names"]))
+
+        # only unpack the masks which have a prob high enough
+        keep = np.nonzero(shard["probs"] >= self.attention_threshold)[0]
+        masks = unpack_attention_shard_masks(shard["masks"][keep], shard["shape"][1])
+
+        if do_flip:
+            masks = masks[:, :, ::-1]
+
+        for i, mask_nr in enumerate(keep):
+            attention_map = torch.from_numpy(masks[i].copy()).unsqueeze(0)
+            attention_masks[str(shard["names"][mask_nr])] = (shard["sizes"][mask_nr].item(), attention_map)
+
+        return attention_masks
+
+    def get_attention_from_index(self, folder, frame_index, side, do_flip):
+        """Same as get_attention but takes the probabilities and sizes from the attention mask index,
+        such that only the masks with a prob high enough are decoded
+        """
+
+        attention_masks = {}
+
+        frame = self.attention_index.get_frame(folder, self.side_map[side], frame_index)
+
+        assert len(frame["names"]) == 100, "There should be 100 attention masks saved for this kitti image. its now {}".format(len(frame["names"]))
+
+        path = os.path.join(self.attention_path, folder, "image_0{}/data".format(self.side_map[side]), "{:010d}".format(int(frame_index)))
+
+        for mask_nr in np.nonzero(frame["probs"] >= self.attention_threshold)[0]:
+
+            file = frame["names"][mask_nr]
+            current_attention = self.attention_loader(os.path.join(path, file))
+
+            if do_flip:
+                current_attention = current_attention.transpose(pil.FLIP_LEFT_RIGHT)
+
+            attention_masks[file] = (frame["sizes"][mask_nr].item(), transforms.ToTensor()(current_attention))
+
+        return attention_masks
+
     def get_attention(self, folder, frame_index, side, do_flip):
 
+        if self.attention_shard_path is not None:
+            return self.get_attention_from_shard(folder, frame_index, side, do_flip)
+
+        if self.attention_index is not None:
+            return self.get_attention_from_index(folder, frame_index, side, do_flip)
+
         attention_masks = {}
         frame_index_start = ""
         frame_index_start = f"{0:010}"
@@ -138,50 +205,34 @@ class KITTIDataset(MonoDataset):
 
 
     def get_attention_top_k(self, folder, frame_index, side, do_flip):
-        "sort the dict with attention masks based on the attention mask probability"
-
-        attention_masks = {}
-        mask_amount = 0
-        frame_index_start = ""
-        frame_index_start = f"{0:010}"
-        length = len(str(frame_index))
-        frame_index_start = frame_index_start[:-length]
-        frame_index = frame_index_start + str(frame_index)
-        # print("frame _ index", frame_index)
-
-        path = self.attention_path + "/" + folder + "/" + "image_0{}/data/".format(self.side_map[side])  + str(frame_index)
-
-        for subdir, dirs, files in os.walk(path):
-             for file in files:
-
-                 # print("file", file)
-                 # probability = file.split("_")[1].split("jpg")[0][:-1]
-                 # print("PROB", probability)
-                 new_path = path + "/" + file
-                 current_attention = self.attention_loader(new_path)
+        """Returns a (top_k, H, W) tensor with the top_k attention masks with the highest probability
 
-                 # only save the attention mask probability
-                 file = file.split("_")[1].split(".jpg")[0]
+        The masks are picked based on the probability in the file names (or in the attention mask index)
+        so only the top_k masks are decoded instead of all 100
+        """
 
+        path = os.path.join(self.attention_path, folder, "image_0{}/data".format(self.side_map[side]), "{:010d}".format(int(frame_index)))
 
-                 if do_flip:
-                     current_attention = current_attention.transpose(pil.FLIP_LEFT_RIGHT)
+        if self.attention_index is not None:
+            frame = self.attention_index.get_frame(folder, self.side_map[side], frame_index)
+            files, probs = frame["names"], frame["probs"]
+        else:
+            files = sorted(os.listdir(path))
+            probs = np.array([mask_probability(file) for file in files])
 
-                 # if there is already a attention mask with the same prob.. make a list with masks wich have the same prob
-                 if file in attention_masks:
-                     current_list = attention_masks[file]
-                     current_list.append(current_attention)
-                     attention_masks[file] = current_list
-                     mask_amount += 1
+        assert len(files) == 100, "There should be 100 attention masks saved for this kitti image. its now {}".format(len(files))
 
-                 # if there is not a attention mask with the same prob number
-                 else:
+        # highest probability first
+        top_k_mask_nrs = np.argsort(-probs, kind="stable")[:self.top_k]
 
-                    attention_masks[file] = [current_attention]
-                    mask_amount += 1
+        top_k_masks = torch.empty(self.top_k, self.height, self.width)
+        for i, mask_nr in enumerate(top_k_mask_nrs):
+            top_k_masks[i] = self.to_tensor(self.attention_loader(os.path.join(path, files[mask_nr])))
 
-        return attention_masks, mask_amount
+        if do_flip:
+            top_k_masks = torch.flip(top_k_masks, [2])
 
+        return top_k_masks
 
 
 class KITTIRAWDataset(KITTIDataset):
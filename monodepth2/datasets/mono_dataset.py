@@ -16,6 +16,9 @@ import torch
 import torch.utils.data as data
 from torchvision import transforms
 
+from .attention_masks import pack_attention_masks, load_attention_index
+from .weight_matrix_store import WeightMatrixStore
+
 
 def pil_loader(path):
 
@@ -42,6 +45,14 @@ class MonoDataset(data.Dataset):
         num_scales
         is_train
         img_ext
+        attention_shard_path    optional root of the packed attention masks made by pack_attention_masks.py
+        pack_attention_masks    if True, inputs["attention"] is emitted as bit packed uint8 masks
+        ragged_attention_masks  if True, inputs["attention"] is not padded to 100 masks and inputs["attention_count"]
+                                holds the amount of masks. Use with collate_attention_masks
+        attention_index_path    optional attention mask index made by index_attention_masks.py
+        weight_matrix_store_path  optional root of the weight matrix arrays made by build_weight_matrix_store.py
+        weight_matrix_on_the_fly  if True, the attention masks are loaded instead of the weight matrix,
+                                  which is then computed by the trainer
     """
     def __init__(self,
                  convolution_experiment,
@@ -60,7 +71,13 @@ class MonoDataset(data.Dataset):
                  frame_idxs,
                  num_scales,
                  is_train=False,
-                 img_ext='.jpg',):
+                 img_ext='.jpg',
+                 attention_shard_path=None,
+                 pack_attention_masks=False,
+                 ragged_attention_masks=False,
+                 attention_index_path=None,
+                 weight_matrix_store_path=None,
+                 weight_matrix_on_the_fly=False):
         super(MonoDataset, self).__init__()
 
         self.convolution_experiment = convolution_experiment
@@ -72,6 +89,19 @@ class MonoDataset(data.Dataset):
         self.edge_loss = edge_loss
         self.attention_threshold = attention_threshold
         self.attention_path = attention_path
+        self.attention_shard_path = attention_shard_path
+        self.pack_attention_masks = pack_attention_masks
+        self.ragged_attention_masks = ragged_attention_masks
+
+        self.attention_index = None
+        if attention_index_path is not None:
+            self.attention_index = load_attention_index(attention_index_path)
+
+        self.weight_matrix_on_the_fly = weight_matrix_on_the_fly
+
+        self.weight_matrix_store = None
+        if weight_matrix_store_path is not None:
+            self.weight_matrix_store = WeightMatrixStore(weight_matrix_store_path, self.attention_threshold, self.weight_mask_method)
         self.data_path = data_path
         self.filenames = filenames
         self.height = height
@@ -209,12 +239,13 @@ class MonoDataset(data.Dataset):
 
                 inputs[("color", i, -1)] = self.get_color(folder, frame_index + i, side, do_flip)
 
-                if i == 0:
+                # the weight matrix is always needed, also for the attention_mask_loss
+                if i == 0 and not self.weight_matrix_on_the_fly:
                     weight_matrix = self.get_weight_matrix(folder, frame_index, side, do_flip)
                     inputs[("weight_matrix")] = weight_matrix
 
             # only add the attention masks for the target frame (frame 0)
-                if self.edge_loss:
+                if self.edge_loss or self.weight_matrix_on_the_fly:
                     if i == 0:
 
                         # look up attention masks for target frame
@@ -223,7 +254,12 @@ class MonoDataset(data.Dataset):
 
                         # # attention_masks_dict['68_0_858.jpg']: (235, M)
                         mask_sizes = np.array([attention_masks_dict[key][0] for key in attention_masks_dict])
-                        masks = torch.from_numpy(np.vstack([attention_masks_dict[key][1] for key in attention_masks_dict]))
+                        if attention_masks_dict:
+                            masks = torch.from_numpy(np.vstack([attention_masks_dict[key][1] for key in attention_masks_dict]))
+                        else:
+                            # no mask has a prob above attention_threshold, zero masks give a weight matrix of
+                            # all ones, the same as pre_process_weight_matrix saves for such a frame
+                            masks = torch.zeros(0, self.height, self.width)
 
                         mask_order = mask_sizes.argsort()
 
@@ -235,54 +271,25 @@ class MonoDataset(data.Dataset):
                         # check how many dimension are missing to create a 100, 192, 640 tensor such then every image got same dimensions
                         diff = zeros.shape[0] - masks_sorted.shape[0]
 
-                        masks_sorted = torch.cat([masks_sorted, torch.zeros(diff, self.height, self.width)])
+                        if self.pack_attention_masks:
+                            # 100, 192, 80 uint8 with 1 bit per pixel, unpacked again on the training device
+                            masks_sorted = pack_attention_masks(masks_sorted)
+
+                        if self.ragged_attention_masks:
+                            # no padding, collate_attention_masks concatenates the masks of the batch
+                            inputs[("attention_count")] = torch.tensor(masks_sorted.shape[0])
+                        else:
+                            masks_sorted = torch.cat([masks_sorted, torch.zeros(diff, *masks_sorted.shape[1:], dtype=masks_sorted.dtype)])
 
                         # print(masks_sorted.shape)
 
                         inputs[("attention")] = masks_sorted
 
-                if self.attention_mask_loss:
-                    if i == 0:
-                        weight_matrix = self.get_weight_matrix(folder, frame_index, side, do_flip)
-                        inputs[("weight_matrix")] = weight_matrix
-
                 if self.convolution_experiment:
                     if i == 0:
 
-                        # look up 100 attention masks for target frame
-                        attention_masks, mask_amount = self.get_attention_top_k(folder, frame_index, side, do_flip)
-
-                        assert mask_amount == 100, "There should be 100 attention masks saved for this kitti image. its now {}".format(mask_amount)
-
-                        loop_count = 0
-                        a = torch.empty(self.top_k, self.height, self.width)
-
-                        # loop over the dict with keys the prob and value a list of attention mask which have that prob
-                        for key, value in sorted(attention_masks.items(), reverse = True):
-
-                            # if you have found enough attention masks based on the top-k number
-                            if loop_count == self.top_k:
-                                break
-
-                            # if there is only 1 attention mask for this prob
-                            if len(value) == 1:
-
-                                a[loop_count] = transforms.ToTensor()(value[0])
-                                loop_count += 1
-
-                            # if there are more attention mask with the same prob
-                            else:
-
-                                for mask in value:
-
-                                    # if you have found enough attention masks based on the top-k number
-                                    if loop_count == self.top_k:
-                                        break
-
-                                    a[loop_count] = transforms.ToTensor()(mask)
-                                    loop_count +=1
-
-                        inputs[("top_k_masks")] = a
+                        # only the top_k attention masks with the highest probability are decoded
+                        inputs[("top_k_masks")] = self.get_attention_top_k(folder, frame_index, side, do_flip)
 
 
 
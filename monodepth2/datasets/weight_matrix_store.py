@@ -0,0 +1,42 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import numpy as np
+
+from .attention_masks import get_attention_frame_key
+
+
+def get_weight_matrix_store_path(store_path, threshold, method):
+    """Path of the .npy array which holds the weight matrices of all kitti frames for one threshold and method
+    """
+    return os.path.join(store_path, "threshold_{}_method_{}.npy".format(threshold, method))
+
+
+def get_weight_matrix_store_frames_path(store_path, threshold, method):
+    """Path of the frame keys belonging to the rows of get_weight_matrix_store_path
+    """
+    return os.path.join(store_path, "threshold_{}_method_{}_frames.npy".format(threshold, method))
+
+
+class WeightMatrixStore(object):
+    """All (H, W) weight matrices of one threshold and method in one memory mapped (N, H, W) array
+
+    The array is only opened on first use, such that every data loader worker maps the file itself
+    """
+    def __init__(self, store_path, threshold, method):
+        self.path = get_weight_matrix_store_path(store_path, threshold, method)
+        frames = np.load(get_weight_matrix_store_frames_path(store_path, threshold, method))
+
+        self.frame_rows = {str(key): i for i, key in enumerate(frames)}
+        self.weight_matrices = None
+
+    def get(self, folder, side_number, frame_index):
+        """Read only (H, W) view of the weight matrix of one kitti frame
+        """
+        if self.weight_matrices is None:
+            self.weight_matrices = np.load(self.path, mmap_mode='r')
+
+        key = get_attention_frame_key(folder, side_number, frame_index)
+        assert key in self.frame_rows, "There is no weight matrix in {} for {}".format(self.path, key)
+
+        return self.weight_matrices[self.frame_rows[key]]
@@ -4,433 +4,294 @@ import torch
 import numpy as np
 import time
 import seaborn as sns
-import cv2
 import torch.nn.functional as F
 
-def edge_detection_bob_hidde(scale, outputs, inputs, batch_idx, device, height, width, log_dir, model_name, edge_detection_threshold, save_plot_every, batch_size):
+from datasets.attention_masks import split_attention_masks
+from attention_mask_loss import mask_overlap_matrix, find_overlapping_tensors
+from plot_service import plot_inputs
 
-    edges_overall = torch.zeros(batch_size, height, width).clone()
-    edges_overall_test = torch.zeros(batch_size, height, width).clone()
+def select_masks_with_new_edges(shared_edges):
+    """
+    shared_edges: [masks, masks] number of edge pixels every two attention masks have in common, the diagonal
+    is the number of edge pixels inside a mask.
+    Goes over the masks in order and keeps a mask if it has edges and none of them are already found by a kept mask
+    """
+    selected = []
+    for i in range(shared_edges.shape[0]):
+        if shared_edges[i, i] > 0 and not shared_edges[i, selected].any():
+            selected.append(i)
+    return selected
 
-    path = log_dir + model_name + "/" + "edge_loss_img"
-    if not os.path.exists(path):
-        os.makedirs(path)
 
-    path = f'{path}/{batch_idx}'
-    if not os.path.exists(path):
-        os.mkdir(path)
+def edge_detection_bob_hidde(scale, outputs, inputs, batch_idx, device, height, width, log_dir, model_name, edge_detection_threshold, save_plot_every, batch_size,
+                             plot_service=None):
+    """
+    Counts the depth edges inside the (eroded) attention masks. The edges of a mask are only counted
+    if they are not already counted for an earlier mask of the same kitti image.
+    The edges of the whole batch are found in one batched canny on the device, and per kitti image the edges
+    shared between the masks are one matrix product, so only the greedy pick runs on the cpu.
+    The filesystem and host copies for plotting are only touched every save_plot_every steps.
+    If a plot_service is given the plot is made through it, otherwise directly
+    """
 
-    attention_masks = inputs['attention'].to(device)
+    plot = batch_idx % save_plot_every == 0
 
-    attention_masks[attention_masks >= 0.8] = 1
-    attention_masks[attention_masks < 0.8] = 0
+    disp = outputs[("disp", scale)]
 
-    attention_masks_plot = attention_masks
+    # dit zijn alle edges gevonden over het gehele diepte plaatje
+    edges_disp = canny_edges(disp, edge_detection_threshold)
 
-    disp = outputs[("disp", scale)]
+    edge_pixels = []
+    for b, attention_masks in enumerate(split_attention_masks(inputs)):
 
+        attention_masks = (attention_masks.to(device) >= 0.8).to(torch.float32)
 
-    for b in range(batch_size):
-
-        # path = f'{path}/{b}'
-        # if not os.path.exists(path):
-        #     os.mkdir(path)
-        # cast to int for correct canny input
-        depth_mask = np.uint8(disp[b].squeeze().cpu().detach().numpy() * 255)
-
-        # dit zijn alle edges gevonden over het gehele diepte plaatje
-        edges_disp = torch.from_numpy(cv2.Canny(depth_mask, edge_detection_threshold * 255, edge_detection_threshold * 255,
-                               apertureSize=3, L2gradient=False)) # 0.1
-
-        # edges_disp_0_05 = torch.from_numpy(cv2.Canny(depth_mask, 0.05 * 255, 0.05 * 255,
-        #                        apertureSize=3, L2gradient=False))
-        #
-        # edges_disp_0_20 = torch.from_numpy(cv2.Canny(depth_mask, 0.2 * 255, 0.2 * 255,
-        #                        apertureSize=3, L2gradient=False))
-
-        # if batch_idx % save_plot_every == 0 and b == 0:
-        original_img = inputs["color_aug", 0, 0][b]
-
-        original_img = np.array(original_img.squeeze().cpu().detach().permute(1, 2, 0).numpy())
-
-          # EDGE THRESHOLD
-        # path = log_dir + model_name + "/" + "edge_loss_with_masks"
-        # # path = "edge_img_for_thesis/edge_threshold-hidde"
-        # if not os.path.exists(path):
-        #     print("PATH NOT EXSIST")
-        #     os.makedirs(path)
-        # path = f'{path}/{batch_idx}'
-        # if not os.path.exists(path):
-        #     os.mkdir(path)
-
-
-        # print(path_edge_threshold)
-
-        # fig, axis = plt.subplots(5, 1, figsize=(12, 12))
-        #
-        # font_nr = 20
-        # # EDGE THRESHOLDS PLAATJE
-        #
-        # axis[0].imshow(original_img)
-        # axis[0].set_title('Kitti image', fontsize=font_nr)
-        # # axis[0].title.set_text('Original image')
-        # axis[0].axis('off')
-        # np.save(os.path.join(path, 'original_img.npy'), original_img)
-        # #
-        # #
-        # axis[1].imshow(disp[b].squeeze(0).squeeze(0).cpu().detach().numpy())
-        # axis[1].set_title('Depth image', fontsize=font_nr)
-        # # axis[1].title.set_text('depth image')
-        # axis[1].axis('off')
-        # np.save(os.path.join(path, 'disp.npy'), disp[b].squeeze(0).squeeze(0).cpu().detach().numpy())
-        # #
-        # #
-        # axis[2].imshow(edges_disp_0_05 / 255)
-        # axis[2].set_title('Edge detection threshold 0.05', fontsize=font_nr)
-        # # axis[2].title.set_text('edges threshold 0.05')
-        # axis[2].axis('off')
-        # np.save(os.path.join(path, 'edges_disp_0_05.npy'), edges_disp_0_05)
-        # #
-        # #
-        # axis[3].set_title('Edge detection threshold 0.1', fontsize=font_nr)
-        # axis[3].imshow(edges_disp / 255)
-        # # axis[3].title.set_text('edges threshold 0.1')
-        # axis[3].axis('off')
-        # np.save(os.path.join(path, 'edges_disp_0.10.npy'), edges_disp)
-        # #
-        # #
-        # axis[4].imshow(edges_disp_0_20 / 255)
-        # axis[4].set_title('Edge detection threshold 0.2', fontsize=font_nr)
-        # # axis[4].title.set_text('edges threshold 0.2')
-        # axis[4].axis('off')
-        # np.save(os.path.join(path, 'edges_disp_0_20.npy'), edges_disp_0_20)
-        # #
-        # # fig.subplots_adjust(left=None, bottom=None, right=None, top=None, wspace=None, hspace=.4)
-        # #
-        # fig.savefig(
-        #     '{}/batchIDX_{}_threshold_{}_scale{}.png'.format(path, batch_idx,
-        #                                                           edge_detection_threshold, scale))
-        # plt.close('all')
-
-
-
-        # # EDGE PLAATJE BEGIN VAN TRAINING
-        # original_img = inputs["color_aug", 0, 0][b]
-        # #
-        # original_img = np.array(original_img.squeeze().cpu().detach().permute(1, 2, 0).numpy())
-        # #
-        #
-        # path_edge_start_training = f"edge_img_for_thesis/edge_start_training-hidde/{batch_idx}"
-        # if not os.path.exists(path_edge_start_training):
-        #     print("PATH NOT EXSIST")
-        #     os.makedirs(path_edge_start_training)
-        # path = path_edge_start_training
-        # #
-        # # print(path_edge_threshold)
-        # if batch_idx % 100 == 0:
-        #     fig, axis = plt.subplots(3, 1, figsize=(12, 12))
-        #     #
-        #     font_nr = 20
-        #     #
-        #     axis[0].imshow(original_img)
-        #     axis[0].set_title('Kitti image', fontsize=font_nr)
-        #     # axis[0].title.set_text('Original image')
-        #     axis[0].axis('off')
-        #     np.save(os.path.join(path, 'original_img.npy'), original_img)
-        #
-        #     #
-        #     axis[1].imshow(disp[b].squeeze(0).squeeze(0).cpu().detach().numpy())
-        #     axis[1].set_title('Depth image', fontsize=font_nr)
-        #     # axis[1].title.set_text('depth image')
-        #     axis[1].axis('off')
-        #     np.save(os.path.join(path, 'disp.npy'), disp[b].squeeze(0).squeeze(0).cpu().detach().numpy())
-        #
-        #
-        #
-        #     axis[2].set_title('Edges', fontsize=font_nr)
-        #     axis[2].imshow(edges_disp / 255)
-        #     # axis[3].title.set_text('edges threshold 0.1')
-        #     axis[2].axis('off')
-        #     np.save(os.path.join(path, 'edges_disp.npy'), edges_disp)
-        #
-        #
-        #
-        #     fig.savefig(
-        #         '{}/batchIDX_{}_threshold_{}_scale{}.png'.format(path_edge_start_training, batch_idx,
-        #                                                               edge_detection_threshold, scale))
-        #     plt.close('all')
-        #
-        #
-        #
-        #
-        #
-        #
-
-        # loop over the attention masks per kitti image
-        for i, attention_mask in enumerate(attention_masks[b].squeeze(dim=0)):
-
-            # the last x attention masks are zeros so skip them
-            if attention_mask.sum().item() == 0:
-                break
-
-            kernel = np.ones((3, 3), np.uint8)
-            attention_mask = np.uint8(attention_mask.cpu().detach().numpy())
-            attention_mask_light = cv2.erode(attention_mask, kernel, iterations=3)
-
-            # these are the edges inside the attention mask
-            edges_per_attention_mask = torch.tensor(attention_mask_light).to(torch.float32) * edges_disp.to(torch.float32).cpu()
-
-
-            # if sum == 0 then the found edges from attention mask are not yet in the overall edges
-            # sum == zero zodat je checkt dat deze edges not niet eerder zijn gebruikt
-            if (edges_per_attention_mask * edges_overall[b]).sum().item() == 0 and (edges_per_attention_mask > 0).any():
-
-                edges_overall[b] += (edges_per_attention_mask / 255)
-
-    if batch_idx % save_plot_every == 0:
-
-        b = 0
-
-        fig, axis = plt.subplots(3, 1, figsize=(12, 12))
-
-        original_img = inputs["color_aug", 0, 0][b]
-        original_img = np.array(original_img.squeeze().cpu().detach().permute(1, 2, 0).numpy())
-        # np.save(os.path.join(path, 'original_img.npy'), original_img)
-
-        axis[0].imshow(original_img)
-        axis[0].title.set_text('Original image')
-        axis[0].axis('off')
-        # np.save(os.path.join(path, 'original_img.npy'), original_img)
-
-        axis[1].imshow(disp[b].squeeze(0).squeeze(0).cpu().detach().numpy())
-        axis[1].title.set_text('depth imagw')
-        axis[1].axis('off')
-        # np.save(os.path.join(path, 'disp.npy'), disp[b].squeeze(0).squeeze(0).cpu().detach().numpy())
-
-        axis[2].imshow(edges_overall[b].cpu().detach().numpy())
-        axis[2].title.set_text(f'all edges found after erosion{edges_overall[b].sum()}')
-        axis[2].axis('off')
-        # np.save(os.path.join(path, 'edges_overall.npy'), edges_overall[b].cpu().detach().numpy())
-
-        fig.savefig(
-            '{}/batchIDX_{}_threshold_{}_i_{}_scale{}.png'.format(path, batch_idx,
-                                                              edge_detection_threshold, i, scale))
-        plt.close('all')
-
-    # if batch_idx % save_plot_every == 0 and b == 0:
-    #
-    #     original_img = inputs["color_aug", 0, 0][b]
-    #
-    #     original_img = np.array(original_img.squeeze().cpu().detach().permute(1, 2, 0).numpy())
-    #     np.save(os.path.join(path, 'original_img.npy'), original_img)
-    #
-    #     fig, axis = plt.subplots(4, 1, figsize=(12, 12))
-    #
-    #     axis[0].imshow(original_img)
-    #     axis[0].title.set_text('Original image')
-    #     axis[0].axis('off')
-    #     np.save(os.path.join(path, 'original_img.npy'), original_img)
-    #
-    #     axis[1].imshow(disp[b].squeeze(0).squeeze(0).cpu().detach().numpy())
-    #     axis[1].title.set_text('depth image')
-    #     axis[1].axis('off')
-    #     np.save(os.path.join(path, 'disp.npy'), disp[b].squeeze(0).squeeze(0).cpu().detach().numpy())
-    #
-    #     axis[2].imshow(edges_overall[b].cpu().detach().numpy())
-    #     axis[2].title.set_text(f'edge overall with erions {edges_overall[b].sum()}')
-    #     axis[2].axis('off')
-    #     np.save(os.path.join(path, 'edges_overall_light.npy'), edges_overall[b].cpu().detach().numpy())
-    #
-    #     axis[3].imshow(edges_overall_test[b].cpu().detach().numpy())
-    #     axis[3].title.set_text(f'edges overal without erosion {edges_overall_test[b].sum()}')
-    #     axis[3].axis('off')
-    #     np.save(os.path.join(path, 'edges_overall_test.npy'), edges_overall_test[b].cpu().detach().numpy())
-    #
-    #
-    #     # print("save", path)
-    #
-    #     fig.savefig(
-    #         '{}/batchIDX_{}_threshold_{}_i_{}_scale{}.png'.format(path, batch_idx,
-    #                                                           edge_detection_threshold, i, scale))
-    #     plt.close('all')
-
-    return edges_overall.sum()
-
-def edge_detection_loss(self, scale, outputs, inputs, attention_mask, batch_idx, index_nrs_not_overlapping,
-                        original_attention):
-    """"
-    scale: this selects the correct depth image
-    outputs: for selecting the depth image
-    inputs: for selecting the original kitti image
-    attention_mask: these are the not overlapping attention masks
-    batch_idx: iteration number during training. This is needed because every 250 steps, save the edge image
-    index_nrs_not_overlapping: these are the index numbers of the not overlapping masks, needed for indexing
-    original_attention: needed for plotting every 250 steps
-    """
+        # these are the edges inside every attention mask after erosion, [masks, 192 * 640]
+        mask_edges = (erode(attention_masks.unsqueeze(1), kernel_size=3, iterations=3) * edges_disp[b]).flatten(1)
 
-    edge_loss = []
+        shared_edges = torch.mm(mask_edges, mask_edges.t())
+        selected = select_masks_with_new_edges(shared_edges.cpu().numpy())
 
-    # set this on if you want to double check if the tensors are not overlapping.
-    # self.additional_not_overlapping_check(attention_mask)
+        # the selected masks have no edges in common, so the edges found are the sum of their edge pixels
+        edge_pixels.append(torch.diagonal(shared_edges)[selected].sum())
 
-    attention_mask = torch.clone(attention_mask).to(self.device)
+        if plot and b == 0:
+            edges_overall = mask_edges[selected].sum(0).view(height, width)
+            amount_masks = attention_masks.shape[0]
 
-    # set all the negative values to zero. the values were negative to make sure no overlapping values were found
-    # curing the attention_mask_weight function
-    attention_mask[attention_mask <= -1] = 0
+    if plot:
+        args = (plot_inputs(inputs, 1), disp[:1], edges_overall, batch_idx, log_dir, model_name, edge_detection_threshold,
+                amount_masks, scale)
+        if plot_service is None:
+            plot_edges_overall(*args)
+        else:
+            plot_service.submit(plot_edges_overall, *args)
 
-    # breakpoint()
-    disp = outputs[("disp", scale)].to(self.device)
+    return torch.stack(edge_pixels).sum()
 
-    # upsample to kitti size for correct multiplication with attention_mask
-    disp = F.interpolate(
-        disp, [self.opt.height, self.opt.width], mode="bilinear", align_corners=False).to(self.device)
 
-    # sum all the attention mask together in 1 attention tensor for faster computation. This is possible because there are not overlalping maps # attention_mask [2, 1, 192, 640]
-    attention_mask = attention_mask.sum(1).unsqueeze(1).to(self.device)
+def plot_edges_overall(inputs, disp, edges_overall, batch_idx, log_dir, model_name, edge_detection_threshold, amount_masks, scale):
+    """
+    Plot the kitti image, the depth image and the edges found inside the attention masks of the first image in the batch
+    """
 
-    assert attention_mask.max() == 1, "sum of attention masks is greater than one .. probably overlapping masks"
+    path = log_dir + model_name + "/" + "edge_loss_img"
+    path = f'{path}/{batch_idx}'
+    if not os.path.exists(path):
+        os.makedirs(path)
 
-    # create only the depth pixels that lie inside the attention mask
-    depth_mask = (attention_mask * disp).squeeze(0).squeeze(0).to(self.device)
+    b = 0
 
-    # breakpoint()
-    if self.opt.batch_size > 1:
-        # 1, 1 192 * batch_size , 640. so paste the images under eachother such that you only have to do edge detection once
-        depth_mask = depth_mask.view(self.opt.height * self.opt.batch_size, self.opt.width).to(self.device)
+    fig, axis = plt.subplots(3, 1, figsize=(12, 12))
 
-    depth_mask = np.array(depth_mask.cpu().detach().numpy())
+    original_img = inputs["color_aug", 0, 0][b]
+    original_img = np.array(original_img.squeeze().cpu().detach().permute(1, 2, 0).numpy())
 
-    # * 255 for canny edge working
-    depth_mask = depth_mask * 255
+    axis[0].imshow(original_img)
+    axis[0].title.set_text('Original image')
+    axis[0].axis('off')
 
-    # cast to int for correct canny input
-    depth_mask = np.uint8(depth_mask)
+    axis[1].imshow(disp[b].squeeze(0).squeeze(0).cpu().detach().numpy())
+    axis[1].title.set_text('depth imagw')
+    axis[1].axis('off')
 
-    # # prepare images for plotting
-    if batch_idx % self.opt.save_plot_every == 0 and scale == 0:
-        disp_min, disp_max, original_img, disp, path, attention_mask = self.prepare_edge_plot(disp, inputs,
-                                                                                              attention_mask)
+    axis[2].imshow(edges_overall.cpu().detach().numpy())
+    axis[2].title.set_text(f'all edges found after erosion{edges_overall.sum()}')
+    axis[2].axis('off')
 
-    edges_disp = cv2.Canny(depth_mask, self.opt.edge_detection_threshold * 255, self.opt.edge_detection_threshold * 255,
-                           apertureSize=3, L2gradient=False)
-    kernel = np.ones((5, 5), np.uint8)
-    erosion = cv2.erode(depth_mask, kernel, iterations=3)
-    result = cv2.bitwise_and(edges_disp, edges_disp, mask=erosion)
+    fig.savefig(
+        '{}/batchIDX_{}_threshold_{}_i_{}_scale{}.png'.format(path, batch_idx,
+                                                          edge_detection_threshold, amount_masks, scale))
+    plt.close('all')
 
-    for b in range(self.opt.batch_size - 1):
-        # remove edges between the stacked images borders
-        number = (b + 1) * (self.opt.height)
-        result[number] = 0
-        result[number - 1] = 0
 
-    # if you found an edge and save the image. only once in the self.opt.save_edge_img steps because of computational speed
-    if result.sum() > 0 and batch_idx % self.opt.save_plot_every == 0 and scale == 0:
-        # print("SAVEEUU")
+# tan(22.5) and tan(67.5), the same direction bins as cv2.Canny uses for the non maximum suppression
+TAN_22_5 = 0.4142135623730951
+TAN_67_5 = 2.414213562373095
 
-        fig, ax = plt.subplots(6, 1, figsize=(12, 12))
 
-        # 2, 192, 640, 3
-        ax[0].imshow(original_img)
-        ax[0].title.set_text('Original image')
-        ax[0].axis('off')
-        #
-        # # 2, 192, 640
-        ax[1].imshow(disp)
-        ax[1].title.set_text('disp')
-        ax[1].axis('off')
+def sobel_gradients(images):
+    """
+    images: [batch, 1, H, W]
+    3x3 sobel x and y gradients with replicated borders, like cv2.Canny with apertureSize=3
+    """
+    kernel_x = torch.tensor([[-1., 0., 1.],
+                             [-2., 0., 2.],
+                             [-1., 0., 1.]], device=images.device, dtype=images.dtype)
+    kernels = torch.stack([kernel_x, kernel_x.t()]).unsqueeze(1)
 
-        # ax[2].imshow(original_attention.cpu()[batch][index_nrs_not_overlapping[batch][attention]], cmap='cividis')
-        # ax[2].title.set_text('Original attention mask')
-        # ax[2].axis('off')
+    gradients = F.conv2d(F.pad(images, (1, 1, 1, 1), mode='replicate'), kernels)
 
-        # # #2, 1, 192, 640
-        ax[2].imshow(attention_mask.cpu(), cmap='cividis')
-        ax[2].title.set_text('Casted attention mask')
-        ax[2].axis('off')
+    return gradients[:, 0:1], gradients[:, 1:2]
 
 
+def non_maximum_suppression(magnitude, grad_x, grad_y):
+    """
+    Keeps the pixels whose gradient magnitude is a local maximum along the gradient direction,
+    with the same direction bins and tie breaking as cv2.Canny
+    """
+    height, width = magnitude.shape[-2:]
+    padded = F.pad(magnitude, (1, 1, 1, 1))
 
-        ax[3].imshow(depth_mask, vmin=disp_min, vmax=disp_max)
-        ax[3].title.set_text('depth mask')
-        ax[3].axis('off')
+    def neighbour(dy, dx):
+        return padded[..., 1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
 
-        ax[4].imshow(edges_disp)
-        ax[4].title.set_text('Edges disp before erosion')
-        ax[4].axis('off')
+    abs_x = grad_x.abs()
+    abs_y = grad_y.abs()
 
-        ax[5].imshow(result)
-        ax[5].title.set_text('Edges disp after erosion')
-        ax[5].axis('off')
+    horizontal = abs_y < abs_x * TAN_22_5
+    vertical = abs_y > abs_x * TAN_67_5
+    same_sign = (grad_x * grad_y) >= 0
 
-        # plt.show()
+    keep_horizontal = (magnitude > neighbour(0, -1)) & (magnitude >= neighbour(0, 1))
+    keep_vertical = (magnitude > neighbour(-1, 0)) & (magnitude >= neighbour(1, 0))
+    keep_diagonal = torch.where(same_sign,
+                                (magnitude > neighbour(-1, -1)) & (magnitude > neighbour(1, 1)),
+                                (magnitude > neighbour(-1, 1)) & (magnitude > neighbour(1, -1)))
 
-        fig.savefig(
-            '{}/epoch_{}_batchIDX_{}_result_{}_threshold_{}.png'.format(path, self.epoch, batch_idx, result.sum() / 255,
-                                                                        self.opt.edge_detection_threshold))
-        plt.close()
+    return torch.where(horizontal, keep_horizontal, torch.where(vertical, keep_vertical, keep_diagonal))
 
-    if result.sum() > 0:
-        edge_loss.append(result.sum())
 
-    edge_loss = torch.FloatTensor(edge_loss).to(self.device)
+def canny_edges(images, threshold, soft=False, temperature=1.0):
+    """
+    images: [batch, 1, H, W] with values between 0 and 1
+    threshold: edge threshold between 0 and 1, like edge_detection_threshold
+    Batched torch version of cv2.Canny(np.uint8(images * 255), threshold * 255, threshold * 255, apertureSize=3)
+    with the low and high threshold equal, so without hysteresis. Returns a [batch, 1, H, W] tensor with 1 for edges.
+    If soft, the images are not quantized and the threshold is a sigmoid, such that the edges have a gradient
+    """
+    if soft:
+        images = images * 255
+    else:
+        images = torch.floor(images.detach() * 255)
+
+    grad_x, grad_y = sobel_gradients(images)
+    magnitude = grad_x.abs() + grad_y.abs()
 
-    # divide by 255 because 1 pixels should have value 1 not 255
-    loss = torch.mean(edge_loss) / 255
+    # which pixels are edges is never differentiable, only how strong they are in the soft variant
+    maxima = non_maximum_suppression(magnitude.detach(), grad_x.detach(), grad_y.detach())
 
-    if torch.isnan(loss):
-        loss = 0
+    if soft:
+        return maxima * torch.sigmoid((magnitude - threshold * 255) / temperature)
 
-    return loss
+    return (maxima & (magnitude > np.floor(threshold * 255))).to(images.dtype)
 
-def prepare_edge_plot(self, disp, inputs, attention_mask):
+
+def erode(images, kernel_size=5, iterations=3):
     """
-    Once in a while make a plot of the edge loss. Therefor prepare the min and max values for correct depth mask plot
-    retreive the original kitti image
-    and set correct dimensions for the depth image
+    Grey scale erosion of a [batch, 1, H, W] tensor with a square kernel via max pooling, like cv2.erode.
+    The borders don't erode, the same as the default border value of cv2.erode
     """
+    for _ in range(iterations):
+        images = -F.max_pool2d(-images, kernel_size, stride=1, padding=kernel_size // 2)
+    return images
 
-    attention_mask = attention_mask.view(self.opt.height * self.opt.batch_size, self.opt.width)
 
-    path = self.opt.log_dir + self.opt.model_name + "/" + "edge_loss_img/"
+def edge_detection_loss(self, outputs, inputs, attention_mask, batch_idx, index_nrs_not_overlapping,
+                        original_attention):
+    """"
+    outputs: for selecting the depth images
+    inputs: for selecting the original kitti image
+    attention_mask: these are the not overlapping attention masks
+    batch_idx: iteration number during training. This is needed because every 250 steps, save the edge image
+    index_nrs_not_overlapping: these are the index numbers of the not overlapping masks, needed for indexing
+    original_attention: needed for plotting every 250 steps
+    Returns a dict with the edge loss per scale. The edges of all scales and images in the batch are found
+    in one batched canny on the device instead of cv2 per scale. With --soft_edge_loss the loss has a gradient
+    """
 
-    # print("EDGE LOSS PATH", path)
+    # set this on if you want to double check if the tensors are not overlapping.
+    # additional_not_overlapping_check(self, attention_mask)
 
+    attention_mask = torch.clone(attention_mask).to(self.device)
 
-    if not os.path.exists(path):
-        os.makedirs(path)
+    # set all the negative values to zero. the values were negative to make sure no overlapping values were found
+    # curing the attention_mask_weight function
+    attention_mask[attention_mask <= -1] = 0
+
+    # sum all the attention mask together in 1 attention tensor for faster computation. This is possible because there are not overlalping maps # attention_mask [2, 1, 192, 640]
+    attention_mask = attention_mask.sum(1).unsqueeze(1)
+
+    assert attention_mask.max() == 1, "sum of attention masks is greater than one .. probably overlapping masks"
+
+    # upsample to kitti size for correct multiplication with attention_mask, and put all scales after each other
+    # [scales * batch, 1, 192, 640]
+    disp = torch.cat([F.interpolate(outputs[("disp", scale)], [self.opt.height, self.opt.width], mode="bilinear",
+                                    align_corners=False) for scale in self.opt.scales])
+
+    # create only the depth pixels that lie inside the attention mask
+    depth_mask = attention_mask.repeat(len(self.opt.scales), 1, 1, 1) * disp
 
+    edges_disp = canny_edges(depth_mask, self.opt.edge_detection_threshold, soft=self.opt.soft_edge_loss)
 
-    disp = disp.view(self.opt.height * self.opt.batch_size, self.opt.width)
+    # only keep the edges which lie well inside the attention mask
+    erosion = erode(torch.floor(depth_mask.detach() * 255))
+    result = edges_disp * (erosion > 0).to(edges_disp.dtype)
 
-    disp_min = np.uint8(disp.min().cpu().detach().numpy() * 255)
-    disp_max = np.uint8(disp.max().cpu().detach().numpy() * 255)
+    # sum of the edge pixels per scale
+    edge_pixels = result.view(len(self.opt.scales), -1).sum(-1)
 
-    original_img = inputs["color_aug", 0, 0]
+    # save the image only once in the self.opt.save_plot_every steps because of computational speed
+    if batch_idx % self.opt.save_plot_every == 0 and edge_pixels[0] > 0:
+        batch_size = attention_mask.shape[0]
+        self.plot_service.submit(plot_edge_loss, self, plot_inputs(inputs), disp[:batch_size], attention_mask,
+                                 depth_mask[:batch_size], edges_disp[:batch_size], result[:batch_size], batch_idx)
 
+    return {scale: edge_pixels[i] for i, scale in enumerate(self.opt.scales)}
 
 
-    original_img = original_img.view(self.opt.height * self.opt.batch_size, self.opt.width, 3)
-    # depth_mask = depth_mask.view(self.opt.height * self.opt.batch_size, self.opt.width, 3)
+def plot_edge_loss(self, inputs, disp, attention_mask, depth_mask, edges_disp, result, batch_idx):
+    """
+    Plot the edges of scale 0 for all images in the batch under each other
+    """
 
-    original_img = np.array(original_img.cpu().detach().numpy())
+    path = self.opt.log_dir + self.opt.model_name + "/" + "edge_loss_img/"
+    if not os.path.exists(path):
+        os.makedirs(path)
 
+    def stacked(tensor):
+        # [batch, c, 192, 640] -> [batch * 192, 640, c]
+        return tensor.detach().permute(0, 2, 3, 1).reshape(-1, tensor.shape[-1], tensor.shape[1]).squeeze(-1).cpu().numpy()
 
-    # original_img = np.swapaxes(original_img, 1, 2)
-    # original_img = np.swapaxes(original_img, 0, 1)
+    disp_min = np.uint8(disp.min().item() * 255)
+    disp_max = np.uint8(disp.max().item() * 255)
 
+    fig, ax = plt.subplots(6, 1, figsize=(12, 12))
 
-    # filter out dimension for correct plotting
-    disp = disp.squeeze(1)
-    disp = np.array(disp.cpu().detach().numpy())
+    ax[0].imshow(stacked(inputs["color_aug", 0, 0]))
+    ax[0].title.set_text('Original image')
+    ax[0].axis('off')
 
-    return disp_min, disp_max, original_img, disp, path, attention_mask
+    ax[1].imshow(stacked(disp))
+    ax[1].title.set_text('disp')
+    ax[1].axis('off')
 
+    ax[2].imshow(stacked(attention_mask), cmap='cividis')
+    ax[2].title.set_text('Casted attention mask')
+    ax[2].axis('off')
 
+    ax[3].imshow(np.uint8(stacked(depth_mask) * 255), vmin=disp_min, vmax=disp_max)
+    ax[3].title.set_text('depth mask')
+    ax[3].axis('off')
+
+    ax[4].imshow(stacked(edges_disp))
+    ax[4].title.set_text('Edges disp before erosion')
+    ax[4].axis('off')
+
+    ax[5].imshow(stacked(result))
+    ax[5].title.set_text('Edges disp after erosion')
+    ax[5].axis('off')
+
+    fig.savefig(
+        '{}/epoch_{}_batchIDX_{}_result_{}_threshold_{}.png'.format(path, self.epoch, batch_idx, result.sum().item(),
+                                                                    self.opt.edge_detection_threshold))
+    plt.close()
 
 
 def additional_not_overlapping_check(self, attention_mask):
     # additional check if the not overlapping masks are not overlapping
+    overlap_matrix = mask_overlap_matrix(attention_mask)
+
     for batch in range(self.opt.batch_size):
 
         # loop over the attention masks per batch
@@ -444,7 +305,7 @@ def additional_not_overlapping_check(self, attention_mask):
             masks_to_compare_with = np.arange(0, attention_mask[batch].shape[0])
 
             # you want to compare the mask x from batch x with the attention_masks y from batch x
-            overlap = find_overlapping_tensors(batch, mask, masks_to_compare_with, attention_mask)
+            overlap = find_overlapping_tensors(batch, mask, masks_to_compare_with, overlap_matrix)
 
             assert len(overlap) == 1, "there are still overlapping values"
 
@@ -0,0 +1,112 @@
+from __future__ import absolute_import, division, print_function
+
+import queue
+import threading
+import traceback
+import collections
+
+import torch
+import torch.nn.functional as F
+
+from utils import normalize_image
+
+
+def collect_log_images(opt, inputs, outputs):
+    """The (tag, image) pairs which Trainer.log writes to tensorboard, still on the device
+
+    Only the scales in opt.log_image_scales (all scales if not set) are collected,
+    and the images are downsampled by opt.log_image_downsample
+    """
+    scales = opt.scales if opt.log_image_scales is None else opt.log_image_scales
+
+    def downsample(image):
+        if opt.log_image_downsample == 1:
+            return image
+        return F.interpolate(image[None, ...].float(), scale_factor=1 / opt.log_image_downsample, mode="area")[0]
+
+    images = []
+    for j in range(min(4, opt.batch_size)):  # write a maxmimum of four images
+        for s in scales:
+            for frame_id in opt.frame_ids:
+                images.append(("color_{}_{}/{}".format(frame_id, s, j),
+                               downsample(inputs[("color", frame_id, s)][j].data)))
+                if s == 0 and frame_id != 0:
+                    images.append(("color_pred_{}_{}/{}".format(frame_id, s, j),
+                                   downsample(outputs[("color", frame_id, s)][j].data)))
+
+            images.append(("disp_{}/{}".format(s, j), downsample(normalize_image(outputs[("disp", s)][j]))))
+
+            if opt.predictive_mask:
+                for f_idx, frame_id in enumerate(opt.frame_ids[1:]):
+                    images.append(("predictive_mask_{}_{}/{}".format(frame_id, s, j),
+                                   downsample(outputs["predictive_mask"][("disp", s)][j, f_idx][None, ...])))
+
+            elif not opt.disable_automasking:
+                images.append(("automask_{}/{}".format(s, j),
+                               downsample(outputs["identity_selection/{}".format(s)][j][None, ...])))
+
+    return images
+
+
+class ImageLogWriter:
+    """Writes the tensorboard images of Trainer.log in a background thread, such that the training step
+    doesn't wait on encoding the pngs
+
+    submit copies the images to the host with non blocking transfers, the thread waits for the copies
+    to be finished before writing. Only every opt.log_images_every-th submit per mode is written,
+    and when the thread is still busy with queue_size earlier submits the images are dropped
+    """
+    def __init__(self, opt, writers, queue_size=2):
+        self.opt = opt
+        self.writers = writers
+        self.submits = collections.Counter()
+        self.dropped = 0
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, mode, inputs, outputs, step):
+        self.submits[mode] += 1
+        if (self.submits[mode] - 1) % self.opt.log_images_every != 0:
+            return
+
+        if self.queue.full():
+            self.dropped += 1
+            return
+
+        images = collect_log_images(self.opt, inputs, outputs)
+        host_images = [(tag, image.detach().to("cpu", non_blocking=True, copy=True)) for tag, image in images]
+
+        copied = None
+        if any(image.is_cuda for _, image in images):
+            copied = torch.cuda.Event()
+            copied.record()
+
+        self.queue.put((mode, host_images, step, copied))
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+
+            mode, images, step, copied = job
+            try:
+                if copied is not None:
+                    copied.synchronize()
+
+                for tag, image in images:
+                    self.writers[mode].add_image(tag, image, step)
+            except Exception:
+                print("writing the {} images of step {} failed".format(mode, step))
+                traceback.print_exc()
+
+    def close(self, timeout=60):
+        """Write the images which are still queued and stop the thread
+        """
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
@@ -0,0 +1,75 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import argparse
+import numpy as np
+
+from datasets.mono_dataset import pil_loader_attention
+from datasets.attention_masks import MASK_THRESHOLD, mask_probability, get_attention_frame_key, \
+    save_attention_index
+
+
+def index_frame(frame_dir, files):
+    """Probabilities and binarized pixel sizes of the attention masks of one kitti frame
+    """
+    names = sorted(files)
+    probs = [mask_probability(name) for name in names]
+    sizes = []
+
+    for name in names:
+        # same scaling as transforms.ToTensor so the sizes are the same as the size_check in get_attention
+        mask = np.asarray(pil_loader_attention(os.path.join(frame_dir, name)), dtype=np.float32) / 255 >= MASK_THRESHOLD
+        sizes.append(int(mask.sum()))
+
+    return names, probs, sizes
+
+
+def index_attention_masks():
+
+    parser = argparse.ArgumentParser(description='index_attention_masks')
+
+    parser.add_argument('--attention_path',
+                        type=str,
+                        help='path to the root of the attention masks tree with 100 jpgs per kitti frame',
+                        required=True)
+    parser.add_argument('--output_file',
+                        type=str,
+                        help='where to write the .npz index',
+                        required=True)
+    opt = parser.parse_args()
+
+    print("Indexing attention masks in {}".format(opt.attention_path))
+
+    frames, names, probs, sizes = [], [], [], []
+    for frame_dir, _, files in os.walk(opt.attention_path):
+
+        files = [f for f in files if f.endswith('.jpg')]
+        if len(files) == 0:
+            continue
+
+        if len(files) != 100:
+            print("   skipping {}, expected 100 attention masks but found {}".format(frame_dir, len(files)))
+            continue
+
+        # <attention_path>/<folder>/image_0x/data/<frame>
+        parts = os.path.relpath(frame_dir, opt.attention_path).split(os.sep)
+        folder, side_number, frame_index = "/".join(parts[:-3]), int(parts[-3][-1]), int(parts[-1])
+
+        frame_names, frame_probs, frame_sizes = index_frame(frame_dir, files)
+
+        frames.append(get_attention_frame_key(folder, side_number, frame_index))
+        names.append(frame_names)
+        probs.append(frame_probs)
+        sizes.append(frame_sizes)
+
+        if len(frames) % 1000 == 0:
+            print("   indexed {} frames".format(len(frames)))
+
+    save_attention_index(opt.output_file, frames, names, probs, sizes)
+
+    print("Indexed {} frames".format(len(frames)))
+
+
+if __name__ == "__main__":
+    index_attention_masks()
@@ -136,8 +136,26 @@ class Conv3x3(nn.Module):
         return out
 
 
+# homogeneous pixel grids per (height, width, device, dtype), shared by all BackprojectDepth layers
+_pixel_grids = {}
+
+
+def pixel_grid(height, width, device, dtype):
+    """The (1, 3, height * width) homogeneous pixel coordinates [x, y, 1], computed once per shape
+    """
+    key = (height, width, device, dtype)
+    if key not in _pixel_grids:
+        meshgrid = np.meshgrid(range(width), range(height), indexing='xy')
+        id_coords = np.stack(list(meshgrid) + [np.ones((height, width))], axis=0).reshape(1, 3, -1)
+        _pixel_grids[key] = torch.from_numpy(id_coords).to(device=device, dtype=dtype)
+    return _pixel_grids[key]
+
+
 class BackprojectDepth(nn.Module):
     """Layer to transform a depth image into a point cloud
+
+    Works for any batch size, batch_size is only kept for the signature. The points are (B, 3, H * W)
+    without the homogeneous row of ones, Project3D applies the pose as rotation plus translation
     """
     def __init__(self, batch_size, height, width):
         super(BackprojectDepth, self).__init__()
@@ -146,24 +164,11 @@ class BackprojectDepth(nn.Module):
         self.height = height
         self.width = width
 
-        meshgrid = np.meshgrid(range(self.width), range(self.height), indexing='xy')
-        self.id_coords = np.stack(meshgrid, axis=0).astype(np.float32)
-        self.id_coords = nn.Parameter(torch.from_numpy(self.id_coords),
-                                      requires_grad=False)
-
-        self.ones = nn.Parameter(torch.ones(self.batch_size, 1, self.height * self.width),
-                                 requires_grad=False)
-
-        self.pix_coords = torch.unsqueeze(torch.stack(
-            [self.id_coords[0].view(-1), self.id_coords[1].view(-1)], 0), 0)
-        self.pix_coords = self.pix_coords.repeat(batch_size, 1, 1)
-        self.pix_coords = nn.Parameter(torch.cat([self.pix_coords, self.ones], 1),
-                                       requires_grad=False)
-
     def forward(self, depth, inv_K):
-        cam_points = torch.matmul(inv_K[:, :3, :3], self.pix_coords)
-        cam_points = depth.view(self.batch_size, 1, -1) * cam_points
-        cam_points = torch.cat([cam_points, self.ones], 1)
+        pix_coords = pixel_grid(self.height, self.width, depth.device, depth.dtype)
+
+        cam_points = torch.matmul(inv_K[:, :3, :3], pix_coords)
+        cam_points = depth.view(depth.shape[0], 1, -1) * cam_points
 
         return cam_points
 
@@ -180,13 +185,24 @@ class Project3D(nn.Module):
         self.eps = eps
 
     def forward(self, points, K, T):
-        P = torch.matmul(K, T)[:, :3, :]
-
-        cam_points = torch.matmul(P, points)
+        """points are (B, 3, H * W) or homogeneous (B, 4, H * W). T is (B, 4, 4), or (B, F, 4, 4) to project
+        the same points into F cameras with one matmul, the pixel coordinates are then (B, F, H, W, 2)
+        instead of (B, H, W, 2)
+        """
+        if T.dim() == 4:
+            K = K.unsqueeze(1)
+            points = points.unsqueeze(1)
+
+        P = torch.matmul(K, T)[..., :3, :]
+
+        if points.shape[-2] == 3:
+            cam_points = torch.matmul(P[..., :3], points) + P[..., 3:]
+        else:
+            cam_points = torch.matmul(P, points)
 
-        pix_coords = cam_points[:, :2, :] / (cam_points[:, 2, :].unsqueeze(1) + self.eps)
-        pix_coords = pix_coords.view(self.batch_size, 2, self.height, self.width)
-        pix_coords = pix_coords.permute(0, 2, 3, 1)
+        pix_coords = cam_points[..., :2, :] / (cam_points[..., 2, :].unsqueeze(-2) + self.eps)
+        pix_coords = pix_coords.view(T.shape[:-2] + (2, self.height, self.width))
+        pix_coords = pix_coords.transpose(-3, -2).transpose(-2, -1)
         pix_coords[..., 0] /= self.width - 1
         pix_coords[..., 1] /= self.height - 1
         pix_coords = (pix_coords - 0.5) * 2
@@ -215,6 +231,13 @@ def get_smooth_loss(disp, img):
     return grad_disp_x.mean() + grad_disp_y.mean()
 
 
+def pool_frames(layer, x):
+    """Apply a 2d layer to (..., C, H, W), extra leading dimensions are treated as part of the batch
+    """
+    out = layer(x.reshape((-1,) + x.shape[-3:]))
+    return out.view(x.shape[:-3] + out.shape[-3:])
+
+
 class SSIM(nn.Module):
     """Layer to compute the SSIM loss between a pair of images
     """
@@ -231,16 +254,31 @@ class SSIM(nn.Module):
         self.C1 = 0.01 ** 2
         self.C2 = 0.03 ** 2
 
-    def forward(self, x, y):
-        x = self.refl(x)
+    def target_statistics(self, y):
+        """The padded target with its mean and variance, to compare several images against the same target
+        """
         y = self.refl(y)
-
-        mu_x = self.mu_x_pool(x)
         mu_y = self.mu_y_pool(y)
+        sigma_y = self.sig_y_pool(y ** 2) - mu_y ** 2
+        return y, mu_y, sigma_y
+
+    def forward(self, x, y, y_statistics=None):
+        """x is (B, C, H, W) or (B, F, C, H, W) to compare F images at once against the same y of (B, C, H, W).
+        y_statistics from target_statistics(y) can be passed in when y is compared more than once
+        """
+        if y_statistics is None:
+            y_statistics = self.target_statistics(y)
+        y, mu_y, sigma_y = y_statistics
+
+        if x.dim() == 5:
+            y, mu_y, sigma_y = y.unsqueeze(1), mu_y.unsqueeze(1), sigma_y.unsqueeze(1)
+
+        x = pool_frames(self.refl, x)
+
+        mu_x = pool_frames(self.mu_x_pool, x)
 
-        sigma_x  = self.sig_x_pool(x ** 2) - mu_x ** 2
-        sigma_y  = self.sig_y_pool(y ** 2) - mu_y ** 2
-        sigma_xy = self.sig_xy_pool(x * y) - mu_x * mu_y
+        sigma_x  = pool_frames(self.sig_x_pool, x ** 2) - mu_x ** 2
+        sigma_xy = pool_frames(self.sig_xy_pool, x * y) - mu_x * mu_y
 
         SSIM_n = (2 * mu_x * mu_y + self.C1) * (2 * sigma_xy + self.C2)
         SSIM_d = (mu_x ** 2 + mu_y ** 2 + self.C1) * (sigma_x + sigma_y + self.C2)
@@ -0,0 +1,134 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import json
+import time
+import argparse
+import collections
+
+import numpy as np
+import torch
+
+
+def to_scalar(value):
+    """Python number of a number, 0-d / 1 element tensor or numpy array, or None if it isn't a scalar
+    """
+    if isinstance(value, torch.Tensor):
+        return value.item() if value.numel() == 1 else None
+    if isinstance(value, np.ndarray):
+        return value.item() if value.size == 1 else None
+    if isinstance(value, np.number):
+        return value.item()
+    if isinstance(value, (bool, int, float)):
+        return value
+    return None
+
+
+class MetricsLog:
+    """Append-only jsonl file with one record per line
+
+    Records are buffered and written when there are flush_every records or the last write
+    was flush_seconds ago, so a log call doesn't touch the disk. Existing lines are never read or rewritten
+    """
+    def __init__(self, path, flush_every=20, flush_seconds=30):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.last_flush = time.time()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def write(self, record):
+        """Add one record, non scalar values are skipped
+        """
+        record = {key: to_scalar(value) for key, value in record.items()}
+        self.buffer.append({key: value for key, value in record.items() if value is not None})
+
+        if len(self.buffer) >= self.flush_every or time.time() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            with open(self.path, 'a') as f:
+                f.write(''.join(json.dumps(record) + '\n' for record in self.buffer))
+            self.buffer = []
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+
+
+def parse_records(lines):
+    """Records of the lines of a metrics log. A half written last line, of a run which is still busy, is skipped
+    """
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
+
+
+def read_metrics(path):
+    """All records of a metrics log
+    """
+    with open(path) as f:
+        return parse_records(f)
+
+
+def tail_metrics(path, n=10):
+    """The last n records of a metrics log, without keeping the whole file in memory
+    """
+    with open(path) as f:
+        return parse_records(collections.deque(f, maxlen=n))
+
+
+def aggregate_metrics(path, group_by='epoch'):
+    """Mean of every metric per value of group_by, e.g. per epoch
+
+    Returns an ordered dict of group -> {metric: mean}
+    """
+    groups = collections.OrderedDict()
+    for record in read_metrics(path):
+        if group_by not in record:
+            continue
+        group = groups.setdefault(record[group_by], collections.defaultdict(list))
+        for key, value in record.items():
+            if key != group_by:
+                group[key].append(value)
+
+    return collections.OrderedDict(
+        (group, {key: float(np.mean(values)) for key, values in metrics.items()}) for group, metrics in groups.items())
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Show the last records of a metrics log or aggregate it')
+
+    parser.add_argument('path',
+                        type=str,
+                        help='path to the metrics.jsonl file in the log directory of a model')
+    parser.add_argument('--tail',
+                        type=int,
+                        help='how many of the last records to show',
+                        default=10)
+    parser.add_argument('--aggregate',
+                        type=str,
+                        help='if set, show the mean of every metric per value of this key, e.g. epoch',
+                        default=None)
+    opt = parser.parse_args()
+
+    if opt.aggregate is None:
+        for record in tail_metrics(opt.path, opt.tail):
+            print(json.dumps(record))
+    else:
+        for group, metrics in aggregate_metrics(opt.path, opt.aggregate).items():
+            print(json.dumps(dict({opt.aggregate: group}, **metrics)))
+
+
+if __name__ == "__main__":
+    main()
@@ -34,10 +34,37 @@ class MonodepthOptions:
                                  type=str,
                                  help="path to the attention masks data",
                                  default="../../../attention_masks_hidde/")
+        self.parser.add_argument("--attention_shard_path",
+                                 type=str,
+                                 help="path to the packed attention masks made by pack_attention_masks.py. "
+                                      "If set, these are loaded instead of the 100 jpgs per kitti image",
+                                 default=None)
+        self.parser.add_argument("--attention_index_path",
+                                 type=str,
+                                 help="path to the attention mask index made by index_attention_masks.py. "
+                                      "If set, the mask probabilities and sizes are read from it instead of from the jpgs",
+                                 default=None)
+        self.parser.add_argument("--pack_attention_masks",
+                                 help="if set, the attention masks are sent from the data loader to the gpu "
+                                      "with 1 bit per pixel and only unpacked on the gpu",
+                                 action="store_true")
+        self.parser.add_argument("--ragged_attention_masks",
+                                 help="if set, the attention masks are not padded to 100 per kitti image. "
+                                      "The masks of a batch are concatenated and the losses only loop over the real masks",
+                                 action="store_true")
         self.parser.add_argument("--weight_matrix_path",
                                  type=str,
                                  help="path to the attention masks data",
                                  default="../../../weight_mask/")
+        self.parser.add_argument("--weight_matrix_store",
+                                 type=str,
+                                 help="path to the weight matrix arrays made by build_weight_matrix_store.py. "
+                                      "If set, these are used instead of the .pt files in weight_matrix_path",
+                                 default=None)
+        self.parser.add_argument("--weight_matrix_on_the_fly",
+                                 help="if set, the weight matrix is computed from the attention masks on the gpu "
+                                      "instead of loaded from weight_matrix_path",
+                                 action="store_true")
         self.parser.add_argument("--attention_threshold",
                                  type=float,
                                  help="how accurate the attention maps should be",
@@ -46,10 +73,21 @@ class MonodepthOptions:
                                  type=int,
                                  help="how often to save edge loss or additional weight loss images during training",
                                  default=500)
+        self.parser.add_argument("--async_plots",
+                                 help="if set, the diagnostic plots are made in a separate process so training doesn't wait on them",
+                                 action="store_true")
+        self.parser.add_argument("--plot_queue_size",
+                                 type=int,
+                                 help="how many plots can wait for the plot process, plots are dropped when it is full",
+                                 default=8)
         self.parser.add_argument("--edge_detection_threshold",
                                  type=float,
                                  help="The threshold used for canny edge detection. The lower the number the easier it will find edges",
                                  default=0.1)
+        self.parser.add_argument("--soft_edge_loss",
+                                 help="if set, the edge loss uses a differentiable soft threshold on the edge strength "
+                                      "instead of counting the canny edge pixels",
+                                 action="store_true")
         self.parser.add_argument("--seed",
                                  type=float,
                                  help="The random seed used for experiments",
@@ -259,6 +297,36 @@ class MonodepthOptions:
                                  type=int,
                                  help="number of batches between each tensorboard log",
                                  default=250)
+        self.parser.add_argument("--log_image_scales",
+                                 nargs="+",
+                                 type=int,
+                                 help="scales of which images are written to tensorboard, defaults to all scales",
+                                 default=None)
+        self.parser.add_argument("--log_image_downsample",
+                                 type=int,
+                                 help="factor by which the tensorboard images are downsampled",
+                                 default=1)
+        self.parser.add_argument("--log_images_every",
+                                 type=int,
+                                 help="write images to tensorboard only every this many tensorboard logs",
+                                 default=1)
+        self.parser.add_argument("--time_stages",
+                                 help="if set, times every stage of the training step and logs the percentiles. "
+                                      "Synchronizes the gpu after every stage, so this slows down training",
+                                 action="store_true")
+        self.parser.add_argument("--profile_start_step",
+                                 type=int,
+                                 help="step at which the torch.profiler trace starts",
+                                 default=100)
+        self.parser.add_argument("--profile_steps",
+                                 type=int,
+                                 help="number of steps to capture in a torch.profiler trace in <log_dir>/<model_name>/profile, "
+                                      "0 disables the profiler",
+                                 default=0)
+        self.parser.add_argument("--metrics_flush_every",
+                                 type=int,
+                                 help="number of records the metrics log keeps in memory before appending them to metrics.jsonl",
+                                 default=20)
         self.parser.add_argument("--save_frequency",
                                  type=int,
                                  help="number of epochs between each save",
@@ -0,0 +1,78 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import argparse
+import numpy as np
+
+from datasets.mono_dataset import pil_loader_attention
+from datasets.attention_masks import mask_probability, save_attention_shard
+
+
+def pack_frame(frame_dir, files, output_file):
+    """Decode the attention mask jpgs of one kitti frame and write them to a single shard
+    """
+    names = sorted(files)
+    probs = [mask_probability(name) for name in names]
+
+    # same scaling as transforms.ToTensor so the 0.8 threshold gives the same masks as before
+    masks = np.stack([np.asarray(pil_loader_attention(os.path.join(frame_dir, name)), dtype=np.float32) / 255
+                      for name in names])
+
+    # write to a temporary file first such that an interrupted run never leaves half a shard behind
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        save_attention_shard(f, names, probs, masks)
+    os.replace(tmp_file, output_file)
+
+
+def pack_attention_masks():
+
+    parser = argparse.ArgumentParser(description='pack_attention_masks')
+
+    parser.add_argument('--attention_path',
+                        type=str,
+                        help='path to the root of the attention masks tree with 100 jpgs per kitti frame',
+                        required=True)
+    parser.add_argument('--output_path',
+                        type=str,
+                        help='where to write one .npz shard per kitti frame',
+                        required=True)
+    parser.add_argument('--overwrite',
+                        help='if set, also rewrites shards which already exist',
+                        action='store_true')
+    opt = parser.parse_args()
+
+    print("Packing attention masks from {} into {}".format(opt.attention_path, opt.output_path))
+
+    packed = 0
+    for frame_dir, _, files in os.walk(opt.attention_path):
+
+        files = [f for f in files if f.endswith('.jpg')]
+        if len(files) == 0:
+            continue
+
+        if len(files) != 100:
+            print("   skipping {}, expected 100 attention masks but found {}".format(frame_dir, len(files)))
+            continue
+
+        # <attention_path>/<folder>/image_0x/data/<frame> -> <output_path>/<folder>/image_0x/data/<frame>.npz
+        output_file = os.path.join(opt.output_path, os.path.relpath(frame_dir, opt.attention_path) + ".npz")
+
+        if os.path.isfile(output_file) and not opt.overwrite:
+            continue
+
+        if not os.path.exists(os.path.dirname(output_file)):
+            os.makedirs(os.path.dirname(output_file))
+
+        pack_frame(frame_dir, files, output_file)
+
+        packed += 1
+        if packed % 1000 == 0:
+            print("   packed {} frames".format(packed))
+
+    print("Packed {} frames".format(packed))
+
+
+if __name__ == "__main__":
+    pack_attention_masks()
@@ -0,0 +1,134 @@
+from __future__ import absolute_import, division, print_function
+
+import time
+import queue
+import traceback
+import multiprocessing
+
+import numpy as np
+import torch
+
+
+# the only entries of inputs which are used by the plot functions, the rest of the batch is never copied
+PLOT_INPUTS = [("color_aug", 0, 0), "weight_matrix"]
+
+# at most one message per this many seconds about dropped plots
+DROP_MESSAGE_SECONDS = 60
+
+
+class PlotContext:
+    """The part of the trainer the plot functions use (self.opt, self.epoch and self.device),
+    such that the plot functions run the same in the plot process as in the training loop
+    """
+    def __init__(self, trainer):
+        self.opt = trainer.opt
+        self.epoch = trainer.epoch
+        self.device = torch.device("cpu")
+
+
+def plot_inputs(inputs, samples=None):
+    """Only the entries of inputs which are needed for plotting, and only the first samples images of the batch
+    if the plot doesn't draw the others
+    """
+    return {key: inputs[key][:samples] for key in PLOT_INPUTS if key in inputs}
+
+
+def snapshot(value):
+    """Detached cpu copy of all tensors in value, and a PlotContext instead of the trainer
+    """
+    if isinstance(value, torch.Tensor):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, dict):
+        return {key: snapshot(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(snapshot(v) for v in value)
+    if hasattr(value, "opt") and hasattr(value, "models"):
+        return PlotContext(value)
+    return value
+
+
+def plot_worker(plot_queue):
+    """Runs in the plot process until it receives None
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    torch.set_num_threads(1)
+
+    while True:
+        job = plot_queue.get()
+        if job is None:
+            break
+
+        function, args = job
+        try:
+            function(*args)
+        except Exception:
+            print("plot {} failed".format(function.__name__))
+            traceback.print_exc()
+        finally:
+            plt.close('all')
+
+
+class PlotService:
+    """Makes the diagnostic plots of the training loop in a separate process
+
+    submit(function, *args) calls function(*args) with detached cpu snapshots of the tensors in args.
+    If the trainer itself is passed, the plot function gets a PlotContext with opt, epoch and device instead.
+    The queue is bounded, when it is full the plot is dropped before anything is copied, such that the training step
+    never waits on matplotlib. The copies are synchronous, so callers pass only what is drawn (e.g. sample 0).
+    Plot functions must be module level functions, such that they can be sent to the plot process.
+    If not enabled, submit plots directly in the training loop like before
+    """
+    def __init__(self, enabled=False, queue_size=8):
+        self.enabled = enabled
+        self.dropped = 0
+        self.drop_message_time = None
+        self.process = None
+
+        if self.enabled:
+            # spawn instead of fork because the training process uses cuda
+            context = multiprocessing.get_context('spawn')
+            self.queue = context.Queue(maxsize=queue_size)
+            self.process = context.Process(target=plot_worker, args=(self.queue,), daemon=True)
+            self.process.start()
+
+    def submit(self, function, *args):
+        if not self.enabled:
+            function(*args)
+            return
+
+        if self.queue.full():
+            self.drop(function)
+            return
+
+        try:
+            self.queue.put_nowait((function, snapshot(args)))
+        except queue.Full:
+            self.drop(function)
+
+    def drop(self, function):
+        self.dropped += 1
+
+        now = time.time()
+        if self.drop_message_time is None or now - self.drop_message_time > DROP_MESSAGE_SECONDS:
+            self.drop_message_time = now
+            print("plot queue is full, dropped {} ({} plots so far)".format(function.__name__, self.dropped))
+
+    def close(self, timeout=60):
+        """Wait until the queued plots are made and stop the plot process
+        """
+        if self.process is None:
+            return
+
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
@@ -1,27 +1,28 @@
+from __future__ import absolute_import, division, print_function
+
 import os
-import torch
-from PIL import Image
-import torchvision.transforms as T
-from torchvision import transforms
-import numpy as np
-from pathlib import Path
+import argparse
 import traceback
+import multiprocessing
 
-import os
-import matplotlib.pyplot as plt
 import torch
 import numpy as np
-import time
-import seaborn as sns
-import copy
-import itertools
+from PIL import Image
+from torchvision import transforms
 
-def pil_loader(path):
-    # open path as file to avoid ResourceWarning
-    # (https://github.com/python-pillow/Pillow/issues/835)
-    with open(path, 'rb') as f:
-        with Image.open(f) as img:
-            return img.convert('RGB')
+
+METHODS = ['avg', 'min', 'max']
+THRESHOLDS = [0.4, 0.5, 0.6, 0.7, 0.8]
+
+# these weight are determined by looping over the whole dataset en calculating per image how many kitti images
+# are not overlapping and then determine the avg weight based on those attention mask per kitti image
+avg_weight_per_threshold = {
+    0.4: 1053,
+    0.5: 980,
+    0.6: 905,
+    0.7: 818,
+    0.8: 688
+}
 
 
 def pil_loader_attention(path):
@@ -33,32 +34,21 @@ def pil_loader_attention(path):
 
 
 def calculate_weight_per_mask(attention_masks, threshold):
-    # set values again to their normal values. First their were casted to negative such that there was no torch.eq outside the mask
-    attention_masks[attention_masks >= 0.8] = 1
-    attention_masks[attention_masks < 0.8] = 0
+    """
+    attention_masks: (..., masks, H, W) binary attention masks
+    The smaller the mask the more weight it'll receive. Returns a (..., masks) tensor
+    """
 
     # batch x amount of attention. sum every attention tensor within the batch size
     attention_sum = attention_masks.sum(-1).sum(-1)
-    #     print("ATTENTION SUM", attention_sum)
-
-    # within a batch you have multiple attention masks. Decide how much weight each attention mask will receive.
-    # The smaller the mask the more weight it'll receive.
 
-    v = attention_sum / (attention_masks.shape[1] * attention_masks.shape[2])
+    v = attention_sum / (attention_masks.shape[-2] * attention_masks.shape[-1])
 
     v = 1 / v
     # remove inf number because 1 / 0 = inf
     v[v == float('inf')] = 0
     v[v != v] = 0
 
-    avg_weight_per_threshold = {
-        0.4: 1053,
-        0.5: 980,
-        0.6: 905,
-        0.7: 818,
-        0.8: 688
-    }
-
     attention_weight_matrix = v / avg_weight_per_threshold[threshold]
 
     # remove nan
@@ -67,128 +57,196 @@ def calculate_weight_per_mask(attention_masks, threshold):
     return attention_weight_matrix
 
 
+def weight_matrix_from_masks(attention_masks, weight_per_mask, method):
+    """
+    attention_masks: (..., masks, H, W) binary attention masks
+    weight_per_mask: (..., masks) weight of every mask, see calculate_weight_per_mask
+    Returns the (..., H, W) weight matrix: 1 + the avg, min or max weight of the masks covering a pixel
+    and 1 for pixels outside every mask
+    """
 
-def pre_process_weight_matrix():
-
-    device = "cuda"
-    torch.cuda.empty_cache()
-
-
-    methods = ['avg', 'min', 'max']
-    thresholds = [0.4, 0.5, 0.6, 0.7, 0.8]
+    # overal waar een attention pixel is, zet daar de weight neer
+    weight_mask = attention_masks * weight_per_mask.unsqueeze(-1).unsqueeze(-1)
 
-    # remove the old version
-    if os.path.exists('output_during_weight_pre_process.txt'):
-        os.remove('output_during_weight_pre_process.txt')
+    if attention_masks.shape[-3] == 0:
+        end_mask = weight_mask.sum(-3)
 
-    with open('output_during_weight_pre_process.txt', 'w') as fileee:
+    elif method == 'avg':
+        # how many masks overlap per pixel. summed in float64 like np.average in calculate_weight_matrix_pairwise,
+        # such that both give the same float32 weights
+        end_mask = weight_mask.sum(-3, dtype=torch.float64) / attention_masks.sum(-3)
 
-        for threshold in thresholds:
+        # replace nan
+        end_mask[end_mask != end_mask] = 0
 
-            fileee.write('\n' + str(threshold))
+    elif method == 'min':
+        # set all zero element on 99997 such that the torch.min doesn't find 0 values for overlapping pixels
+        min_values = torch.where(weight_mask == 0, torch.full_like(weight_mask, 99997), weight_mask).min(dim=-3)[0]
 
-            for method in methods:
+        # but for some pixels there are only 0 values so cast back to zero after torch.min
+        min_values[min_values == 99997] = 0
+        end_mask = min_values
 
-                fileee.write('\n' + method)
+    elif method == 'max':
+        end_mask = weight_mask.max(dim=-3)[0]
 
-                # PAD AANPASSEN
-                paths = os.walk('../data/attention_masks')
+    else:
+        raise ValueError("Unknown weight mask method {}".format(method))
 
-                for i, (path, directories, files) in enumerate(tqdm(paths)):
+    # add 1 everywhere becasue otherwise the ssim loss , l1 loss will shrink
+    return (end_mask + 1).to(weight_mask.dtype)
 
-                    # voor deze kitti plaatjes heb je al de weight mask berekend
-                    weight_path = path.replace("attention_masks", "weight_mask")
 
-                    # check if the weight matrix already exsist for this method and threshold. is so, continue
-                    my_file = weight_path + "/" + "threshold_" + str(threshold) + "_method_" + method + ".pt"
+def get_weight_matrix_file(weight_path, threshold, method):
+    return weight_path + "/" + "threshold_" + str(threshold) + "_method_" + method + ".pt"
 
-                    # every 2500 steps write to progress to outfile to keeping track
-                    if i % 2500 == 0:
-                        fileee.write('\n' + str(i))
-                        fileee.write('\n' + my_file)
 
-                    if os.path.isfile(my_file):
-                        continue
+def process_frame(args):
+    """Decode the 100 attention masks of one kitti frame once and save the weight matrix of every threshold and method
 
-                    # open the attention masks per kitti image
-                    if len(files) == 100 and files[0].endswith('jpg'):
+    Returns the frame and None, or the frame and the traceback if it failed
+    """
+    frame, opt = args
 
-                        attention_masks_per_kitti_img = torch.empty(size=(0, 192, 640))
+    try:
+        path = os.path.join(opt.attention_path, frame)
+        weight_path = os.path.join(opt.weight_matrix_path, frame)
 
-                        for file in files:
+        files = [file for file in os.listdir(path) if file.endswith('jpg')]
 
-                            # check the attention mask probability
-                            attention_mask_prob = float(file.split("_")[1].split(".jpg")[0])
+        probs = torch.tensor([float(file.split("_")[1].split(".jpg")[0]) for file in files])
 
-                            #             print("PROB", attention_mask_prob)
-                            if attention_mask_prob >= threshold:
-                                # create path to attention mask
-                                curr_path = path + "/" + file
-                                attention_mask_from_pil = pil_loader_attention(curr_path)
-                                attention_mask_from_pil = transforms.ToTensor()(attention_mask_from_pil)
+        attention_masks = torch.stack([transforms.ToTensor()(pil_loader_attention(path + "/" + file))[0]
+                                       for file in files]).to(opt.device)
 
-                                #                # stack the attention masks which belong to the same kitti image in one big tensor
-                                attention_masks_per_kitti_img = torch.cat(
-                                    (attention_masks_per_kitti_img, attention_mask_from_pil), dim=0)
+        attention_masks = (attention_masks >= 0.8).to(torch.float32)
 
-                        attention_masks_per_kitti_img[attention_masks_per_kitti_img >= 0.8] = 1
-                        attention_masks_per_kitti_img[attention_masks_per_kitti_img < 0.8] = 0
+        if not os.path.exists(weight_path):
+            os.makedirs(weight_path)
 
-                        weight_per_mask = calculate_weight_per_mask(attention_masks_per_kitti_img, threshold)
+        for threshold in opt.thresholds:
 
-                        # initialize the weight matrix per kitti image
-                        weight_mask = copy.deepcopy(attention_masks_per_kitti_img.clone().detach())
-                        divide_mask = copy.deepcopy(attention_masks_per_kitti_img.clone().detach())
+            masks_above_threshold = attention_masks[(probs >= threshold).to(opt.device)]
+            weight_per_mask = calculate_weight_per_mask(masks_above_threshold, threshold)
 
-                        for i, current_mask in enumerate(weight_mask):
-                            # overal waar een attention pixel is, zet daar de weight neer
-                            current_mask[current_mask == 1] = weight_per_mask[i]
-                            weight_mask[i] = current_mask
+            for method in opt.methods:
+                end_mask = weight_matrix_from_masks(masks_above_threshold, weight_per_mask, method)
+                torch.save(end_mask.cpu(), get_weight_matrix_file(weight_path, threshold, method))
 
-                        if method == 'avg':
+    except Exception:
+        return frame, traceback.format_exc()
 
-                            for i, curr_mask in enumerate(divide_mask):
-                                # overal waar een pixel is zet daar een 1 neer zodat je later weer hoeveel overlappende masks per pixels er zijn
-                                curr_mask[curr_mask == 1] = 1
-                                divide_mask[i] = curr_mask
+    return frame, None
 
-                            weight_mask = weight_mask.sum(0)
-                            divide_mask = divide_mask.sum(0)
 
-                            end_mask = (weight_mask / divide_mask)
+def init_worker():
+    """Every worker computes one frame at a time, so one thread per worker such that num_workers processes
+    don't oversubscribe the cpu
+    """
+    torch.set_num_threads(1)
 
-                            # replace nan
-                            end_mask[end_mask != end_mask] = 0
 
-                            # add 1 everywhere becasue otherwise the ssim loss , l1 loss will shrink
-                            end_mask = end_mask + 1
+def manifest_config(opt):
+    """The part of a manifest entry which tells with which settings the frame was done, such that a run
+    with other thresholds, methods or weight_matrix_path doesn't skip the frame
+    """
+    return "thresholds={} methods={} weight_matrix_path={}".format(
+        ",".join(str(threshold) for threshold in sorted(opt.thresholds)), ",".join(sorted(opt.methods)),
+        os.path.abspath(opt.weight_matrix_path))
 
-                        if method == 'min':
-                            # set all zero element on 999 such that the torch. min doesn't find 0 values for overlapping pixels
-                            weight_mask[weight_mask == 0] = 99997
 
-                            # find lowest value and now the 0 values are skipped because they are cased to 999
-                            min_values = torch.min(weight_mask, dim=0)[0]
-
-                            # but for some pixels there are only 0 values so cast back to zero after torch. min
-                            min_values[min_values == 99997] = 0
-
-                            # add 1 everywhere becasue otherwise the ssim loss , l1 loss will shrink
-                            end_mask = min_values + 1
-
-                        if method == 'max':
-                            end_mask = weight_mask.max(dim=0)[0]
-                            end_mask = end_mask + 1
-
-                        if not os.path.exists(weight_path):
-                            os.makedirs(weight_path)
-
-                        torch.save(end_mask, weight_path + "/" + "threshold_" + str(threshold) + "_method_" + method + ".pt")
+def find_frames(attention_path):
+    """All <folder>/image_0x/data/<frame> directories with 100 attention masks, relative to attention_path
+    """
+    frames = []
+    for path, directories, files in os.walk(attention_path):
+        if len(files) == 100 and files[0].endswith('jpg'):
+            frames.append(os.path.relpath(path, attention_path))
+    return sorted(frames)
 
 
+def pre_process_weight_matrix():
 
-file = open('log_errors_weight_matrix.txt', 'w')
-try:
+    parser = argparse.ArgumentParser(description='pre_process_weight_matrix')
+
+    parser.add_argument('--attention_path',
+                        type=str,
+                        help='path to the root of the attention masks tree with 100 jpgs per kitti frame',
+                        default='../data/attention_masks')
+    parser.add_argument('--weight_matrix_path',
+                        type=str,
+                        help='where to write the weight matrices, with the same tree as attention_path',
+                        default='../data/weight_mask')
+    parser.add_argument('--thresholds',
+                        nargs='+',
+                        type=float,
+                        help='attention thresholds to compute the weight matrices for',
+                        default=THRESHOLDS)
+    parser.add_argument('--methods',
+                        nargs='+',
+                        type=str,
+                        help='weight mask methods to compute the weight matrices for',
+                        choices=METHODS,
+                        default=METHODS)
+    parser.add_argument('--num_workers',
+                        type=int,
+                        help='number of processes',
+                        default=os.cpu_count())
+    parser.add_argument('--device',
+                        type=str,
+                        help='device used for computing the weight matrices',
+                        default='cpu')
+    parser.add_argument('--manifest',
+                        type=str,
+                        help='file with the frames which are done and their settings. Frames done with the same thresholds, '
+                             'methods and weight_matrix_path are skipped, such that an interrupted run resumes. '
+                             'Defaults to <weight_matrix_path>/manifest.txt',
+                        default=None)
+    opt = parser.parse_args()
+
+    if opt.manifest is None:
+        opt.manifest = os.path.join(opt.weight_matrix_path, 'manifest.txt')
+
+    if not os.path.exists(opt.weight_matrix_path):
+        os.makedirs(opt.weight_matrix_path)
+
+    # manifest lines are <frame>\t<config>
+    config = manifest_config(opt)
+
+    done = set()
+    if os.path.isfile(opt.manifest):
+        with open(opt.manifest) as f:
+            for line in f:
+                frame, _, frame_config = line.rstrip('\n').partition('\t')
+                if frame_config == config:
+                    done.add(frame)
+
+    frames = [frame for frame in find_frames(opt.attention_path) if frame not in done]
+    print("{} frames done, {} frames to go".format(len(done), len(frames)))
+
+    # cuda can't be used in forked processes
+    context = multiprocessing.get_context('fork' if opt.device == 'cpu' else 'spawn')
+
+    failed = 0
+    with context.Pool(opt.num_workers, initializer=init_worker) as pool, \
+            open(opt.manifest, 'a') as manifest, \
+            open('log_errors_weight_matrix.txt', 'a') as errors:
+
+        for i, (frame, error) in enumerate(pool.imap_unordered(process_frame, [(frame, opt) for frame in frames], chunksize=16)):
+
+            if error is None:
+                # flushed per frame, such that a killed run loses no progress
+                manifest.write(frame + '\t' + config + '\n')
+                manifest.flush()
+            else:
+                failed += 1
+                errors.write(frame + '\n' + error)
+
+            if (i + 1) % 2500 == 0:
+                print("   {} / {} frames, {} failed".format(i + 1, len(frames), failed))
+
+    print("Done, {} frames failed, see log_errors_weight_matrix.txt".format(failed))
+
+
+if __name__ == "__main__":
     pre_process_weight_matrix()
-except:
-    traceback.print_exc(file=file)
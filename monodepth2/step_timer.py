@@ -0,0 +1,108 @@
+from __future__ import absolute_import, division, print_function
+
+import time
+import contextlib
+import collections
+
+import numpy as np
+import torch
+
+
+PERCENTILES = [50, 90, 99]
+
+
+class StepTimer:
+    """Named timing regions of the training step
+
+    A step is timed between start() and stop(): sequential stages with lap(name) and nested parts with the
+    region(name) context manager, outside a step (e.g. validation) nothing is recorded. If not enabled nothing
+    is measured, if enabled the device is synchronized before every measurement such that the asynchronous
+    cuda kernels are counted in the stage which launched them.
+    summary() gives percentiles per stage over the steps since the last summary.
+
+    If profile_steps > 0, a torch.profiler trace of profile_steps steps, starting at step profile_start_step,
+    is written to profile_path for tensorboard. The regions show up by name in the trace
+    """
+    def __init__(self, enabled=False, device=torch.device("cpu"), profile_start_step=0, profile_steps=0,
+                 profile_path=None):
+        self.enabled = enabled
+        self.synchronize = enabled and device.type == "cuda"
+        self.times = collections.defaultdict(list)
+        self.lap_time = None
+
+        self.profiler = None
+        if profile_steps > 0:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if device.type == "cuda":
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+            self.profiler = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(skip_first=profile_start_step, wait=0, warmup=1,
+                                                 active=profile_steps, repeat=1),
+                on_trace_ready=torch.profiler.tensorboard_trace_handler(profile_path))
+            self.profiler.start()
+
+    def now(self):
+        if self.synchronize:
+            torch.cuda.synchronize()
+        return time.time()
+
+    def start(self):
+        """Start the first stage of a step
+        """
+        if self.enabled:
+            self.lap_time = self.now()
+
+    def lap(self, name):
+        """End the current stage under name and start the next one
+        """
+        if self.lap_time is not None:
+            end = self.now()
+            self.times[name].append(end - self.lap_time)
+            self.lap_time = end
+
+    def stop(self):
+        """End the step, nothing is recorded until the next start()
+        """
+        self.lap_time = None
+
+    def add(self, name, seconds):
+        """Add a duration which is measured elsewhere, e.g. waiting on the data loader
+        """
+        if self.enabled:
+            self.times[name].append(seconds)
+
+    @contextlib.contextmanager
+    def region(self, name):
+        # the profiler also names the region when the timing is not enabled
+        with torch.profiler.record_function(name) if self.profiler is not None else contextlib.nullcontext():
+            if self.lap_time is None:
+                yield
+                return
+
+            start = self.now()
+            yield
+            self.times[name].append(self.now() - start)
+
+    def step(self):
+        """Call at the end of every training step, for the profiler schedule
+        """
+        if self.profiler is not None:
+            self.profiler.step()
+
+    def summary(self):
+        """{'time/<region>/p<percentile>': seconds} over the steps since the last summary, and start over
+        """
+        summary = {}
+        for name, times in self.times.items():
+            for percentile, value in zip(PERCENTILES, np.percentile(times, PERCENTILES)):
+                summary["time/{}/p{}".format(name, percentile)] = float(value)
+
+        self.times.clear()
+        return summary
+
+    def close(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
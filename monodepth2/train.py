@@ -21,9 +21,6 @@ def experiment_training():
 
     for current_model_name, seed in zip(experiment_names, seeds):
 
-        if os.path.exists('output_during_training.txt'):
-            os.remove('output_during_training.txt')
-        open('output_during_training.txt', 'w')
         file = open(f'log {current_model_name}.txt', 'w')
 
 
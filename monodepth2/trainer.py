@@ -66,6 +66,10 @@ import os
 # attention weight loss
 from attention_mask_loss import *
 from attention_weight_mask import *
+import edge_code
+from plot_service import PlotService, plot_inputs
+from metrics_log import MetricsLog
+from image_log_writer import ImageLogWriter
 
 
 class Trainer:
@@ -83,6 +87,9 @@ class Trainer:
         self.opt = options
         self.log_path = os.path.join(self.opt.log_dir, self.opt.model_name)
 
+        self.plot_service = PlotService(self.opt.async_plots, self.opt.plot_queue_size)
+        self.metrics_log = MetricsLog(os.path.join(self.log_path, "metrics.jsonl"), self.opt.metrics_flush_every)
+
         torch.manual_seed(self.opt.seed)
         torch.cuda.manual_seed(self.opt.seed)
         torch.cuda.manual_seed_all(self.opt.seed)
@@ -221,6 +228,7 @@ class Trainer:
         # breakpoint()
         for mode in ["train", "val"]:
             self.writers[mode] = SummaryWriter(os.path.join(self.log_path, mode))
+        self.image_log_writer = ImageLogWriter(self.opt, self.writers)
 
         if not self.opt.no_ssim:
             self.ssim = SSIM()
@@ -268,10 +276,15 @@ class Trainer:
 
         # text_file = open("progress_during_training.txt", "w")
 
-        for self.epoch in range(self.opt.num_epochs):
-            self.run_epoch()
-            # if (self.epoch + 1) % self.opt.save_frequency == 0:
-            self.save_model(0)
+        try:
+            for self.epoch in range(self.opt.num_epochs):
+                self.run_epoch()
+                # if (self.epoch + 1) % self.opt.save_frequency == 0:
+                self.save_model(0)
+        finally:
+            self.plot_service.close()
+            self.metrics_log.close()
+            self.image_log_writer.close()
 
 
     def run_epoch(self):
@@ -310,7 +323,7 @@ class Trainer:
             late_phase = self.step % 2000 == 0
 
             if early_phase or late_phase:
-                self.log_time(batch_idx, duration, losses["loss_with_attention_weight"].cpu().data)
+                self.log_time(batch_idx, duration, losses["loss_with_attention_weight"].cpu().data, losses)
 
                 if "depth_gt" in inputs:
                     self.compute_depth_losses(inputs, outputs, losses)
@@ -379,28 +392,32 @@ class Trainer:
             else:
                 pose_feats = {f_i: inputs["color_aug", f_i, 0] for f_i in self.opt.frame_ids}
 
-            for f_i in self.opt.frame_ids[1:]:
-                if f_i != "s":
-                    # To maintain ordering we always pass frames in temporal order
-                    if f_i < 0:
-                        pose_inputs = [pose_feats[f_i], pose_feats[0]]
-                    else:
-                        pose_inputs = [pose_feats[0], pose_feats[f_i]]
+            # To maintain ordering we always pass frames in temporal order
+            source_frame_ids = [f_i for f_i in self.opt.frame_ids[1:] if f_i != "s"]
+            pairs = [[pose_feats[f_i], pose_feats[0]] if f_i < 0 else [pose_feats[0], pose_feats[f_i]]
+                     for f_i in source_frame_ids]
 
-                    if self.opt.pose_model_type == "separate_resnet":
-                        pose_inputs = [self.models["pose_encoder"](torch.cat(pose_inputs, 1))]
-                    elif self.opt.pose_model_type == "posecnn":
-                        pose_inputs = torch.cat(pose_inputs, 1)
+            if self.opt.pose_model_type in ["separate_resnet", "posecnn"]:
+                # the pairs of all source frames are stacked along the batch, such that the pose network
+                # runs once at batch size B * len(source_frame_ids) instead of once per source frame
+                pose_inputs = torch.cat([torch.cat(pair, 1) for pair in pairs], 0)
 
-                    axisangle, translation = self.models["pose"](pose_inputs)
+                if self.opt.pose_model_type == "separate_resnet":
+                    pose_inputs = [self.models["pose_encoder"](pose_inputs)]
 
+                axisangle, translation = self.models["pose"](pose_inputs)
+                poses = zip(axisangle.chunk(len(pairs), 0), translation.chunk(len(pairs), 0))
 
-                    outputs[("axisangle", 0, f_i)] = axisangle
-                    outputs[("translation", 0, f_i)] = translation
+            else:
+                poses = [self.models["pose"](pair) for pair in pairs]
 
-                    # Invert the matrix if the frame id is negative
-                    outputs[("cam_T_cam", 0, f_i)] = transformation_from_parameters(
-                        axisangle[:, 0], translation[:, 0], invert=(f_i < 0))
+            for f_i, (axisangle, translation) in zip(source_frame_ids, poses):
+                outputs[("axisangle", 0, f_i)] = axisangle
+                outputs[("translation", 0, f_i)] = translation
+
+                # Invert the matrix if the frame id is negative
+                outputs[("cam_T_cam", 0, f_i)] = transformation_from_parameters(
+                    axisangle[:, 0], translation[:, 0], invert=(f_i < 0))
 
         else:
             # Here we input all frames to the pose net (and predict all poses) together
@@ -446,51 +463,10 @@ class Trainer:
 
         self.set_train()
 
-    def prepare_edge_plot(self, disp, inputs, attention_mask):
-        """
-        Once in a while make a plot of the edge loss. Therefor prepare the min and max values for correct depth mask plot
-        retreive the original kitti image
-        and set correct dimensions for the depth image
-        """
-
-        attention_mask = attention_mask.view(self.opt.height * self.opt.batch_size, self.opt.width)
-
-        path = self.opt.log_dir + self.opt.model_name + "/" + "edge_loss_img/"
-
-        # print("EDGE LOSS PATH", path)
-
-
-        if not os.path.exists(path):
-            os.makedirs(path)
-
-
-        disp = disp.view(self.opt.height * self.opt.batch_size, self.opt.width)
-
-        disp_min = np.uint8(disp.min().cpu().detach().numpy() * 255)
-        disp_max = np.uint8(disp.max().cpu().detach().numpy() * 255)
-
-        original_img = inputs["color_aug", 0, 0]
-
-
-
-        original_img = original_img.view(self.opt.height * self.opt.batch_size, self.opt.width, 3)
-        # depth_mask = depth_mask.view(self.opt.height * self.opt.batch_size, self.opt.width, 3)
-
-        original_img = np.array(original_img.cpu().detach().numpy())
-
-
-        # original_img = np.swapaxes(original_img, 1, 2)
-        # original_img = np.swapaxes(original_img, 0, 1)
-
-
-        # filter out dimension for correct plotting
-        disp = disp.squeeze(1)
-        disp = np.array(disp.cpu().detach().numpy())
-
-        return disp_min, disp_max, original_img, disp, path, attention_mask
-
     def additional_not_overlapping_check(self, attention_mask):
         # additional check if the not overlapping masks are not overlapping
+        overlap_matrix = mask_overlap_matrix(attention_mask)
+
         for batch in range(self.opt.batch_size):
 
             # loop over the attention masks per batch
@@ -504,141 +480,10 @@ class Trainer:
                 masks_to_compare_with = np.arange(0, attention_mask[batch].shape[0])
 
                 # you want to compare the mask x from batch x with the attention_masks y from batch x
-                overlap = find_overlapping_tensors(batch, mask, masks_to_compare_with, attention_mask)
+                overlap = find_overlapping_tensors(batch, mask, masks_to_compare_with, overlap_matrix)
 
                 assert len(overlap) == 1, "there are still overlapping values"
 
-    def edge_detection_loss(self, scale, outputs, inputs, attention_mask, batch_idx, index_nrs_not_overlapping, original_attention):
-        """"
-        scale: this selects the correct depth image
-        outputs: for selecting the depth image
-        inputs: for selecting the original kitti image
-        attention_mask: these are the not overlapping attention masks
-        batch_idx: iteration number during training. This is needed because every 250 steps, save the edge image
-        index_nrs_not_overlapping: these are the index numbers of the not overlapping masks, needed for indexing
-        original_attention: needed for plotting every 250 steps
-        """
-
-        edge_loss = []
-
-        # set this on if you want to double check if the tensors are not overlapping.
-        # self.additional_not_overlapping_check(attention_mask)
-
-        attention_mask = torch.clone(attention_mask).to(self.device)
-
-        # set all the negative values to zero. the values were negative to make sure no overlapping values were found
-        # curing the attention_mask_weight function
-        attention_mask[attention_mask <= -1] = 0
-
-        # breakpoint()
-        disp = outputs[("disp", scale)].to(self.device)
-
-        # upsample to kitti size for correct multiplication with attention_mask
-        disp = F.interpolate(
-            disp, [self.opt.height, self.opt.width], mode="bilinear", align_corners=False).to(self.device)
-
-        # sum all the attention mask together in 1 attention tensor for faster computation. This is possible because there are not overlalping maps # attention_mask [2, 1, 192, 640]
-        attention_mask = attention_mask.sum(1).unsqueeze(1).to(self.device)
-
-
-        assert attention_mask.max() == 1, "sum of attention masks is greater than one .. probably overlapping masks"
-
-        # create only the depth pixels that lie inside the attention mask
-        depth_mask = (attention_mask * disp).squeeze(0).squeeze(0).to(self.device)
-
-        # breakpoint()
-        if self.opt.batch_size > 1:
-
-            # 1, 1 192 * batch_size , 640. so paste the images under eachother such that you only have to do edge detection once
-            depth_mask = depth_mask.view(self.opt.height * self.opt.batch_size, self.opt.width).to(self.device)
-
-        depth_mask = np.array(depth_mask.cpu().detach().numpy())
-
-        # * 255 for canny edge working
-        depth_mask = depth_mask * 255
-
-        # cast to int for correct canny input
-        depth_mask = np.uint8(depth_mask)
-
-        # # prepare images for plotting
-        if batch_idx % self.opt.save_plot_every == 0 and scale == 0:
-            disp_min, disp_max, original_img, disp, path, attention_mask = self.prepare_edge_plot(disp, inputs, attention_mask)
-
-
-        edges_disp = cv2.Canny(depth_mask, self.opt.edge_detection_threshold * 255, self.opt.edge_detection_threshold * 255, apertureSize=3, L2gradient=False)
-        kernel = np.ones((5, 5), np.uint8)
-        erosion = cv2.erode(depth_mask, kernel, iterations=3)
-        result = cv2.bitwise_and(edges_disp, edges_disp, mask=erosion)
-
-
-        for b in range(self.opt.batch_size -1):
-
-            # remove edges between the stacked images borders
-            number = (b + 1) * (self.opt.height)
-            result[number] = 0
-            result[number -1] = 0
-
-
-        # if you found an edge and save the image. only once in the self.opt.save_edge_img steps because of computational speed
-        if result.sum() > 0 and batch_idx % self.opt.save_plot_every  == 0 and scale ==0:
-
-            # print("SAVEEUU")
-
-            fig, ax = plt.subplots(6, 1, figsize=(12, 12))
-
-            # 2, 192, 640, 3
-            ax[0].imshow(original_img)
-            ax[0].title.set_text('Original image')
-            ax[0].axis('off')
-            #
-            # # 2, 192, 640
-            ax[1].imshow(disp)
-            ax[1].title.set_text('disp')
-            ax[1].axis('off')
-
-            # ax[2].imshow(original_attention.cpu()[batch][index_nrs_not_overlapping[batch][attention]], cmap='cividis')
-            # ax[2].title.set_text('Original attention mask')
-            # ax[2].axis('off')
-
-            # # #2, 1, 192, 640
-            ax[2].imshow(attention_mask.cpu(), cmap='cividis')
-            ax[2].title.set_text('Casted attention mask')
-            ax[2].axis('off')
-
-            ax[3].imshow(depth_mask, vmin =disp_min, vmax=disp_max)
-            ax[3].title.set_text('depth mask')
-            ax[3].axis('off')
-
-            ax[4].imshow(edges_disp)
-            ax[4].title.set_text('Edges disp before erosion')
-            ax[4].axis('off')
-
-            ax[5].imshow(result)
-            ax[5].title.set_text('Edges disp after erosion')
-            ax[5].axis('off')
-
-            # plt.show()
-
-            fig.savefig('{}/epoch_{}_batchIDX_{}_result_{}_threshold_{}.png'.format(path, self.epoch, batch_idx, result.sum()/255, self.opt.edge_detection_threshold))
-            plt.close()
-
-
-        if result.sum() > 0:
-            edge_loss.append(result.sum())
-
-        edge_loss = torch.FloatTensor(edge_loss).to(self.device)
-
-
-        # divide by 255 because 1 pixels should have value 1 not 255
-        loss = torch.mean(edge_loss)/255
-
-
-        if torch.isnan(loss):
-            loss = 0
-
-        return loss
-
-
     def attention_depth_loss(self, scale, outputs, inputs):
 
         start = time.time()
@@ -788,6 +633,11 @@ class Trainer:
         """Generate the warped (reprojected) color images for a minibatch.
         Generated images are saved into the `outputs` dictionary.
         """
+        frame_ids = self.opt.frame_ids[1:]
+
+        # the source images stacked along a frame dimension, per source scale
+        source_images = {}
+
         for scale in self.opt.scales:
             disp = outputs[("disp", scale)]
             if self.opt.v1_multiscale:
@@ -802,7 +652,8 @@ class Trainer:
 
             outputs[("depth", 0, scale)] = depth
 
-            for i, frame_id in enumerate(self.opt.frame_ids[1:]):
+            Ts = []
+            for frame_id in frame_ids:
 
                 if frame_id == "s":
                     T = inputs["stereo_T"]
@@ -810,6 +661,7 @@ class Trainer:
                     T = outputs[("cam_T_cam", 0, frame_id)]
 
                 # from the authors of https://arxiv.org/abs/1712.00175
+                # FALSE
                 if self.opt.pose_model_type == "posecnn":
 
                     axisangle = outputs[("axisangle", 0, frame_id)]
@@ -821,62 +673,68 @@ class Trainer:
                     T = transformation_from_parameters(
                         axisangle[:, 0], translation[:, 0] * mean_inv_depth[:, 0], frame_id < 0)
 
-                cam_points = self.backproject_depth[source_scale](
-                    depth, inputs[("inv_K", source_scale)])
-                pix_coords = self.project_3d[source_scale](
-                    cam_points, inputs[("K", source_scale)], T)
+                Ts.append(T)
+
+            # depth and inv_K don't depend on the source frame, so the depth is backprojected once
+            # and projected into all source frames at once
+            cam_points = self.backproject_depth[source_scale](
+                depth, inputs[("inv_K", source_scale)])
+            pix_coords = self.project_3d[source_scale](
+                cam_points, inputs[("K", source_scale)], torch.stack(Ts, 1))
+
+            if source_scale not in source_images:
+                source_images[source_scale] = torch.stack(
+                    [inputs[("color", frame_id, source_scale)] for frame_id in frame_ids], 1)
 
-                outputs[("sample", frame_id, scale)] = pix_coords
+            # one grid_sample over the batch of all source frames
+            colors = F.grid_sample(
+                source_images[source_scale].flatten(0, 1),
+                pix_coords.flatten(0, 1),
+                padding_mode="border")
+            colors = colors.view(pix_coords.shape[:2] + colors.shape[1:])
 
-                outputs[("color", frame_id, scale)] = F.grid_sample(
-                    inputs[("color", frame_id, source_scale)],
-                    outputs[("sample", frame_id, scale)],
-                    padding_mode="border")
+            for i, frame_id in enumerate(frame_ids):
+                outputs[("sample", frame_id, scale)] = pix_coords[:, i]
+                outputs[("color", frame_id, scale)] = colors[:, i]
 
                 if not self.opt.disable_automasking:
                     outputs[("color_identity", frame_id, scale)] = \
                         inputs[("color", frame_id, source_scale)]
 
-    def compute_reprojection_loss(self, pred, target):
-        """Computes reprojection loss between a batch of predicted and target images
+    def compute_reprojection_losses(self, preds, target, target_statistics=None):
+        """Computes the reprojection losses of a list of predicted images against the same target at once.
+        Returns (batch, len(preds), height, width): per pred the 0.85 SSIM + 0.15 L1 loss averaged over the channels
         """
-        abs_diff = torch.abs(target - pred)
-        l1_loss = abs_diff.mean(1, True)
+        preds = torch.stack(preds, 1)
+
+        abs_diff = torch.abs(target.unsqueeze(1) - preds)
+        l1_loss = abs_diff.mean(2)
 
         if self.opt.no_ssim:
             reprojection_loss = l1_loss
         else:
-            ssim_loss = self.ssim(pred, target).mean(1, True)
+            ssim_loss = self.ssim(preds, target, target_statistics).mean(2)
             reprojection_loss = 0.85 * ssim_loss + 0.15 * l1_loss
 
         return reprojection_loss
 
+    def compute_identity_reprojection_loss(self, inputs, source_scale, target, target_statistics=None):
+        """Reprojection loss of the unwarped source images against the target, with random numbers to break ties
+        with the reprojection losses
+        """
+        # calculate here the reprojection error with the original source images
+        identity_reprojection_losses = self.compute_reprojection_losses(
+            [inputs[("color", frame_id, source_scale)] for frame_id in self.opt.frame_ids[1:]],
+            target, target_statistics)
 
-    def plot_attention_masks(self, inputs, batch_idx):
-
-        path = self.opt.log_dir + self.opt.model_name + "/" + "weight_matrix_img/"
-        if not os.path.exists(path):
-            os.makedirs(path)
-
-        for b in range(self.opt.batch_size):
-            original_img = inputs["color_aug", 0, 0][b]
-
-            original_img = np.array(original_img.cpu().detach().numpy())
-
-            original_img = np.swapaxes(original_img, 0, 1)
-            original_img = np.swapaxes(original_img, 1, 2)
-
-            weight_mask = inputs['weight_matrix'][b].cpu()
-
-            fig, axis = plt.subplots(1, 2, figsize=(40, 5))
-
-            # create the heatmap
-            sns.heatmap(weight_mask, ax=axis[0], vmin=1, vmax=1.2, cmap='Greens', center=1)
+        if self.opt.avg_reprojection:
+            identity_reprojection_loss = identity_reprojection_losses.mean(1, keepdim=True)
+        else:
+            # save both images, and do min all at once below
+            identity_reprojection_loss = identity_reprojection_losses
 
-            # put the original rgb kitti image in the subplot
-            axis[1].imshow(original_img)
-            fig.savefig('{}/epoch_{}_batch_idx_{}_batch_{}.png'.format(path, self.epoch, batch_idx, b))
-            plt.close(fig)
+        return identity_reprojection_loss + torch.randn(
+            identity_reprojection_loss.shape, device=identity_reprojection_loss.device) * 0.00001
 
 
     def compute_losses(self, inputs, outputs, batch_idx):
@@ -889,7 +747,7 @@ class Trainer:
         else:
             original_masks = None
         if batch_idx % self.opt.save_plot_every == 0 and self.opt.attention_mask_loss and batch_idx != 0:
-            self.plot_attention_masks(inputs, batch_idx)
+            self.plot_service.submit(plot_attention_masks, self, plot_inputs(inputs), batch_idx)
 
 
 
@@ -919,20 +777,22 @@ class Trainer:
             # because you don't want overlapping masks for edge detection because you might find the same edge multiple times
             not_overlapping_attention_masks, index_numbers_not_overlapping = overlapping_masks_edge_detection(self, inputs, batch_idx, original_masks)
 
+            # the edge loss of every scale in one batched call on the gpu
+            edge_losses = edge_code.edge_detection_loss(self, outputs, inputs, not_overlapping_attention_masks, batch_idx, index_numbers_not_overlapping, original_masks)
+
 
         total_edge_loss = 0
         total_attention_weight_loss = 0
 
         # self.opt.scales = # help = "scales used in the loss", # default = [0, 1, 2, 3])
+        source_scale_cache = {}
+
         for scale in self.opt.scales:
             # print("HGFDS")
             # 1/0
             # print("scale", scale)
             loss = 0
             loss_without_mask = 0
-            reprojection_losses = []
-
-            # reprojection_losses_bob = []
 
             if self.opt.v1_multiscale:
                 source_scale = scale
@@ -944,24 +804,26 @@ class Trainer:
             target = inputs[("color", 0, source_scale)]
             # disp, color, target: torch.Size([1, 1, 192, 640]), torch.Size([1, 3, 192, 640]), torch.Size([1, 3, 192, 640])
 
-            predictions = []
-            for frame_id in self.opt.frame_ids[1:]:
-
-                # this function selects frame ID -1 and +1. 0 is the target image. So it creates two prediction images
-
-                pred = outputs[("color", frame_id, scale)]
-                predictions.append(pred)
-
+            # without v1_multiscale the source scale is 0 at every scale, so the target statistics and the
+            # identity losses are computed once per batch and reused
+            if source_scale not in source_scale_cache:
+                target_statistics = None if self.opt.no_ssim else self.ssim.target_statistics(target)
+                identity_reprojection_loss = None
+                if not self.opt.disable_automasking:
+                    identity_reprojection_loss = self.compute_identity_reprojection_loss(
+                        inputs, source_scale, target, target_statistics)
+                source_scale_cache[source_scale] = target_statistics, identity_reprojection_loss
 
-                start = time.time()
-                reprojection_losses.append(self.compute_reprojection_loss(pred, target))
+            target_statistics, identity_reprojection_loss = source_scale_cache[source_scale]
 
-            reprojection_losses = torch.cat(reprojection_losses, 1)
+            # frame ID -1 and +1 are warped to the target 0, all predictions are compared in one pass
+            predictions = [outputs[("color", frame_id, scale)] for frame_id in self.opt.frame_ids[1:]]
+            reprojection_losses = self.compute_reprojection_losses(predictions, target, target_statistics)
 
             if self.opt.edge_loss:
 
                 # start = time.time()
-                edge_loss = self.edge_detection_loss(scale, outputs, inputs, not_overlapping_attention_masks, batch_idx, index_numbers_not_overlapping, original_masks)
+                edge_loss = edge_losses[scale]
 
                 loss += self.opt.edge_weight * edge_loss / (2 ** scale)
 
@@ -972,30 +834,8 @@ class Trainer:
 
 
 
-            # this statement is performed
-            if not self.opt.disable_automasking:
-                # print("ik kom hieraan")
-                identity_reprojection_losses = []
-                for frame_id in self.opt.frame_ids[1:]:
-
-                    # calculate here the reprojection error with the original source images
-                    pred = inputs[("color", frame_id, source_scale)]
-                    # print("ANDERE LOSS REPRONECTION")
-                    identity_reprojection_losses.append(
-                        self.compute_reprojection_loss(pred, target))
-
-                identity_reprojection_losses = torch.cat(identity_reprojection_losses, 1)
-
-
-                if self.opt.avg_reprojection:
-                    identity_reprojection_loss = identity_reprojection_losses.mean(1, keepdim=True)
-                else:
-                    # save both images, and do min all at once below
-                    identity_reprojection_loss = identity_reprojection_losses
-
-
             # FALSE
-            elif self.opt.predictive_mask:
+            if self.opt.disable_automasking and self.opt.predictive_mask:
                 # use the predicted mask
                 mask = outputs["predictive_mask"]["disp", scale]
                 if not self.opt.v1_multiscale:
@@ -1018,11 +858,6 @@ class Trainer:
             # This one is performed
             if not self.opt.disable_automasking:
                 # print("AUTOMASKING")
-                # add random numbers to break ties
-                identity_reprojection_loss += torch.randn(
-                    identity_reprojection_loss.shape).to('cpu' if self.opt.no_cuda else 'cuda') * 0.00001
-
-
                 combined = torch.cat((identity_reprojection_loss, reprojection_loss), dim=1)
 
             else:
@@ -1144,8 +979,8 @@ class Trainer:
         for i, metric in enumerate(self.depth_metric_names):
             losses[metric] = np.array(depth_errors[i].cpu())
 
-    def log_time(self, batch_idx, duration, loss):
-        """Print a logging statement to the terminal
+    def log_time(self, batch_idx, duration, loss, losses):
+        """Print a logging statement to the terminal and add a record to the metrics log
         """
         samples_per_sec = self.opt.batch_size / duration
         time_sofar = time.time() - self.start_time
@@ -1157,24 +992,10 @@ class Trainer:
                                   sec_to_hm_str(time_sofar), sec_to_hm_str(training_time_left)))
 
 
-        print_string = ("epoch {:>3} | batch {:>6} | examples/s: {:5.1f}" + \
-            " | loss: {:.5f} | time elapsed: {} | time left: {}").format(self.epoch, batch_idx, samples_per_sec, loss,
-                                  sec_to_hm_str(time_sofar), sec_to_hm_str(training_time_left))
-        current_log = [item.replace('\n', '') for item in open('output_during_training.txt').readlines()]
-        current_log.append(print_string)
-
-        with open('output_during_training.txt', 'w') as file:
-            file.write('\n'.join(current_log))
-
-        # with open('output_during_training.txt', 'r') as file:
-        #     content = file
-        #     print('content', content)
-            # content = '\n'.join(file.readlines())
-            # file.write(content + '\n' + print_string)
-
-        # with open("output_during_training.txt", "w") as text_file:
-        #     text_file.write( print_string + "\n")
-
+        record = {"step": self.step, "epoch": self.epoch, "batch_idx": batch_idx, "examples_per_sec": samples_per_sec,
+                  "time_step": duration, "time_elapsed": time_sofar}
+        record.update(losses)
+        self.metrics_log.write(record)
 
     def log(self, mode, inputs, outputs, losses):
         """Write an event to the tensorboard events file
@@ -1192,32 +1013,7 @@ class Trainer:
         for l, v in losses.items():
             writer.add_scalar("{}".format(l), v, self.step)
 
-        for j in range(min(4, self.opt.batch_size)):  # write a maxmimum of four images
-            for s in self.opt.scales:
-                for frame_id in self.opt.frame_ids:
-                    writer.add_image(
-                        "color_{}_{}/{}".format(frame_id, s, j),
-                        inputs[("color", frame_id, s)][j].data, self.step)
-                    if s == 0 and frame_id != 0:
-                        writer.add_image(
-                            "color_pred_{}_{}/{}".format(frame_id, s, j),
-                            outputs[("color", frame_id, s)][j].data, self.step)
-
-                writer.add_image(
-                    "disp_{}/{}".format(s, j),
-                    normalize_image(outputs[("disp", s)][j]), self.step)
-
-                if self.opt.predictive_mask:
-                    for f_idx, frame_id in enumerate(self.opt.frame_ids[1:]):
-                        writer.add_image(
-                            "predictive_mask_{}_{}/{}".format(frame_id, s, j),
-                            outputs["predictive_mask"][("disp", s)][j, f_idx][None, ...],
-                            self.step)
-
-                elif not self.opt.disable_automasking:
-                    writer.add_image(
-                        "automask_{}/{}".format(s, j),
-                        outputs["identity_selection/{}".format(s)][j][None, ...], self.step)
+        self.image_log_writer.submit(mode, inputs, outputs, self.step)
 
     def save_opts(self):
         """Save options to disk so we know what we ran this experiment with
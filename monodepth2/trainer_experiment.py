@@ -50,6 +50,13 @@ from attention_mask_loss import *
 from attention_weight_mask import *
 from self_attention_util import *
 from edge_code import edge_detection_bob_hidde
+from plot_service import PlotService, plot_inputs
+from metrics_log import MetricsLog
+from image_log_writer import ImageLogWriter
+from step_timer import StepTimer
+from datasets.attention_masks import unpack_attention_masks, collate_attention_masks, pad_attention_masks
+from pre_process_weight_matrix import weight_matrix_from_masks
+from pre_process_weight_matrix import calculate_weight_per_mask as calculate_weight_per_mask_for_weight_matrix
 # import edge_code as edge_code
 
 import pickle
@@ -62,6 +69,9 @@ class Trainer:
         self.opt = options
         self.log_path = os.path.join(self.opt.log_dir, self.opt.model_name)
 
+        self.plot_service = PlotService(self.opt.async_plots, self.opt.plot_queue_size)
+        self.metrics_log = MetricsLog(os.path.join(self.log_path, "metrics.jsonl"), self.opt.metrics_flush_every)
+
         torch.manual_seed(self.opt.seed)
         torch.cuda.manual_seed(self.opt.seed)
         torch.cuda.manual_seed_all(self.opt.seed)
@@ -78,6 +88,9 @@ class Trainer:
 
         self.device = torch.device("cpu" if self.opt.no_cuda else "cuda")
 
+        self.step_timer = StepTimer(self.opt.time_stages, self.device, self.opt.profile_start_step,
+                                    self.opt.profile_steps, os.path.join(self.log_path, "profile"))
+
 
         self.num_scales = len(self.opt.scales)
         self.num_input_frames = len(self.opt.frame_ids)
@@ -181,6 +194,9 @@ class Trainer:
 
         img_ext = '.png' if self.opt.png else '.jpg'
 
+        # with ragged attention masks every sample has its own amount of masks, so they can't be stacked
+        collate_fn = collate_attention_masks if self.opt.ragged_attention_masks else None
+
         num_train_samples = len(train_filenames)
         self.num_total_steps = num_train_samples // self.opt.batch_size * self.opt.num_epochs
 
@@ -189,11 +205,17 @@ class Trainer:
             self.opt.seed, self.opt.weight_mask_method, self.opt.weight_matrix_path, self.opt.attention_mask_loss, self.opt.edge_loss,
             self.opt.data_path, self.opt.attention_path, self.opt.attention_threshold, train_filenames, self.opt.height,
             self.opt.width,
-            self.opt.frame_ids, 4, is_train=True, img_ext=img_ext)
+            self.opt.frame_ids, 4, is_train=True, img_ext=img_ext,
+            attention_shard_path=self.opt.attention_shard_path,
+            pack_attention_masks=self.opt.pack_attention_masks,
+            ragged_attention_masks=self.opt.ragged_attention_masks,
+            attention_index_path=self.opt.attention_index_path,
+            weight_matrix_store_path=self.opt.weight_matrix_store,
+            weight_matrix_on_the_fly=self.opt.weight_matrix_on_the_fly)
 
         self.train_loader = DataLoader(
             train_dataset, self.opt.batch_size, True,
-            num_workers=self.opt.num_workers, pin_memory=True, drop_last=True)
+            num_workers=self.opt.num_workers, pin_memory=True, drop_last=True, collate_fn=collate_fn)
 
         val_dataset = self.dataset(
             self.opt.convolution_experiment,
@@ -212,10 +234,16 @@ class Trainer:
             self.opt.frame_ids,
             4,
             is_train=False,
-            img_ext=img_ext)
+            img_ext=img_ext,
+            attention_shard_path=self.opt.attention_shard_path,
+            pack_attention_masks=self.opt.pack_attention_masks,
+            ragged_attention_masks=self.opt.ragged_attention_masks,
+            attention_index_path=self.opt.attention_index_path,
+            weight_matrix_store_path=self.opt.weight_matrix_store,
+            weight_matrix_on_the_fly=self.opt.weight_matrix_on_the_fly)
         self.val_loader = DataLoader(
             val_dataset, self.opt.batch_size, True,
-            num_workers=self.opt.num_workers, pin_memory=True, drop_last=True)
+            num_workers=self.opt.num_workers, pin_memory=True, drop_last=True, collate_fn=collate_fn)
 
         self.val_iter = iter(self.val_loader)
 
@@ -237,10 +265,16 @@ class Trainer:
             self.opt.frame_ids,
             4,
             is_train=False,
-            img_ext=img_ext)
+            img_ext=img_ext,
+            attention_shard_path=self.opt.attention_shard_path,
+            pack_attention_masks=self.opt.pack_attention_masks,
+            ragged_attention_masks=self.opt.ragged_attention_masks,
+            attention_index_path=self.opt.attention_index_path,
+            weight_matrix_store_path=self.opt.weight_matrix_store,
+            weight_matrix_on_the_fly=self.opt.weight_matrix_on_the_fly)
         self.test_loader = DataLoader(
             test_dataset, self.opt.batch_size, True,
-            num_workers=self.opt.num_workers, pin_memory=True, drop_last=True)
+            num_workers=self.opt.num_workers, pin_memory=True, drop_last=True, collate_fn=collate_fn)
 
         self.test_iter = iter(self.test_loader)
         #
@@ -263,6 +297,7 @@ class Trainer:
         self.writers = {}
         for mode in ["train", "val"]:
             self.writers[mode] = SummaryWriter(os.path.join(self.log_path, mode))
+        self.image_log_writer = ImageLogWriter(self.opt, self.writers)
 
         if not self.opt.no_ssim:
             self.ssim = SSIM()
@@ -310,12 +345,18 @@ class Trainer:
         self.epoch = 0
         self.step = 0
         self.start_time = time.time()
-        for self.epoch in range(self.opt.num_epochs):
-            message = self.run_epoch()
-            if message == "stop":
-                return "stop"
-            # if (self.epoch + 1) % self.opt.save_frequency == 0:
-            self.save_model(batch_idx = 9999)
+        try:
+            for self.epoch in range(self.opt.num_epochs):
+                message = self.run_epoch()
+                if message == "stop":
+                    return "stop"
+                # if (self.epoch + 1) % self.opt.save_frequency == 0:
+                self.save_model(batch_idx = 9999)
+        finally:
+            self.plot_service.close()
+            self.metrics_log.close()
+            self.image_log_writer.close()
+            self.step_timer.close()
 
     def early_stopping_check(self, batch_idx):
 
@@ -342,6 +383,7 @@ class Trainer:
 
         # self.pose_depth_info = {}
 
+        data_start_time = time.time()
         for batch_idx, inputs in enumerate(self.train_loader):
 
             # print("IDX ", batch_idx)
@@ -356,12 +398,18 @@ class Trainer:
             # print(inputs.shape)
 
             before_op_time = time.time()
+            data_duration = before_op_time - data_start_time
+            self.step_timer.add("data", data_duration)
+            self.step_timer.start()
 
             outputs, losses = self.process_batch(inputs, batch_idx)
 
             self.model_optimizer.zero_grad()
             losses["loss"].backward()
+            self.step_timer.lap("backward")
             self.model_optimizer.step()
+            self.step_timer.lap("optimizer")
+            self.step_timer.stop()
 
             duration = time.time() - before_op_time
 
@@ -370,7 +418,8 @@ class Trainer:
             late_phase = self.step % 2000 == 0
 
             if early_phase or late_phase:
-                self.log_time(batch_idx, duration, losses["loss"].cpu().data)
+                log_start_time = self.step_timer.now()
+                self.log_time(batch_idx, duration, losses["loss"].cpu().data, losses, data_duration)
 
                 if "depth_gt" in inputs:
                     self.compute_depth_losses(inputs, outputs, losses)
@@ -384,8 +433,11 @@ class Trainer:
                     if message == "stop":
                         return "stop"
                 # print("vall loss", self.val_losses)
+                self.step_timer.add("log", self.step_timer.now() - log_start_time)
 
+            self.step_timer.step()
             self.step += 1
+            data_start_time = time.time()
 
 
 
@@ -395,6 +447,13 @@ class Trainer:
         for key, ipt in inputs.items():
             inputs[key] = ipt.to(self.device)
 
+        if self.opt.pack_attention_masks and "attention" in inputs:
+            inputs["attention"] = unpack_attention_masks(inputs["attention"], self.opt.width)
+
+        if self.opt.weight_matrix_on_the_fly:
+            inputs["weight_matrix"] = self.compute_weight_matrix(inputs)
+        self.step_timer.lap("inputs")
+
         # breakpoint()
 
         # NO
@@ -436,7 +495,10 @@ class Trainer:
                 outputs = self.models["depth"](features, attention_maps)
 
                 if batch_idx % self.opt.save_plot_every == 0:
-                    save_self_attention_masks(inputs, outputs, batch_idx, self.epoch, self.opt.model_name, self.opt.log_dir)
+                    with self.step_timer.region("plot"):
+                        self.plot_service.submit(save_self_attention_masks, plot_inputs(inputs, 1),
+                                                 {'self_attention_maps': [outputs['self_attention_maps'][0]]},
+                                                 batch_idx, self.epoch, self.opt.model_name, self.opt.log_dir)
 
             else:
 
@@ -445,13 +507,17 @@ class Trainer:
         # FALSE
         if self.opt.predictive_mask:
             outputs["predictive_mask"] = self.models["predictive_mask"](features)
+        self.step_timer.lap("depth")
 
         # TRUE
         if self.use_pose_net:
             outputs.update(self.predict_poses(inputs, features, batch_idx))
+        self.step_timer.lap("pose")
 
         self.generate_images_pred(inputs, outputs, batch_idx)
+        self.step_timer.lap("generate_images_pred")
         losses = self.compute_losses(inputs, outputs, batch_idx)
+        self.step_timer.lap("losses")
 
         return outputs, losses
 
@@ -473,34 +539,32 @@ class Trainer:
             else:
                 pose_feats = {f_i: inputs["color_aug", f_i, 0] for f_i in self.opt.frame_ids}
 
-            for f_i in self.opt.frame_ids[1:]:
-                if f_i != "s":
-                    # To maintain ordering we always pass frames in temporal order
-                    if f_i < 0:
-                        pose_inputs = [pose_feats[f_i], pose_feats[0]]
-                    else:
-                        pose_inputs = [pose_feats[0], pose_feats[f_i]]
+            # To maintain ordering we always pass frames in temporal order
+            source_frame_ids = [f_i for f_i in self.opt.frame_ids[1:] if f_i != "s"]
+            pairs = [[pose_feats[f_i], pose_feats[0]] if f_i < 0 else [pose_feats[0], pose_feats[f_i]]
+                     for f_i in source_frame_ids]
 
-                    # breakpoint()
-                    if self.opt.pose_model_type == "separate_resnet":
-                        pose_inputs = [self.models["pose_encoder"](torch.cat(pose_inputs, 1))]
-                    elif self.opt.pose_model_type == "posecnn":
-                        pose_inputs = torch.cat(pose_inputs, 1)
+            if self.opt.pose_model_type in ["separate_resnet", "posecnn"]:
+                # the pairs of all source frames are stacked along the batch, such that the pose network
+                # runs once at batch size B * len(source_frame_ids) instead of once per source frame
+                pose_inputs = torch.cat([torch.cat(pair, 1) for pair in pairs], 0)
 
-                    axisangle, translation = self.models["pose"](pose_inputs)
+                if self.opt.pose_model_type == "separate_resnet":
+                    pose_inputs = [self.models["pose_encoder"](pose_inputs)]
 
-                    # self.pose_depth_info[str(batch_idx) + 'axisangle'] = axisangle.reshape(6)
-                    # self.pose_depth_info[str(batch_idx) + 'translation'] = translation.reshape(6)
+                axisangle, translation = self.models["pose"](pose_inputs)
+                poses = zip(axisangle.chunk(len(pairs), 0), translation.chunk(len(pairs), 0))
 
-                    outputs[("axisangle", 0, f_i)] = axisangle
-                    outputs[("translation", 0, f_i)] = translation
+            else:
+                poses = [self.models["pose"](pair) for pair in pairs]
 
-                    # breakpoint()
+            for f_i, (axisangle, translation) in zip(source_frame_ids, poses):
+                outputs[("axisangle", 0, f_i)] = axisangle
+                outputs[("translation", 0, f_i)] = translation
 
-                    # Invert the matrix if the frame id is negative
-                    # select the first 3 axis angle and trans params
-                    outputs[("cam_T_cam", 0, f_i)] = transformation_from_parameters(
-                        axisangle[:, 0], translation[:, 0], invert=(f_i < 0))
+                # Invert the matrix if the frame id is negative
+                outputs[("cam_T_cam", 0, f_i)] = transformation_from_parameters(
+                    axisangle[:, 0], translation[:, 0], invert=(f_i < 0))
 
         else:
             # Here we input all frames to the pose net (and predict all poses) together
@@ -660,36 +724,15 @@ class Trainer:
         self.set_train()
         return val_loss
 
-    def plot_attention_masks(self, inputs, batch_idx):
-
-        path = self.opt.log_dir + self.opt.model_name + "/" + "weight_matrix_img/"
-        if not os.path.exists(path):
-            os.makedirs(path)
-
-        for b in range(self.opt.batch_size):
-            original_img = inputs["color_aug", 0, 0][b]
-
-            original_img = np.array(original_img.cpu().detach().numpy())
-
-            original_img = np.swapaxes(original_img, 0, 1)
-            original_img = np.swapaxes(original_img, 1, 2)
-
-            weight_mask = inputs['weight_matrix'][b].cpu()
-
-            fig, axis = plt.subplots(1, 2, figsize=(40, 5))
-
-            # create the heatmap
-            sns.heatmap(weight_mask, ax=axis[0], vmin=1, vmax=1.2, cmap='Greens', center=1)
-
-            # put the original rgb kitti image in the subplot
-            axis[1].imshow(original_img)
-            fig.savefig('{}/epoch_{}_batch_idx_{}_batch_{}.png'.format(path, self.epoch, batch_idx, b))
-            plt.close(fig)
-
     def generate_images_pred(self, inputs, outputs, batch_idx):
         """Generate the warped (reprojected) color images for a minibatch.
         Generated images are saved into the `outputs` dictionary.
         """
+        frame_ids = self.opt.frame_ids[1:]
+
+        # the source images stacked along a frame dimension, per source scale
+        source_images = {}
+
         for scale in self.opt.scales:
             disp = outputs[("disp", scale)]
             if self.opt.v1_multiscale:
@@ -703,21 +746,15 @@ class Trainer:
 
             outputs[("depth", 0, scale)] = depth
 
-            for i, frame_id in enumerate(self.opt.frame_ids[1:]):
+            Ts = []
+            for frame_id in frame_ids:
 
                 if frame_id == "s":
                     T = inputs["stereo_T"]
                 else:
                     T = outputs[("cam_T_cam", 0, frame_id)]
 
-                    # self.pose_depth_info[str(batch_idx) + 'T'] = T[0]
-
-
-                # breakpoint()
-
                 # from the authors of https://arxiv.org/abs/1712.00175
-                # breakpoint()
-
                 # FALSE
                 if self.opt.pose_model_type == "posecnn":
 
@@ -730,37 +767,79 @@ class Trainer:
                     T = transformation_from_parameters(
                         axisangle[:, 0], translation[:, 0] * mean_inv_depth[:, 0], frame_id < 0)
 
+                Ts.append(T)
 
-                cam_points = self.backproject_depth[source_scale](
-                    depth, inputs[("inv_K", source_scale)])
-                pix_coords = self.project_3d[source_scale](
-                    cam_points, inputs[("K", source_scale)], T)
+            # depth and inv_K don't depend on the source frame, so the depth is backprojected once
+            # and projected into all source frames at once
+            cam_points = self.backproject_depth[source_scale](
+                depth, inputs[("inv_K", source_scale)])
+            pix_coords = self.project_3d[source_scale](
+                cam_points, inputs[("K", source_scale)], torch.stack(Ts, 1))
 
-                outputs[("sample", frame_id, scale)] = pix_coords
+            if source_scale not in source_images:
+                source_images[source_scale] = torch.stack(
+                    [inputs[("color", frame_id, source_scale)] for frame_id in frame_ids], 1)
 
-                outputs[("color", frame_id, scale)] = F.grid_sample(
-                    inputs[("color", frame_id, source_scale)],
-                    outputs[("sample", frame_id, scale)],
-                    padding_mode="border")
+            # one grid_sample over the batch of all source frames
+            colors = F.grid_sample(
+                source_images[source_scale].flatten(0, 1),
+                pix_coords.flatten(0, 1),
+                padding_mode="border")
+            colors = colors.view(pix_coords.shape[:2] + colors.shape[1:])
+
+            for i, frame_id in enumerate(frame_ids):
+                outputs[("sample", frame_id, scale)] = pix_coords[:, i]
+                outputs[("color", frame_id, scale)] = colors[:, i]
 
                 if not self.opt.disable_automasking:
                     outputs[("color_identity", frame_id, scale)] = \
                         inputs[("color", frame_id, source_scale)]
 
-    def compute_reprojection_loss(self, pred, target):
-        """Computes reprojection loss between a batch of predicted and target images
+    def compute_reprojection_losses(self, preds, target, target_statistics=None):
+        """Computes the reprojection losses of a list of predicted images against the same target at once.
+        Returns (batch, len(preds), height, width): per pred the 0.85 SSIM + 0.15 L1 loss averaged over the channels
         """
-        abs_diff = torch.abs(target - pred)
-        l1_loss = abs_diff.mean(1, True)
+        preds = torch.stack(preds, 1)
+
+        abs_diff = torch.abs(target.unsqueeze(1) - preds)
+        l1_loss = abs_diff.mean(2)
 
         if self.opt.no_ssim:
             reprojection_loss = l1_loss
         else:
-            ssim_loss = self.ssim(pred, target).mean(1, True)
+            ssim_loss = self.ssim(preds, target, target_statistics).mean(2)
             reprojection_loss = 0.85 * ssim_loss + 0.15 * l1_loss
 
         return reprojection_loss
 
+    def compute_identity_reprojection_loss(self, inputs, source_scale, target, target_statistics=None):
+        """Reprojection loss of the unwarped source images against the target, with random numbers to break ties
+        with the reprojection losses
+        """
+        identity_reprojection_losses = self.compute_reprojection_losses(
+            [inputs[("color", frame_id, source_scale)] for frame_id in self.opt.frame_ids[1:]],
+            target, target_statistics)
+
+        if self.opt.avg_reprojection:
+            identity_reprojection_loss = identity_reprojection_losses.mean(1, keepdim=True)
+        else:
+            # save both images, and do min all at once below
+            identity_reprojection_loss = identity_reprojection_losses
+
+        return identity_reprojection_loss + torch.randn(
+            identity_reprojection_loss.shape, device=identity_reprojection_loss.device) * 0.00001
+
+    def compute_weight_matrix(self, inputs):
+        """Compute the (batch, 192, 640) weight matrix from the attention masks of the batch on the training device,
+        the same as pre_process_weight_matrix.py does per kitti image
+        """
+        # zero padded masks get a weight of 0 and don't change the weight matrix
+        attention_masks = (pad_attention_masks(inputs) >= 0.8).to(torch.float32)
+
+        weight_per_mask = calculate_weight_per_mask_for_weight_matrix(attention_masks, self.opt.attention_threshold)
+
+        return weight_matrix_from_masks(attention_masks, weight_per_mask, self.opt.weight_mask_method)
+
     def prepare_attention_masks(self, inputs):
 
         attention_mask_weight = inputs['weight_matrix'].to(self.device).clone()
@@ -828,7 +907,8 @@ class Trainer:
         total_edge_loss = 0
         total_attention_weight_loss = 0
 
-        _, original_attention_masks, loss_inside_mask_tensor, loss_inside_mask_tensor_dialation_1, loss_inside_mask_tensor_dialation_3, amount_pixels_inside_mask= self.prepare_attention_masks(inputs)
+        with self.step_timer.region("attention_masks"):
+            _, original_attention_masks, loss_inside_mask_tensor, loss_inside_mask_tensor_dialation_1, loss_inside_mask_tensor_dialation_3, amount_pixels_inside_mask= self.prepare_attention_masks(inputs)
 
 
         # first determine if you need to calculate the attention mask loss. Then you only have to do this once.
@@ -836,7 +916,8 @@ class Trainer:
         # batch size , 192, 640
         if self.opt.attention_mask_loss == True:
 
-            attention_mask_weight, original_attention_masks, loss_inside_mask_tensor, loss_inside_mask_tensor_dialation_1, loss_inside_mask_tensor_dialation_3, amount_pixels_inside_mask = self.prepare_attention_masks(inputs)
+            with self.step_timer.region("attention_masks"):
+                attention_mask_weight, original_attention_masks, loss_inside_mask_tensor, loss_inside_mask_tensor_dialation_1, loss_inside_mask_tensor_dialation_3, amount_pixels_inside_mask = self.prepare_attention_masks(inputs)
 
         else:
             attention_mask_weight = torch.ones(size=(self.opt.batch_size, 1, self.opt.height, self.opt.width)).to(
@@ -850,6 +931,8 @@ class Trainer:
             # because you don't want overlapping masks for edge detection because you might find the same edge multiple times
             # not_overlapping_attention_masks, index_numbers_not_overlapping = overlapping_masks_edge_detection(self, inputs, batch_idx, original_masks)
 
+        source_scale_cache = {}
+
         for scale in self.opt.scales:
             loss = 0
             loss_without_edge = 0
@@ -857,7 +940,6 @@ class Trainer:
             loss_within_mask = 0
             loss_within_mask_dialation_1 = 0
             loss_within_mask_dialation_3 = 0
-            reprojection_losses = []
 
             if self.opt.v1_multiscale:
                 source_scale = scale
@@ -871,14 +953,20 @@ class Trainer:
             color = inputs[("color", 0, scale)]
             target = inputs[("color", 0, source_scale)]
 
-            for frame_id in self.opt.frame_ids[1:]:
-
-                pred = outputs[("color", frame_id, scale)]
+            # without v1_multiscale the source scale is 0 at every scale, so the target statistics and the
+            # identity losses are computed once per batch and reused
+            if source_scale not in source_scale_cache:
+                target_statistics = None if self.opt.no_ssim else self.ssim.target_statistics(target)
+                identity_reprojection_loss = None
+                if not self.opt.disable_automasking:
+                    identity_reprojection_loss = self.compute_identity_reprojection_loss(
+                        inputs, source_scale, target, target_statistics)
+                source_scale_cache[source_scale] = target_statistics, identity_reprojection_loss
 
-                # print("PRED TARGET", pred.shape, target.shape)
-                reprojection_losses.append(self.compute_reprojection_loss(pred, target))
+            target_statistics, identity_reprojection_loss = source_scale_cache[source_scale]
 
-            reprojection_losses = torch.cat(reprojection_losses, 1)
+            reprojection_losses = self.compute_reprojection_losses(
+                [outputs[("color", frame_id, scale)] for frame_id in self.opt.frame_ids[1:]], target, target_statistics)
 
             # if scale == 0 and batch_idx % self.opt.save_plot_every == 0:
             #     plot_tensor_begin_training(self, inputs, outputs, batch_idx, scale, reprojection_losses)
@@ -887,7 +975,8 @@ class Trainer:
 
                 if scale == 0:
 
-                    edge_loss = edge_detection_bob_hidde(scale, outputs, inputs, batch_idx, self.device, self.opt.height, self.opt.width, self.opt.log_dir, self.opt.model_name, self.opt.edge_detection_threshold, self.opt.save_plot_every, self.opt.batch_size).to(self.device)
+                    with self.step_timer.region("edge_loss"):
+                        edge_loss = edge_detection_bob_hidde(scale, outputs, inputs, batch_idx, self.device, self.opt.height, self.opt.width, self.opt.log_dir, self.opt.model_name, self.opt.edge_detection_threshold, self.opt.save_plot_every, self.opt.batch_size, self.plot_service).to(self.device)
 
                     loss += self.opt.edge_weight * edge_loss * self.num_scales
 
@@ -896,25 +985,8 @@ class Trainer:
                     # add for writing to tensorboard
                     losses["edge_loss/{}".format(scale)] = self.opt.edge_weight * edge_loss
 
-            # this statement is performed
-            if not self.opt.disable_automasking:
-                identity_reprojection_losses = []
-                for frame_id in self.opt.frame_ids[1:]:
-
-                    pred = inputs[("color", frame_id, source_scale)]
-                    identity_reprojection_losses.append(
-                        self.compute_reprojection_loss(pred, target))
-
-                identity_reprojection_losses = torch.cat(identity_reprojection_losses, 1)
-
-                if self.opt.avg_reprojection:
-                    identity_reprojection_loss = identity_reprojection_losses.mean(1, keepdim=True)
-                else:
-                    # save both images, and do min all at once below
-                    identity_reprojection_loss = identity_reprojection_losses
-
             # FALSE
-            elif self.opt.predictive_mask:
+            if self.opt.disable_automasking and self.opt.predictive_mask:
                 # use the predicted mask
                 mask = outputs["predictive_mask"]["disp", scale]
                 if not self.opt.v1_multiscale:
@@ -936,12 +1008,6 @@ class Trainer:
 
             # this one is performed
             if not self.opt.disable_automasking:
-                # add random numbers to break ties
-                identity_reprojection_loss += torch.randn(
-                    identity_reprojection_loss.shape).to(self.device) * 0.00001
-
-                # if self.opt.no_cuda cpu() else cuda()
-
                 combined = torch.cat((identity_reprojection_loss, reprojection_loss), dim=1)
             else:
                 combined = reprojection_loss
@@ -1024,8 +1090,11 @@ class Trainer:
 
 
                 if batch_idx % self.opt.save_plot_every == 0 and self.opt.attention_mask_loss and batch_idx != 0 and scale ==0:
-                    plot_loss_tensor(self, inputs, to_optimise, original_attention_masks, batch_idx, scale, idxs, identity_reprojection_loss,
-                                     loss_inside_mask_tensor, loss_inside_mask_tensor_dialation_1, loss_inside_mask_tensor_dialation_3)
+                    with self.step_timer.region("plot"):
+                        # only the first image of the batch is drawn
+                        self.plot_service.submit(plot_loss_tensor, self, plot_inputs(inputs, 1), to_optimise[:1], original_attention_masks[:1],
+                                                 batch_idx, scale, idxs[:1], identity_reprojection_loss[:1], loss_inside_mask_tensor[:1],
+                                                 loss_inside_mask_tensor_dialation_1[:1], loss_inside_mask_tensor_dialation_3[:1])
 
 
                 total_attention_weight_loss += (to_optimise * attention_mask_weight).mean() - to_optimise.mean()
@@ -1132,8 +1201,8 @@ class Trainer:
         for i, metric in enumerate(self.depth_metric_names):
             losses[metric] = np.array(depth_errors[i].cpu())
 
-    def log_time(self, batch_idx, duration, loss):
-        """Print a logging statement to the terminal
+    def log_time(self, batch_idx, duration, loss, losses, data_duration):
+        """Print a logging statement to the terminal and add a record to the metrics log
         """
         samples_per_sec = self.opt.batch_size / duration
         time_sofar = time.time() - self.start_time
@@ -1144,11 +1213,17 @@ class Trainer:
         print(print_string.format(self.epoch, batch_idx, samples_per_sec, loss,
                                   sec_to_hm_str(time_sofar), sec_to_hm_str(training_time_left)))
 
-        current_log = [item.replace('\n', '') for item in open('output_during_training.txt').readlines()]
-        current_log.append(print_string)
+        record = {"step": self.step, "epoch": self.epoch, "batch_idx": batch_idx, "examples_per_sec": samples_per_sec,
+                  "time_data": data_duration, "time_step": duration, "time_elapsed": time_sofar}
+        record.update(losses)
+
+        # percentiles of the time per stage since the last log, empty if --time_stages is not set
+        timings = self.step_timer.summary()
+        record.update(timings)
+        self.metrics_log.write(record)
 
-        with open('output_during_training.txt', 'w') as file:
-            file.write('\n'.join(current_log))
+        for name, value in timings.items():
+            self.writers["train"].add_scalar(name, value, self.step)
 
     def log(self, mode, inputs, outputs, losses):
         """Write an event to the tensorboard events file
@@ -1157,32 +1232,7 @@ class Trainer:
         for l, v in losses.items():
             writer.add_scalar("{}".format(l), v, self.step)
 
-        for j in range(min(4, self.opt.batch_size)):  # write a maxmimum of four images
-            for s in self.opt.scales:
-                for frame_id in self.opt.frame_ids:
-                    writer.add_image(
-                        "color_{}_{}/{}".format(frame_id, s, j),
-                        inputs[("color", frame_id, s)][j].data, self.step)
-                    if s == 0 and frame_id != 0:
-                        writer.add_image(
-                            "color_pred_{}_{}/{}".format(frame_id, s, j),
-                            outputs[("color", frame_id, s)][j].data, self.step)
-
-                writer.add_image(
-                    "disp_{}/{}".format(s, j),
-                    normalize_image(outputs[("disp", s)][j]), self.step)
-
-                if self.opt.predictive_mask:
-                    for f_idx, frame_id in enumerate(self.opt.frame_ids[1:]):
-                        writer.add_image(
-                            "predictive_mask_{}_{}/{}".format(frame_id, s, j),
-                            outputs["predictive_mask"][("disp", s)][j, f_idx][None, ...],
-                            self.step)
-
-                elif not self.opt.disable_automasking:
-                    writer.add_image(
-                        "automask_{}/{}".format(s, j),
-                        outputs["identity_selection/{}".format(s)][j][None, ...], self.step)
+        self.image_log_writer.submit(mode, inputs, outputs, self.step)
 
     def save_opts(self):
         """Save options to disk so we know what we ran this experiment with